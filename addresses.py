@@ -0,0 +1,91 @@
+# Module to turn ethereum addresses into compact interned 20-byte values
+
+import threading
+from typing import Dict
+
+
+# The number of bytes in an ethereum address
+ADDRESS_LENGTH = 20
+
+# The value used for a missing address, like the recipient of a contract creation
+EMPTY_ADDRESS = bytes(ADDRESS_LENGTH)
+
+# The dictionary that maps every address seen to its one shared bytes object
+_interned: Dict[bytes, bytes] = {EMPTY_ADDRESS: EMPTY_ADDRESS}
+
+# The lock protecting the interned addresses
+_interned_lock = threading.Lock()
+
+
+class InvalidAddress(ValueError):
+  """Exception raised when an address given by a user is not a valid ethereum address"""
+
+
+def intern(value: bytes) -> bytes:
+  """Function to get the shared bytes object of an address, so equal addresses are the same object"""
+
+  # Pads the value in case trailing zero bytes were stripped (numpy does this for "S20" columns)
+  value = value.ljust(ADDRESS_LENGTH, b"\0")
+
+  # Returns the shared object if the address has been seen already
+  interned = _interned.get(value)
+  if interned is not None:
+    return interned
+
+  with _interned_lock:
+    return _interned.setdefault(value, value)
+
+
+def normalize(address) -> bytes:
+  """Function to turn a hex address (checksummed or not) into its interned 20-byte value"""
+
+  # Returns the address as it is if it is already bytes
+  if isinstance(address, bytes):
+    return intern(address)
+
+  # Removes the whitespace and the 0x prefix
+  address = address.strip()
+  if address[:2] in ("0x", "0X"):
+    address = address[2:]
+
+  # Returns the empty address if there is no address (contract creations have no recipient)
+  if not address:
+    return EMPTY_ADDRESS
+
+  # Checks if the address is not 40 hex characters
+  if len(address) != ADDRESS_LENGTH * 2:
+    raise InvalidAddress(f"Invalid ethereum address: 0x{address}")
+
+  # Returns the interned bytes of the address
+  try:
+    return intern(bytes.fromhex(address))
+
+  # Raises InvalidAddress for characters that are not hex
+  except ValueError:
+    raise InvalidAddress(f"Invalid ethereum address: 0x{address}") from None
+
+
+def to_hex(address: bytes) -> str:
+  """Function to turn an address back into its lowercase hex form"""
+  return "0x" + address.ljust(ADDRESS_LENGTH, b"\0").hex()
+
+
+def normalize_array(hex_addresses):
+  """Function to turn a list of hex addresses into a numpy array of 20-byte values in one vectorized pass"""
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  # Gets the 40 hex digits of every address as a row of ASCII codes (missing addresses become zeros)
+  digits = numpy.array([address[-ADDRESS_LENGTH * 2:] if address else "0" * ADDRESS_LENGTH * 2 for address in hex_addresses], dtype=f"S{ADDRESS_LENGTH * 2}")
+  digits = digits.view(numpy.uint8).reshape(len(digits), ADDRESS_LENGTH * 2)
+
+  # Turns the ASCII codes of 0-9, a-f and A-F into the values of the digits
+  values = numpy.where(digits <= ord("9"), digits - ord("0"), (digits | 0x20) - (ord("a") - 10))
+
+  # Checks if any address has a character that is not hex
+  if len(values) and values.max() > 15:
+    raise InvalidAddress("Invalid ethereum address in the list")
+
+  # Joins every pair of digits into a byte and returns the rows as 20-byte values
+  return (values[:, 0::2] << 4 | values[:, 1::2]).astype(numpy.uint8).view(f"S{ADDRESS_LENGTH}").reshape(len(digits))
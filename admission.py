@@ -0,0 +1,269 @@
+# Module that decides which bot commands run now, which wait their turn and which are turned away
+
+import os, heapq, math, threading, time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+from rate_limiter import TokenBucket
+
+
+# The number of command tokens each user gains per second, and the most a user can save up
+USER_RATE = float(os.environ.get("ADMISSION_USER_RATE", 0.5))
+USER_BURST = float(os.environ.get("ADMISSION_USER_BURST", 10))
+
+# The number of command tokens each chat or guild gains per second, and the most a chat can save up
+CHAT_RATE = float(os.environ.get("ADMISSION_CHAT_RATE", 2))
+CHAT_BURST = float(os.environ.get("ADMISSION_CHAT_BURST", 30))
+
+# The number of expensive commands that can run at the same time
+MAX_RUNNING = int(os.environ.get("ADMISSION_MAX_RUNNING", 4))
+
+# The number of expensive commands that can wait in the queue, in total and for one user
+MAX_QUEUE_DEPTH = int(os.environ.get("ADMISSION_MAX_QUEUE_DEPTH", 32))
+MAX_USER_QUEUE_DEPTH = int(os.environ.get("ADMISSION_MAX_USER_QUEUE_DEPTH", 3))
+
+# The cost of each command in tokens (commands not listed cost 1), where commands costing more than 1 are queued
+COMMAND_COSTS = {
+  "gettxs": 2,
+  "portfolio": 3,
+  "getpasttxs": 5,
+  "getanalytics": 5,
+  "compare": 5,
+  "export": 5,
+  "getgas": 5,
+  "getcashflow": 5,
+  "topcounterparties": 5,
+}
+
+# The number of idle buckets kept before the full ones are dropped
+MAX_BUCKETS = 10000
+
+
+class Busy(Exception):
+  """Exception raised when a command is turned away, with the number of seconds to wait before retrying"""
+
+  def __init__(self, reason: str, retry_after: float) -> None:
+    super().__init__(f"Busy ({reason}), retry in {retry_after:.0f} s")
+
+    # The reason the command was turned away
+    self.reason = reason
+
+    # The number of seconds to wait before retrying
+    self.retry_after = retry_after
+
+
+class Ticket:
+  """Class that represents an admitted command, whose future is set once the command may start"""
+
+  def __init__(self, controller: "AdmissionController", user: str, queued: bool) -> None:
+    self.controller = controller
+    self.user = user
+
+    # Whether the command holds a running slot that must be released
+    self.queued = queued
+
+    # The future set when the command may start
+    self.future: Future = Future()
+
+    # The time the command started running
+    self.started_at: Optional[float] = None
+
+
+  def release(self) -> None:
+    """Function to give back the running slot once the command is done"""
+    if self.queued:
+      self.controller.release(self)
+
+
+class AdmissionController:
+  """Class that rate limits commands per user and per chat and runs expensive commands in weighted fair order"""
+
+  def __init__(self, max_running: int = MAX_RUNNING, max_queue_depth: int = MAX_QUEUE_DEPTH, max_user_queue_depth: int = MAX_USER_QUEUE_DEPTH) -> None:
+    self.max_running = max_running
+    self.max_queue_depth = max_queue_depth
+    self.max_user_queue_depth = max_user_queue_depth
+
+    # The dictionaries that map the user and the chat to their token buckets
+    self.user_buckets: Dict[str, TokenBucket] = {}
+    self.chat_buckets: Dict[str, TokenBucket] = {}
+
+    # The heap of (virtual finish time, sequence number, ticket) of the queued commands
+    self.queue: List[Tuple[float, int, Ticket]] = []
+
+    # The virtual time of the queue, which is the finish time of the last command started
+    self.virtual_time = 0.0
+
+    # The dictionary that maps the user to the virtual finish time of their last queued command
+    self.last_finish: Dict[str, float] = {}
+
+    # The dictionary that maps the user to their number of queued commands
+    self.user_queue_depths: Dict[str, int] = {}
+
+    # The number of expensive commands running
+    self.running = 0
+
+    # The moving average of the number of seconds an expensive command runs for, used to estimate waits
+    self.average_run_time = 2.0
+
+    # The sequence number that keeps commands with the same finish time in arrival order
+    self.sequence = 0
+
+    # The counters exported as metrics
+    self.admitted = 0
+    self.rejected: Dict[str, int] = {"user_rate": 0, "chat_rate": 0, "user_queue": 0, "queue_full": 0}
+
+    # The lock protecting the controller
+    self.lock = threading.Lock()
+
+
+  def get_bucket(self, buckets: Dict[str, TokenBucket], key: str, rate: float, capacity: float) -> TokenBucket:
+    """Function to get the bucket of a user or chat (must be called with the lock held)"""
+
+    bucket = buckets.get(key)
+    if bucket is None:
+
+      # Drops the full buckets, which belong to idle users, if there are too many
+      if len(buckets) >= MAX_BUCKETS:
+        for idle_key in [idle_key for idle_key, idle_bucket in buckets.items() if idle_bucket.available() >= idle_bucket.capacity]:
+          del buckets[idle_key]
+
+      bucket = buckets[key] = TokenBucket(rate, capacity)
+
+    return bucket
+
+
+  def estimated_wait(self, depth: int) -> float:
+    """Function to estimate the number of seconds until a command behind depth queued commands starts"""
+    return max(1.0, math.ceil(self.average_run_time * (depth + 1) / self.max_running))
+
+
+  def admit(self, user: str, chat: str, cost: float = 1, weight: float = 1) -> Ticket:
+    """Function to admit a command, raising Busy if the user, the chat or the queue is over its limit
+
+    Commands costing 1 start right away. More expensive commands are queued by their virtual finish time
+    (start + cost / weight), so every user gets an equal share of the running slots however many they send.
+    """
+
+    with self.lock:
+
+      # Checks if the queue is full before taking any tokens
+      if cost > 1:
+        if len(self.queue) >= self.max_queue_depth:
+          self.rejected["queue_full"] += 1
+          raise Busy("queue_full", self.estimated_wait(len(self.queue)))
+
+        if self.user_queue_depths.get(user, 0) >= self.max_user_queue_depth:
+          self.rejected["user_queue"] += 1
+          raise Busy("user_queue", self.estimated_wait(len(self.queue)))
+
+      # Takes the tokens from the user's bucket
+      user_bucket = self.get_bucket(self.user_buckets, user, USER_RATE, USER_BURST)
+      if not user_bucket.try_acquire(cost):
+        self.rejected["user_rate"] += 1
+        raise Busy("user_rate", math.ceil(user_bucket.wait_time(cost)))
+
+      # Takes the tokens from the chat's bucket, giving the user's tokens back if the chat is over its limit
+      chat_bucket = self.get_bucket(self.chat_buckets, chat, CHAT_RATE, CHAT_BURST)
+      if not chat_bucket.try_acquire(cost):
+        user_bucket.give_back(cost)
+        self.rejected["chat_rate"] += 1
+        raise Busy("chat_rate", math.ceil(chat_bucket.wait_time(cost)))
+
+      self.admitted += 1
+
+      # Lets cheap commands start right away
+      if cost <= 1:
+        ticket = Ticket(self, user, False)
+        ticket.future.set_result(None)
+        return ticket
+
+      # Queues the command after the user's previous command
+      ticket = Ticket(self, user, True)
+      finish = max(self.virtual_time, self.last_finish.get(user, 0.0)) + cost / weight
+      self.last_finish[user] = finish
+      self.user_queue_depths[user] = self.user_queue_depths.get(user, 0) + 1
+      self.sequence += 1
+      heapq.heappush(self.queue, (finish, self.sequence, ticket))
+
+      # Starts the commands that fit in the free slots
+      started = self.start_next()
+
+    # Lets the started commands run outside of the lock
+    for ticket_to_start in started:
+      ticket_to_start.future.set_result(None)
+
+    return ticket
+
+
+  def start_next(self) -> List[Ticket]:
+    """Function to take the queued commands with the earliest finish times while there are free slots (must be called with the lock held)"""
+
+    started = []
+    while self.queue and self.running < self.max_running:
+      finish, _, ticket = heapq.heappop(self.queue)
+
+      # Moves the virtual time forward to the finish time of the started command
+      self.virtual_time = max(self.virtual_time, finish)
+
+      # Forgets the user's finish time once they have nothing queued, so the dictionary does not grow forever
+      self.user_queue_depths[ticket.user] -= 1
+      if not self.user_queue_depths[ticket.user]:
+        del self.user_queue_depths[ticket.user]
+        if self.last_finish.get(ticket.user, 0.0) <= self.virtual_time:
+          self.last_finish.pop(ticket.user, None)
+
+      self.running += 1
+      ticket.started_at = time.monotonic()
+      started.append(ticket)
+
+    return started
+
+
+  def release(self, ticket: Ticket) -> None:
+    """Function to free the slot of a finished command and start the next queued command"""
+
+    with self.lock:
+      self.running -= 1
+
+      # Updates the average run time
+      if ticket.started_at is not None:
+        self.average_run_time = 0.9 * self.average_run_time + 0.1 * (time.monotonic() - ticket.started_at)
+
+      started = self.start_next()
+
+    for ticket_to_start in started:
+      ticket_to_start.future.set_result(None)
+
+
+  def metrics(self) -> Dict[str, float]:
+    """Function to get the queue depth, running commands and admission counters"""
+
+    with self.lock:
+      metrics = {
+        "admission_queue_depth": len(self.queue),
+        "admission_running": self.running,
+        "admission_admitted_total": self.admitted,
+        "admission_average_run_seconds": self.average_run_time,
+      }
+      for reason, count in self.rejected.items():
+        metrics[f'admission_rejected_total{{reason="{reason}"}}'] = count
+
+    return metrics
+
+
+  def metrics_text(self) -> str:
+    """Function to get the metrics in the Prometheus text format"""
+    return "".join(f"{name} {value}\n" for name, value in self.metrics().items())
+
+
+def get_cost(command: str) -> float:
+  """Function to get the cost of a command in tokens"""
+  return COMMAND_COSTS.get(command, 1)
+
+
+def busy_message(error: Busy) -> str:
+  """Function to get the reply sent when a command is turned away"""
+  return f"The bot is busy, please retry in {error.retry_after:.0f} s."
+
+
+# The admission controller shared by both bots
+controller = AdmissionController()
@@ -0,0 +1,171 @@
+# Module that batches concurrent ether balance lookups into balancemulti requests
+
+import asyncio, logging, threading, time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+import etherscan_api, io_pool, circuit_breaker
+
+
+class BalanceBatcher:
+  """Class that collects single address balance lookups for a few milliseconds and fetches them in one request"""
+
+  def __init__(self, window: float = 0.01, max_batch_size: int = etherscan_api.MAX_BALANCEMULTI_ADDRESSES) -> None:
+
+    # The number of seconds to wait for more lookups before sending the request
+    self.window = window
+
+    # The maximum number of addresses in one request
+    self.max_batch_size = max_batch_size
+
+    # The dictionary that maps the hex address to the futures waiting for its balance
+    self.pending: Dict[str, List[Future]] = {}
+
+    # The timer that sends the pending lookups when the window ends
+    self.timer: Optional[threading.Timer] = None
+
+    # The lock protecting the pending lookups
+    self.lock = threading.Lock()
+
+    # The dictionary that maps the hex address to its last fetched balance and the time it was fetched
+    self.last_balances: Dict[str, Tuple[float, float]] = {}
+
+
+  def submit(self, address: str) -> Future:
+    """Function to add an address to the next batch and return the future of its balance, raising ValueError if the address is invalid"""
+
+    # Checks the address before it is queued, so an invalid address cannot fail the whole batch
+    address = etherscan_api.query_address(address)
+
+    # Creates the future for the caller
+    future = Future()
+
+    # The batch to send right away if the batch is full
+    full_batch = None
+
+    with self.lock:
+
+      # Adds the future to the pending lookups for the address
+      self.pending.setdefault(address, []).append(future)
+
+      # Checks if the batch is full
+      if len(self.pending) >= self.max_batch_size:
+
+        # Takes the full batch to send it right away
+        full_batch = self.take_pending()
+
+      # Checks if there is no timer running for the batch
+      elif self.timer is None:
+
+        # Starts the timer to send the batch when the window ends
+        self.timer = threading.Timer(self.window, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    # Sends the full batch outside of the lock
+    if full_batch:
+      io_pool.submit(self.send, full_batch)
+
+    # Returns the future
+    return future
+
+
+  def take_pending(self) -> Dict[str, List[Future]]:
+    """Function to take the pending lookups and reset the batch (must be called with the lock held)"""
+
+    # Gets the pending lookups
+    batch = self.pending
+
+    # Resets the pending lookups
+    self.pending = {}
+
+    # Cancels the timer as the batch is being sent
+    if self.timer is not None:
+      self.timer.cancel()
+      self.timer = None
+
+    # Returns the batch
+    return batch
+
+
+  def flush(self) -> None:
+    """Function to send the pending lookups when the window ends"""
+
+    with self.lock:
+      batch = self.take_pending()
+
+    # Sends the batch if it is not empty
+    if batch:
+      self.send(batch)
+
+
+  def send(self, batch: Dict[str, List[Future]]) -> None:
+    """Function to fetch the balances in the batch and give each caller its own result"""
+
+    try:
+
+      # Gets the balances for all the addresses in one request
+      balances = etherscan_api.get_ether_balances(list(batch))
+
+    # Passes the error to every caller in the batch
+    except Exception as e:
+      logging.error(e)
+
+      for futures in batch.values():
+        for future in futures:
+          future.set_exception(e)
+
+      return
+
+    # Remembers the balances so a slow lookup can be answered with the last known balance
+    fetched_at = time.time()
+    for address in batch:
+      if balances.get(address) is not None:
+        self.last_balances[address] = (balances[address], fetched_at)
+
+    # Gives each caller the balance of its address (None if the address is invalid)
+    for address, futures in batch.items():
+      for future in futures:
+        future.set_result(balances.get(address))
+
+
+  def get_balance(self, address: str) -> Optional[float]:
+    """Function to get the ether balance of an address through the batcher"""
+
+    # Waits for the batch containing the address and returns the balance
+    return self.submit(address).result()
+
+
+  def get_cached_balance(self, address: str) -> Optional[Tuple[float, float]]:
+    """Function to get the last fetched balance of an address and its age in seconds, or None if it was never fetched"""
+
+    # Gets the last fetched balance
+    cached = self.last_balances.get(etherscan_api.query_address(address))
+
+    # Returns the balance with its age
+    return (cached[0], time.time() - cached[1]) if cached is not None else None
+
+
+  async def get_balance_async(self, address: str) -> Optional[float]:
+    """Function to get the ether balance of an address through the batcher without blocking the event loop"""
+
+    # Waits for the batch containing the address and returns the balance
+    return await asyncio.wrap_future(self.submit(address))
+
+
+  def get_balance_with_age(self, address: str) -> Tuple[Optional[float], Optional[float]]:
+    """Function to get the ether balance of an address, or the last known balance and its age in seconds while Etherscan is down"""
+
+    try:
+      return self.get_balance(address), None
+
+    # Falls back on the last known balance (there is nothing to serve if the address was never fetched)
+    except circuit_breaker.CircuitOpen:
+      cached = self.get_cached_balance(address)
+      if cached is None:
+        raise
+
+      return cached
+
+
+# The batcher shared by both bots
+batcher = BalanceBatcher()
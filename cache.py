@@ -0,0 +1,452 @@
+# Module that caches values in an in-process LRU tier and, if configured, a shared tier on a Redis-protocol server, so bot replicas share warm data
+
+import os, json, logging, socket, threading, time, uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+import circuit_breaker
+
+# Uses orjson to encode values if it is installed, as it is several times faster than the json module
+try:
+  import orjson
+
+  def dumps(value: Any) -> bytes:
+    return orjson.dumps(value)
+
+  loads = orjson.loads
+
+except ImportError:
+
+  def dumps(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+  loads = json.loads
+
+
+# The maximum number of values kept in the in-process tier
+CACHE_LOCAL_SIZE = int(os.environ.get("CACHE_LOCAL_SIZE", 1024))
+
+# The URL of the Redis-protocol server of the shared tier, like redis://:password@host:6379/0 (no shared tier if empty)
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "")
+
+# The prefix of every key, so several deployments can share one server
+CACHE_NAMESPACE = os.environ.get("CACHE_NAMESPACE", "cryptobot")
+
+# The number of seconds to wait for the server before giving up on the shared tier
+SOCKET_TIMEOUT = 2.0
+
+# The number of seconds a value read from the shared tier is kept in memory, as the server does not say how long it has left
+SHARED_LOCAL_TTL = 30.0
+
+# The number of seconds to wait before listening for invalidation messages again after the connection breaks
+RECONNECT_DELAY = 5.0
+
+# The ID of this replica, used to ignore its own invalidation messages
+REPLICA_ID = uuid.uuid4().hex
+
+# The value returned by the in-process tier for a missing key, as None can be cached
+MISSING = object()
+
+
+class LocalCache:
+  """Class that keeps the most recently used values in memory, each with an expiry time"""
+
+  def __init__(self, size: int) -> None:
+
+    # The maximum number of values
+    self.size = size
+
+    # The dictionary that maps the key to the time the value expires and the value, least recently used first
+    self.entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    # The lock protecting the entries
+    self.lock = threading.Lock()
+
+
+  def get(self, key: str) -> Any:
+    """Function to get a value, returning MISSING if it is not cached or has expired"""
+
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return MISSING
+
+      # Drops the value if it has expired
+      if entry[0] <= time.time():
+        del self.entries[key]
+        return MISSING
+
+      # Marks the value as recently used
+      self.entries.move_to_end(key)
+      return entry[1]
+
+
+  def set(self, key: str, value: Any, ttl: float) -> None:
+    """Function to cache a value for a number of seconds, removing the least recently used value if the cache is full"""
+
+    with self.lock:
+      self.entries[key] = (time.time() + ttl, value)
+      self.entries.move_to_end(key)
+      if len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+
+
+  def delete(self, key: str) -> None:
+    """Function to remove a value"""
+
+    with self.lock:
+      self.entries.pop(key, None)
+
+
+class RespError(Exception):
+  """Exception raised when the server answers a command with an error"""
+
+
+class RespConnection:
+  """Class that represents one connection to a Redis-protocol server, speaking RESP over a socket"""
+
+  def __init__(self, url: str) -> None:
+
+    # Gets the host, port, password and database from the URL
+    parsed = urlparse(url)
+    self.host = parsed.hostname or "localhost"
+    self.port = parsed.port or 6379
+    self.password = parsed.password
+    self.database = int(parsed.path.lstrip("/") or 0)
+
+    # The socket and the file used to read replies, opened on first use
+    self.socket: Optional[socket.socket] = None
+    self.reader = None
+
+
+  def connect(self) -> None:
+    """Function to open the connection, logging in and selecting the database"""
+
+    self.socket = socket.create_connection((self.host, self.port), timeout=SOCKET_TIMEOUT)
+    self.reader = self.socket.makefile("rb")
+
+    if self.password:
+      self.command("AUTH", self.password)
+    if self.database:
+      self.command("SELECT", self.database)
+
+
+  def close(self) -> None:
+    """Function to close the connection, so the next command opens a new one"""
+
+    if self.socket is not None:
+      try:
+        self.socket.close()
+      except OSError:
+        pass
+
+    self.socket = None
+    self.reader = None
+
+
+  def send(self, *arguments) -> None:
+    """Function to send a command as an array of bulk strings"""
+
+    # Opens the connection if needed
+    if self.socket is None:
+      self.connect()
+
+    # Encodes every argument as bytes
+    parts = [argument if isinstance(argument, bytes) else str(argument).encode() for argument in arguments]
+
+    self.socket.sendall(b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts))
+
+
+  def read_reply(self) -> Any:
+    """Function to read one reply, raising RespError for error replies"""
+
+    # Reads the type and the first line of the reply
+    line = self.reader.readline()
+    if not line:
+      raise ConnectionError("The cache server closed the connection")
+    kind, rest = line[:1], line[1:-2]
+
+    # Simple strings and integers
+    if kind == b"+":
+      return rest.decode()
+    if kind == b":":
+      return int(rest)
+
+    # Errors
+    if kind == b"-":
+      raise RespError(rest.decode())
+
+    # Bulk strings (None if missing)
+    if kind == b"$":
+      length = int(rest)
+      if length < 0:
+        return None
+      data = self.reader.read(length + 2)
+      return data[:-2]
+
+    # Arrays of replies
+    if kind == b"*":
+      length = int(rest)
+      return None if length < 0 else [self.read_reply() for _ in range(length)]
+
+    raise ConnectionError(f"Invalid reply from the cache server: {line!r}")
+
+
+  def command(self, *arguments) -> Any:
+    """Function to send a command and read its reply, closing the connection if it breaks"""
+
+    try:
+      self.send(*arguments)
+      return self.read_reply()
+
+    # Keeps the connection for error replies, which leave it in a clean state
+    except RespError:
+      raise
+
+    # Closes the connection so it is opened again for the next command
+    except Exception:
+      self.close()
+      raise
+
+
+class SharedCache:
+  """Class that stores encoded values on a Redis-protocol server and tells the other replicas when a value changes"""
+
+  def __init__(self, url: str, channel: str, on_invalidate: Callable[[str], None], replica_id: str = REPLICA_ID) -> None:
+    self.url = url
+
+    # The ID of the replica, sent with its invalidation messages so it can skip its own
+    self.replica_id = replica_id
+
+    # The channel the invalidation messages are published on
+    self.channel = channel
+
+    # The function called with the key of every value changed by another replica
+    self.on_invalidate = on_invalidate
+
+    # The connection used for commands and the lock making sure one command uses it at a time
+    self.connection = RespConnection(url)
+    self.lock = threading.Lock()
+
+    # The thread listening for invalidation messages
+    self.thread: Optional[threading.Thread] = None
+
+
+  def command(self, *arguments) -> Any:
+    """Function to run a command through the cache server's circuit breaker"""
+
+    # Fails fast with CircuitOpen if the server is down
+    circuit_breaker.cache_server.allow()
+
+    try:
+      with self.lock:
+        reply = self.connection.command(*arguments)
+
+    # Counts the failure and passes the error on
+    except Exception:
+      circuit_breaker.cache_server.record_failure()
+      raise
+
+    circuit_breaker.cache_server.record_success()
+    return reply
+
+
+  def get(self, key: str) -> Optional[bytes]:
+    """Function to get the encoded value of a key (None if it is missing)"""
+    return self.command("GET", key)
+
+
+  def set(self, key: str, data: bytes, ttl: float) -> None:
+    """Function to store the encoded value of a key for a number of seconds and tell the other replicas"""
+    self.command("SET", key, data, "PX", max(1, int(ttl * 1000)))
+    self.command("PUBLISH", self.channel, f"{self.replica_id} {key}")
+
+
+  def delete(self, key: str) -> None:
+    """Function to remove a key and tell the other replicas"""
+    self.command("DEL", key)
+    self.command("PUBLISH", self.channel, f"{self.replica_id} {key}")
+
+
+  def listen(self) -> None:
+    """Function to pass on the invalidation messages of the other replicas forever, reconnecting if the connection breaks"""
+
+    while True:
+
+      # Opens a connection of its own, as a subscribed connection cannot run other commands
+      connection = RespConnection(self.url)
+
+      try:
+        connection.command("SUBSCRIBE", self.channel)
+
+        # Waits for messages without a timeout
+        connection.socket.settimeout(None)
+
+        while True:
+          reply = connection.read_reply()
+
+          # Skips anything that is not a message, and the messages of this replica
+          if not isinstance(reply, list) or len(reply) != 3 or reply[0] != b"message":
+            continue
+          replica, key = reply[2].decode().split(" ", 1)
+          if replica != self.replica_id:
+            self.on_invalidate(key)
+
+      # Logs the error and reconnects after a while
+      except Exception as e:
+        logging.error(f"Cache invalidation listener failed: {e}")
+        connection.close()
+        time.sleep(RECONNECT_DELAY)
+
+
+  def start(self) -> None:
+    """Function to start the thread listening for invalidation messages"""
+
+    if self.thread is None:
+      self.thread = threading.Thread(target=self.listen, daemon=True)
+      self.thread.start()
+
+
+class Cache:
+  """Class that caches values under namespaced keys in the in-process tier and the shared tier
+
+  Values are written through to both tiers, and writing or invalidating a value drops it from the in-process tier
+  of every other replica. Values are encoded as JSON, except for the types registered with a codec of their own.
+  """
+
+  def __init__(self, local_size: int = CACHE_LOCAL_SIZE, url: str = CACHE_REDIS_URL, prefix: str = CACHE_NAMESPACE, replica_id: str = REPLICA_ID) -> None:
+
+    # The prefix of every key
+    self.prefix = prefix
+
+    # The in-process tier
+    self.local = LocalCache(local_size)
+
+    # The shared tier, if a server is configured
+    self.shared = SharedCache(url, f"{prefix}:invalidate", self.local.delete, replica_id) if url else None
+
+    # The dictionary that maps the tag of a registered type to the type and its encode and decode functions
+    self.codecs: Dict[bytes, Tuple[type, Callable[[Any], bytes], Callable[[bytes], Any]]] = {}
+
+
+  def register_codec(self, tag: bytes, value_type: type, encode: Callable[[Any], bytes], decode: Callable[[bytes], Any]) -> None:
+    """Function to register the compact encoding of a type, marked with a one byte tag"""
+    self.codecs[tag] = (value_type, encode, decode)
+
+
+  def encode(self, value: Any) -> bytes:
+    """Function to encode a value with the codec of its type, or as JSON"""
+
+    for tag, (value_type, encode, _) in self.codecs.items():
+      if isinstance(value, value_type):
+        return tag + encode(value)
+
+    return b"J" + dumps(value)
+
+
+  def decode(self, data: bytes) -> Any:
+    """Function to decode a value encoded with encode"""
+
+    tag, body = data[:1], data[1:]
+    return loads(body) if tag == b"J" else self.codecs[tag][2](body)
+
+
+  def make_key(self, namespace: str, key: str) -> str:
+    """Function to get the full key of a value in a namespace"""
+    return f"{self.prefix}:{namespace}:{key}"
+
+
+  def get(self, namespace: str, key: str, default: Any = None, local: bool = True) -> Any:
+    """Function to get a value from the in-process tier, or from the shared tier if it is not in memory"""
+
+    full_key = self.make_key(namespace, key)
+
+    # Returns the value from memory
+    if local:
+      value = self.local.get(full_key)
+      if value is not MISSING:
+        return value
+
+    # Returns the default if there is no shared tier
+    if self.shared is None:
+      return default
+
+    try:
+
+      # Gets the value from the shared tier
+      data = self.shared.get(full_key)
+      if data is None:
+        return default
+      value = self.decode(data)
+
+    # Treats the value as missing if the server is down
+    except circuit_breaker.CircuitOpen:
+      return default
+
+    # Logs the error and treats the value as missing
+    except Exception as e:
+      logging.error(f"Cache get failed for {full_key}: {e}")
+      return default
+
+    # Keeps the value in memory for a short while
+    if local:
+      self.local.set(full_key, value, SHARED_LOCAL_TTL)
+
+    return value
+
+
+  def set(self, namespace: str, key: str, value: Any, ttl: float, local: bool = True) -> None:
+    """Function to write a value through to both tiers for a number of seconds
+
+    Values that already live in memory elsewhere (like the transaction store's histories) are written with
+    local=False, so they are only shared and not held twice.
+    """
+
+    full_key = self.make_key(namespace, key)
+
+    # Writes the value to memory
+    if local:
+      self.local.set(full_key, value, ttl)
+
+    # Writes the value to the shared tier
+    if self.shared is not None:
+      try:
+        self.shared.set(full_key, self.encode(value), ttl)
+
+      # Keeps going with the in-process tier if the server is down
+      except circuit_breaker.CircuitOpen:
+        pass
+
+      # Logs the error
+      except Exception as e:
+        logging.error(f"Cache set failed for {full_key}: {e}")
+
+
+  def invalidate(self, namespace: str, key: str) -> None:
+    """Function to remove a value from both tiers and the in-process tier of every other replica"""
+
+    full_key = self.make_key(namespace, key)
+    self.local.delete(full_key)
+
+    if self.shared is not None:
+      try:
+        self.shared.delete(full_key)
+
+      # Keeps going if the server is down (the value expires with its TTL)
+      except circuit_breaker.CircuitOpen:
+        pass
+
+      # Logs the error
+      except Exception as e:
+        logging.error(f"Cache invalidate failed for {full_key}: {e}")
+
+
+  def start(self) -> None:
+    """Function to start listening for the invalidation messages of the other replicas"""
+
+    if self.shared is not None:
+      self.shared.start()
+
+
+# The cache shared by both bots
+cache = Cache()
@@ -0,0 +1,234 @@
+# Module that looks up transactions and receipts from a configurable chain data provider
+
+import os, logging, threading
+from typing import Any, List, Optional, Sequence, Tuple
+import etherscan_api, httpx_client, circuit_breaker, addresses
+from etherscan_api import Transaction
+
+
+# The provider of chain data, which is "etherscan" or "rpc" for an Ethereum JSON-RPC node
+CHAIN_BACKEND = os.environ.get("CHAIN_BACKEND", "etherscan").lower()
+
+# The URL of the Ethereum JSON-RPC node used by the "rpc" provider
+ETH_RPC_URL = os.environ.get("ETH_RPC_URL", "")
+
+# The maximum number of calls sent in one JSON-RPC batch request
+MAX_RPC_BATCH_SIZE = 100
+
+# The maximum number of transactions of one wallet in one block that Etherscan returns in one txlist page
+MAX_BLOCK_TRANSACTIONS = 10000
+
+# The type of a JSON-RPC call, which is the method and its parameters
+Call = Tuple[str, tuple]
+
+
+class EtherscanBackend:
+  """Class that makes JSON-RPC calls through the Etherscan proxy module, one rate limited request per call"""
+
+  name = "etherscan"
+
+  def call_many(self, calls: Sequence[Call]) -> List[Any]:
+    """Function to make the calls and return their results in order"""
+    return [etherscan_api.call_proxy(method, params) for method, params in calls]
+
+
+  def get_transactions(self, tx_hashes: Sequence[str]) -> List[Optional[Transaction]]:
+    """Function to get many transactions with their receipts and timestamps
+
+    The proxy module answers one call per request, so instead of a receipt and a block per transaction, the mined
+    transactions are looked up in the txlist of their sender at their block, which has the gas used, the status and
+    the timestamp, with one request for every sender and block.
+    """
+
+    # Gets the details of every transaction
+    details = self.call_many([("eth_getTransactionByHash", (tx_hash, )) for tx_hash in tx_hashes])
+
+    # Gets the senders and blocks of the mined transactions, once each
+    senders_and_blocks = dict.fromkeys((result["from"], int(result["blockNumber"], 16)) for result in details if result and result.get("blockNumber"))
+
+    # Gets the transactions of every sender in every block by their hash
+    listed = {
+      transaction.hash.lower(): transaction
+      for sender, block_number in senders_and_blocks
+      for transaction in etherscan_api.get_normal_transactions(sender, MAX_BLOCK_TRANSACTIONS, block_number, "asc", block_number) or []
+    }
+
+    # Gets the receipts and blocks of the mined transactions that Etherscan has not listed yet
+    unlisted = [result if result and result.get("blockNumber") and result["hash"].lower() not in listed else None for result in details]
+    receipts = [self.call_many([("eth_getTransactionReceipt", (result["hash"], ))])[0] if result else None for result in unlisted]
+    completed = complete_transactions(self, unlisted, receipts)
+
+    # Returns the transactions (None if a transaction is not found)
+    return [
+      listed.get(result["hash"].lower()) or transaction or to_transaction(result, None, None) if result else None
+      for result, transaction in zip(details, completed)
+    ]
+
+
+class JsonRpcBackend:
+  """Class that makes JSON-RPC calls against an Ethereum node, sending many calls in one batch request"""
+
+  name = "rpc"
+
+  def __init__(self, url: str) -> None:
+
+    # The URL of the node
+    self.url = url
+
+
+  def call_many(self, calls: Sequence[Call]) -> List[Any]:
+    """Function to make the calls in as few batch requests as possible and return their results in order"""
+
+    # The results of the calls
+    results: List[Any] = []
+
+    # Sends the calls in batches of the maximum batch size
+    for start in range(0, len(calls), MAX_RPC_BATCH_SIZE):
+
+      # Creates the batch, using the position of each call as its ID
+      batch = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": list(params)}
+        for i, (method, params) in enumerate(calls[start : start + MAX_RPC_BATCH_SIZE])
+      ]
+
+      # Fails fast with CircuitOpen if the node is down
+      circuit_breaker.node.allow()
+
+      try:
+
+        # Sends the batch and gets the responses
+        responses = httpx_client.get_client().post(self.url, json=batch).json()
+
+        # Checks if the node rejected the whole batch
+        if not isinstance(responses, list):
+          raise ValueError(f"Invalid JSON-RPC batch response: {responses}")
+
+      # Counts the failure and passes the error on
+      except Exception:
+        circuit_breaker.node.record_failure()
+        raise
+
+      circuit_breaker.node.record_success()
+
+      # Puts the results back in the order of the calls, as the node can answer in any order (None for failed calls)
+      by_id = {response.get("id"): response.get("result") for response in responses}
+      results += [by_id.get(call["id"]) for call in batch]
+
+    # Returns the results
+    return results
+
+
+  def get_transactions(self, tx_hashes: Sequence[str]) -> List[Optional[Transaction]]:
+    """Function to get many transactions with their receipts and timestamps in two round trips"""
+
+    # Gets the details and the receipts of every transaction in one batch
+    results = self.call_many([("eth_getTransactionByHash", (tx_hash, )) for tx_hash in tx_hashes] + [("eth_getTransactionReceipt", (tx_hash, )) for tx_hash in tx_hashes])
+
+    # Gets the blocks in a second batch and creates the transactions
+    return complete_transactions(self, results[:len(tx_hashes)], results[len(tx_hashes):])
+
+
+# The provider chosen by the configuration, created on first use
+_backend = None
+
+# The lock to stop two threads from creating the provider at the same time
+_backend_lock = threading.Lock()
+
+# The Etherscan provider used when the configured provider fails
+fallback = EtherscanBackend()
+
+
+def get_backend():
+  """Function to get the configured provider, using Etherscan if no node URL is set"""
+
+  global _backend
+
+  # Checks if the provider has not been created yet
+  if _backend is None:
+    with _backend_lock:
+      if _backend is None:
+
+        # Creates the node provider if it is configured with a URL
+        if CHAIN_BACKEND == "rpc" and ETH_RPC_URL:
+          _backend = JsonRpcBackend(ETH_RPC_URL)
+
+        # Uses Etherscan otherwise
+        else:
+          if CHAIN_BACKEND != "etherscan":
+            logging.warning(f"Chain backend {CHAIN_BACKEND!r} is not available, using Etherscan")
+          _backend = fallback
+
+  # Returns the provider
+  return _backend
+
+
+def call_backend(method: str, *args) -> Any:
+  """Function to call a method of the configured provider, falling back on Etherscan if it fails"""
+
+  backend = get_backend()
+
+  try:
+    return getattr(backend, method)(*args)
+
+  # Makes the call through Etherscan if the node is down
+  except Exception as e:
+    if backend is fallback:
+      raise
+
+    logging.error(f"{backend.name} backend failed, falling back to Etherscan: {e}")
+    return getattr(fallback, method)(*args)
+
+
+def call_many(calls: Sequence[Call]) -> List[Any]:
+  """Function to make JSON-RPC calls with the configured provider, falling back on Etherscan if it fails"""
+  return call_backend("call_many", calls)
+
+
+def get_transaction_receipts(tx_hashes: Sequence[str]) -> List[Optional[dict]]:
+  """Function to get the receipts of many transactions in one round trip"""
+  return call_many([("eth_getTransactionReceipt", (tx_hash, )) for tx_hash in tx_hashes])
+
+
+def get_transaction_receipt(tx_hash: str) -> Optional[dict]:
+  """Function to get the receipt of a transaction"""
+  return get_transaction_receipts([tx_hash])[0]
+
+
+def to_transaction(details: dict, receipt: Optional[dict], block: Optional[dict]) -> Transaction:
+  """Function to create a transaction object in the txlist format from the JSON-RPC transaction, receipt and block"""
+  return Transaction(**{
+    "hash": details["hash"],
+    "blockNumber": str(int(details["blockNumber"], 16)) if details.get("blockNumber") else "",
+    "timeStamp": str(int(block["timestamp"], 16)) if block else "",
+    "from": addresses.normalize(details["from"]),
+    "to": addresses.normalize(details.get("to") or ""),
+    "value": str(int(details["value"], 16)),
+    "gas": str(int(details["gas"], 16)),
+    "gasPrice": str(int(details["gasPrice"], 16)) if details.get("gasPrice") else "0",
+    "gasUsed": str(int(receipt["gasUsed"], 16)) if receipt else "",
+    "isError": ("0" if int(receipt["status"], 16) == 1 else "1") if receipt and receipt.get("status") else "",
+  })
+
+
+def complete_transactions(backend, details: Sequence[Optional[dict]], receipts: Sequence[Optional[dict]]) -> List[Optional[Transaction]]:
+  """Function to create transactions from their JSON-RPC details and receipts, getting the blocks of the mined ones in one batch for their timestamps"""
+
+  # Gets the blocks of the mined transactions
+  block_numbers = list(dict.fromkeys(result["blockNumber"] for result in details if result and result.get("blockNumber")))
+  blocks = dict(zip(block_numbers, backend.call_many([("eth_getBlockByNumber", (block_number, False)) for block_number in block_numbers])))
+
+  # Returns the transactions (None if a transaction is not found)
+  return [
+    to_transaction(result, receipt, blocks.get(result.get("blockNumber"))) if result else None
+    for result, receipt in zip(details, receipts)
+  ]
+
+
+def get_transactions(tx_hashes: Sequence[str]) -> List[Optional[Transaction]]:
+  """Function to get many transactions with their receipts and timestamps, falling back on Etherscan if the provider fails"""
+  return call_backend("get_transactions", tx_hashes)
+
+
+def get_transaction(tx_hash: str) -> Optional[Transaction]:
+  """Function to get a transaction with its receipt and timestamp"""
+  return get_transactions([tx_hash])[0]
@@ -0,0 +1,129 @@
+# Module that stops calling an upstream API that keeps failing, so callers fail fast instead of retrying forever
+
+import os, logging, threading, time
+from typing import Dict
+
+
+# The number of failures in a row that open the circuit
+FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+
+# The number of seconds the circuit stays open before a probe request is let through
+RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", 30))
+
+# The states of a circuit
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+  """Exception raised when a request is not made because the circuit of its upstream is open"""
+
+  def __init__(self, upstream: str, retry_after: float) -> None:
+    super().__init__(f"{upstream} is unavailable, retry in {retry_after:.0f} s")
+
+    # The name of the upstream
+    self.upstream = upstream
+
+    # The number of seconds until the next probe request
+    self.retry_after = retry_after
+
+
+class CircuitBreaker:
+  """Class that counts the failures of an upstream, opens after too many in a row and lets one probe through at a time to close again"""
+
+  def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT) -> None:
+
+    # The name of the upstream, used in the logs and errors
+    self.name = name
+
+    # The number of failures in a row that open the circuit
+    self.failure_threshold = failure_threshold
+
+    # The number of seconds the circuit stays open before a probe
+    self.reset_timeout = reset_timeout
+
+    # The state of the circuit
+    self.state = CLOSED
+
+    # The number of failures in a row
+    self.failures = 0
+
+    # The time the circuit last opened
+    self.opened_at = 0.0
+
+    # Whether a probe request is in flight while the circuit is half open
+    self.probing = False
+
+    # The lock protecting the circuit
+    self.lock = threading.Lock()
+
+
+  def allow(self) -> None:
+    """Function to check if a request can be made, raising CircuitOpen if it cannot"""
+
+    with self.lock:
+
+      # Lets every request through while the circuit is closed
+      if self.state == CLOSED:
+        return
+
+      # Moves to half open once the circuit has been open for long enough
+      if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+        self.state = HALF_OPEN
+        self.probing = False
+
+      # Lets one probe request through while half open
+      if self.state == HALF_OPEN and not self.probing:
+        self.probing = True
+        return
+
+      # Fails fast otherwise
+      raise CircuitOpen(self.name, max(1.0, self.opened_at + self.reset_timeout - time.time()))
+
+
+  def record_success(self) -> None:
+    """Function to close the circuit after a successful request"""
+
+    with self.lock:
+      if self.state != CLOSED:
+        logging.info(f"{self.name} circuit closed")
+
+      self.state = CLOSED
+      self.failures = 0
+      self.probing = False
+
+
+  def record_failure(self) -> None:
+    """Function to count a failed request, opening the circuit after too many in a row or a failed probe"""
+
+    with self.lock:
+      self.failures += 1
+
+      # Opens the circuit (again) if the probe failed or there were too many failures in a row
+      if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+        if self.state != OPEN:
+          logging.warning(f"{self.name} circuit opened after {self.failures} failures")
+
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.probing = False
+
+
+  def is_open(self) -> bool:
+    """Function to check if the upstream is being treated as down"""
+    return self.state != CLOSED
+
+
+# The circuit breakers of the upstream APIs
+breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in ("Etherscan", "Moralis", "CoinGecko", "Ethereum node", "Cache server")}
+etherscan = breakers["Etherscan"]
+moralis = breakers["Moralis"]
+coingecko = breakers["CoinGecko"]
+node = breakers["Ethereum node"]
+cache_server = breakers["Cache server"]
+
+
+def staleness_note(age: float) -> str:
+  """Function to get the note added to replies that use cached data"""
+  return f"(upstream unavailable, data from {age:.0f} s ago)"
@@ -0,0 +1,219 @@
+# Module that keeps an index of who each wallet transacts with, updated as new transactions are synced
+
+import heapq, threading
+from typing import Dict, List, Set, Tuple
+import transaction_store, addresses
+from transaction_store import TransactionBatch
+
+
+# The metrics the counterparties can be ranked by
+METRICS = ("count", "volume")
+
+
+class CounterpartyStats:
+  """Class that represents the number of transactions and the wei sent and received with one counterparty"""
+
+  __slots__ = ("count", "wei_in", "wei_out")
+
+  def __init__(self) -> None:
+    self.count = 0
+    self.wei_in = 0
+    self.wei_out = 0
+
+
+  def metric(self, metric: str) -> int:
+    """Function to get the value the counterparty is ranked by"""
+    return self.count if metric == "count" else self.wei_in + self.wei_out
+
+
+class CounterpartyIndex:
+  """Class that maps the counterparties of one wallet to their stats and answers top K queries with heaps"""
+
+  def __init__(self) -> None:
+
+    # The dictionary that maps the 20-byte counterparty address to its stats
+    self.table: Dict[bytes, CounterpartyStats] = {}
+
+    # The max heaps of (-metric, counterparty) for each metric, which may hold outdated entries that are skipped
+    self.heaps: Dict[str, List[Tuple[int, bytes]]] = {metric: [] for metric in METRICS}
+
+    # The lock protecting the index
+    self.lock = threading.Lock()
+
+
+  def update(self, batch: TransactionBatch, address: bytes) -> None:
+    """Function to add new transactions of the wallet to the index"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Gets the direction of every transaction, skipping transactions the wallet sent to itself
+    outgoing = batch.sender == address
+    incoming = batch.receiver == address
+    keep = outgoing ^ incoming
+
+    # Checks if there is nothing to add
+    if not keep.any():
+      return
+
+    # Gets the counterparty of every transaction
+    outgoing, incoming = outgoing[keep], incoming[keep]
+    counterparties = numpy.where(outgoing, batch.receiver[keep], batch.sender[keep])
+
+    # Failed transactions count as an interaction but do not move any wei
+    values = batch.value[keep].where(~batch.is_error[keep])
+
+    # Groups the transactions by counterparty
+    unique_counterparties, inverse, counts = numpy.unique(counterparties, return_inverse=True, return_counts=True)
+
+    # Sums the wei in and out of each counterparty exactly
+    wei_in = values.where(incoming).group_sums(inverse, len(unique_counterparties)).to_ints()
+    wei_out = values.where(outgoing).group_sums(inverse, len(unique_counterparties)).to_ints()
+
+    with self.lock:
+
+      # Updates the stats of every counterparty in the new transactions
+      for counterparty, count, received, sent in zip(unique_counterparties.tolist(), counts.tolist(), wei_in, wei_out):
+
+        # Gets the shared bytes object of the counterparty (numpy strips its trailing zero bytes)
+        counterparty = addresses.intern(counterparty)
+
+        stats = self.table.get(counterparty)
+        is_new = stats is None
+        if is_new:
+          stats = self.table[counterparty] = CounterpartyStats()
+
+        # Gets the values before the update, so only the metrics that changed get a new heap entry
+        previous = {metric: stats.metric(metric) for metric in METRICS}
+
+        stats.count += count
+        stats.wei_in += received
+        stats.wei_out += sent
+
+        # Pushes the new values onto the heaps (the old entries become outdated)
+        for metric in METRICS:
+          if is_new or stats.metric(metric) != previous[metric]:
+            heapq.heappush(self.heaps[metric], (-stats.metric(metric), counterparty))
+
+      # Rebuilds the heaps if they hold too many outdated entries
+      for metric in METRICS:
+        if len(self.heaps[metric]) > 2 * len(self.table) + 64:
+          self.heaps[metric] = [(-stats.metric(metric), counterparty) for counterparty, stats in self.table.items()]
+          heapq.heapify(self.heaps[metric])
+
+
+  def top(self, k: int, metric: str = "count") -> List[Tuple[bytes, CounterpartyStats]]:
+    """Function to get the top k counterparties by a metric in O(k log n)"""
+
+    # Checks if the metric is valid
+    if metric not in METRICS:
+      raise ValueError(f"Invalid metric {metric!r}, expected one of {', '.join(METRICS)}")
+
+    with self.lock:
+      heap = self.heaps[metric]
+
+      # The list of the top counterparties, the heap entries to push back and the counterparties already listed
+      top: List[Tuple[bytes, CounterpartyStats]] = []
+      popped: List[Tuple[int, bytes]] = []
+      seen: Set[bytes] = set()
+
+      # Pops the heap until there are k up to date entries
+      while heap and len(top) < k:
+        entry = heapq.heappop(heap)
+        negative_value, counterparty = entry
+        stats = self.table[counterparty]
+
+        # Skips outdated and repeated entries, which are dropped from the heap
+        if -negative_value != stats.metric(metric) or counterparty in seen:
+          continue
+
+        seen.add(counterparty)
+        top.append((counterparty, stats))
+        popped.append(entry)
+
+      # Pushes the up to date entries back
+      for entry in popped:
+        heapq.heappush(heap, entry)
+
+    # Returns the top counterparties
+    return top
+
+
+class CounterpartyIndexes:
+  """Class that keeps a counterparty index for every wallet in the transaction store"""
+
+  def __init__(self, store: transaction_store.TransactionStore) -> None:
+
+    # The transaction store the indexes are built from
+    self.store = store
+
+    # The dictionary that maps the 20-byte address to its index
+    self.indexes: Dict[bytes, CounterpartyIndex] = {}
+
+    # The lock protecting the dictionary of indexes
+    self.lock = threading.Lock()
+
+    # Updates the indexes whenever the store syncs new transactions, and drops them when the history is evicted
+    store.add_listener(self.on_sync)
+    store.add_eviction_listener(self.on_evict)
+
+
+  def on_sync(self, address: bytes, new_batch: TransactionBatch) -> None:
+    """Function to add newly synced transactions to the index of the address"""
+
+    with self.lock:
+      index = self.indexes.setdefault(address, CounterpartyIndex())
+
+    index.update(new_batch, address)
+
+
+  def on_evict(self, address: bytes) -> None:
+    """Function to drop the index of an address whose history was evicted, as it is built again from the full history on the next sync"""
+
+    with self.lock:
+      self.indexes.pop(address, None)
+
+
+  def top(self, address: str, k: int, metric: str = "count") -> List[Tuple[bytes, CounterpartyStats]]:
+    """Function to get the top k counterparties of an address, syncing its new transactions first"""
+
+    # Normalizes the address into its 20-byte value
+    address = addresses.normalize(address)
+
+    # Syncs the address, which updates its index through the listener
+    batch = self.store.get(address)
+
+    with self.lock:
+      index = self.indexes.get(address)
+
+      # Builds the index from the full history if the address was synced before the index existed
+      if index is None and len(batch):
+        index = self.indexes[address] = CounterpartyIndex()
+        index.update(batch, address)
+
+    # Returns the top counterparties (none if the address has no transactions)
+    return index.top(k, metric) if index is not None else []
+
+
+# The counterparty indexes of the shared transaction store
+indexes = CounterpartyIndexes(transaction_store.store)
+
+
+def get_top_counterparties(address: str, k: int, metric: str = "count") -> str:
+  """Function to get the top k counterparties of an address as a message"""
+
+  # Gets the top counterparties
+  top = indexes.top(address, k, metric)
+
+  # Checks if there are no counterparties
+  if not top:
+    return f"{address} has no transactions with other wallets."
+
+  # Creates a line for each counterparty
+  lines = [
+    f"{rank}. {addresses.to_hex(counterparty)}\n{stats.count} txs, in {stats.wei_in / 10**18:.4f} ETH, out {stats.wei_out / 10**18:.4f} ETH"
+    for rank, (counterparty, stats) in enumerate(top, 1)
+  ]
+
+  # Returns the message
+  return f"Top {len(top)} counterparties of {address} by {metric}\n\n" + "\n\n".join(lines)
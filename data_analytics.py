@@ -1,188 +1,105 @@
 # Module to do data analytics on the data returned by the Etherscan API
 
 import re
-import pytz, numpy
-from datetime import datetime
-from typing import List, Dict
-from etherscan_api import Transaction, get_normal_transactions
+import pytz
+from datetime import timedelta
+from typing import Dict, Iterable, List, Tuple
+from etherscan_api import Transaction
+import etherscan_api, transaction_store, time_series, addresses, hot_addresses, monthly_aggregates, cache, io_pool, local_time
+from transaction_store import TransactionBatch
+from wei import WEI_PER_ETHER
 
 
-def get_transactions_by_month(transactions: List[Transaction], month_num: int, year_num: int, timezone: pytz.timezone) -> List[Transaction]:
-  """Function to get the transactions in a specific month"""
-
-  # The list of transactions in a given month and year
-  month_transactions = []
-
-  # Iterates the list of transactions
-  for transaction in transactions:
-
-    # Creates a datetime object from the timestamp
-    date_obj = datetime.fromtimestamp(int(transaction.timeStamp))
-
-    # Localize the time to the timezone given
-    local_time = timezone.localize(date_obj, is_dst=None)
-
-    # Checks if the month and year match the wanted month and year
-    if local_time.month == month_num and local_time.year == year_num:
-
-      # Appends the transaction to the list
-      month_transactions.append(transaction)
-
-  # Returns the list of transactions
-  return month_transactions
+# The number of seconds a rendered graph is kept in the shared cache
+GRAPH_TTL = 3600.0
 
 
 def get_transactions_by_past_months(address: str, number_of_months: int, timezone: pytz.timezone) -> List[Transaction]:
   """Function to get the transactions for the past n months"""
 
-  # Gets the list of transactions from the API
-  transactions = get_normal_transactions(address)
-
-  # Gets the local time
-  local_time = timezone.localize(datetime.now(), is_dst=None)
-
-  # Gets the current month and year
-  current_month, current_year = local_time.month, local_time.year
-
-  # Subtract the number of months from the current month
-  month = current_month - number_of_months
-
-  # Gets the starting year
-  year = current_year
-
-  # Iterates while the starting month is less than or equal to 0
-  while month <= 0:
-
-    # Add 12 to the starting month
-    month += 12
-
-    # Gets the starting year as 1 less than the current year
-    year -= 1
-
-  # The list of transactions
-  transaction_list = []
-
-  # Iterates the months
-  while True:
+  # Counts the request, as the history of hot wallets is kept synced in the background
+  hot_addresses.tracker.record(address)
 
-    # Checks if the month and the year are the same as the current ones
-    if month == current_month and year == current_year:
+  # Gets the transaction history from the store
+  batch = transaction_store.store.get(address)
 
-      # Breaks the loop
-      break
+  # Gets the timestamps of the start of the first month and the start of the current month
+  start_time, end_time = time_series.month_window(number_of_months, timezone)
 
-    # Gets the transactions in the month
-    month_transactions = get_transactions_by_month(transactions, month, year, timezone)
+  # Returns the transactions in the window, found with binary search on the timestamps
+  return batch.window(start_time, end_time).to_transactions()
 
-    # Adds the month transaction to the transaction list
-    transaction_list += month_transactions
 
-    # Checks if the month is 12
-    if month == 12:
+def get_latest_transactions(address: str, number_of_results: int = 100) -> List[Transaction]:
+  """Function to get the latest transactions of a wallet, newest first, from the stored history if the wallet is hot"""
 
-      # Sets the month to 1
-      month = 1
+  # Counts the request
+  hot_addresses.tracker.record(address)
 
-      # Increase the year by 1
-      year += 1
+  # Asks Etherscan for the latest page if the wallet is not hot, as syncing its whole history would cost more
+  if not hot_addresses.tracker.is_hot(address):
+    return etherscan_api.get_normal_transactions(address, number_of_results)
 
-    # If the month isn't 12
-    else:
-
-      # Increase the month by 1
-      month += 1
-
-  # Returns the list of transactions
-  return transaction_list
-
-
-def net_for_a_month(month_transactions: List[Transaction], address: str) -> float:
-  """Function to get the net gain or net loss in a given month for the wallet"""
-
-  # The net gain or loss in Wei
-  net: int = 0
-
-  # Iterates the transactions
-  for transaction in month_transactions:
-
-    # Checks if the transaction is incoming
-    if transaction.to == address:
+  # Gets the transaction history from the store
+  batch = transaction_store.store.get(address)
 
-      # Increase the net by the transaction amount
-      net += int(transaction.value)
-
-    # Checks if the address is outgoing
-    elif transaction.__dict__["from"] == address:
-
-      # Decrease the net by the transaction amount
-      net -= int(transaction.value)
-
-  # Returns the net gain or loss in Ether
-  return float(net) / (10**18)
+  # Returns the last transactions, newest first
+  return batch.slice(max(0, len(batch) - number_of_results), len(batch)).to_transactions()[::-1]
 
 
 def net_for_past_months(address: str, months: int, timezone: pytz.timezone) -> Dict[int, float]:  
   """Function to get the mapping of months (maximum 6 months) to their net gain or loss"""
 
-  # Gets the list of transactions from the API
-  transactions = get_normal_transactions(address)
-
-  # Gets the local time currently
-  local_time = timezone.localize(datetime.now(), is_dst=None)
+  # Gets the transaction history from the store
+  batch = transaction_store.store.get(address)
 
-  # Gets the month and the year
-  current_month, current_year = local_time.month, local_time.year
+  # Gets the current month and the timestamp of its start
+  current_month = time_series.bucket_start(local_time.now(timezone), "month")
+  end_time = time_series.to_timestamp(current_month, timezone)
 
-  # Subtract the number of months from the current month
-  month = current_month - months
+  def compute() -> Dict[int, float]:
+    """Function to read the net gain or loss of each month from the monthly aggregates"""
 
-  # Gets the starting year
-  year = current_year
+    # Gets the months of the window, which costs one row per month however long the history is
+    end_month = monthly_aggregates.month_index(current_month)
+    aggregates = monthly_aggregates.table.months(address, timezone, end_month - months, end_month)
 
-  # Checks if the starting month is less than or equal to 0
-  if month <= 0:
+    # Returns the dictionary of the net gain or loss in Ether for each month
+    return {aggregate.month % 12 + 1: aggregate.net / WEI_PER_ETHER for aggregate in aggregates}
 
-    # Add 12 to the starting month
-    month += 12
+  # Returns the months from memory if they were precomputed for the same history and the same current month
+  return hot_addresses.precomputer.cached((addresses.normalize(address), "net", months, timezone.zone), (len(batch), batch.last_block(), end_time), compute)
 
-    # Gets the starting year as 1 less than the current year
-    year -= 1
 
-  # The dictionary that maps the month number to the net gain or loss in Ether
-  month_net_dict: Dict[int, float] = {}
+def get_cash_flow(address: str, resolution: str, periods: int, timezone: pytz.timezone) -> str:
+  """Function to get the inflow, outflow, gas spent and balance of a wallet for the past n days, weeks or months"""
 
-  # Iterates the months
-  while True:
+  # Gets the transaction history from the store
+  batch = transaction_store.store.get(address)
 
-    # Checks if the month and the year are the same as the current ones
-    if month == current_month and year == current_year:
+  # Gets the start of the current day, week or month
+  current = time_series.bucket_start(local_time.now(timezone), resolution)
 
-      # Breaks the loop
-      break
+  # Gets the start of the first period
+  if resolution == "month":
+    first = time_series.shift_months(current, periods - 1)
+  else:
+    first = current - timedelta(days=(7 if resolution == "week" else 1) * (periods - 1))
 
-    # Gets the transactions in the month
-    month_transactions = get_transactions_by_month(transactions, month, year, timezone)
+  # Gets the cash flow of each period up to now
+  series = time_series.CashFlowSeries(batch, address).resample(resolution, timezone, time_series.to_timestamp(first, timezone))
 
-    # Gets the net gain or loss in the month
-    month_net_dict[month] = net_for_a_month(month_transactions, address)
+  # The format of the label of each period
+  label_format = {"day": "%d/%m/%Y", "week": "w/c %d/%m/%Y", "month": "%b %Y"}[resolution]
 
-    # Checks if the month is 12
-    if month == 12:
-
-      # Sets the month to 1
-      month = 1
-
-      # Increase the year by 1
-      year += 1
-
-    # If the month isn't 12
-    else:
+  # Creates a line for each period
+  lines = [
+    f"{start.strftime(label_format)}: +{inflow:.4f} / -{outflow:.4f} ETH, gas {gas:.4f} ETH, balance {balance:.4f} ETH"
+    for start, inflow, outflow, gas, balance in zip(series.starts, series.inflow, series.outflow, series.gas, series.balance)
+  ]
 
-      # Increase the month by 1
-      month += 1
-
-  # Returns the dictionary of the net gain or loss in Ether for each month
-  return month_net_dict
+  # Returns the cash flow
+  return f"Cash flow of {address} (balance from normal transactions only)\n\n" + "\n".join(lines)
 
 
 class ASCIIGraph:
@@ -193,6 +110,9 @@ class ASCIIGraph:
 
   # The maximum number of rows that can be displayed
   MAX_ROWS = 13
+
+  # The maximum number of months, as more month names do not fit in the maximum width
+  MAX_MONTHS = 6
   
   # The dictionary that maps the month number to the short name of the month
   month_dict = {
@@ -225,11 +145,17 @@ class ASCIIGraph:
   
   def __init__(self, month_net_dict: Dict[int, float]) -> None:
     self.month_net_dict = month_net_dict
+
+    # The width of the graph
+    self.width = self.MAX_WIDTH
     
 
   def write_value_to_the_graph(self, row_list: List[List[str]], row: int, line_position: int, net: float) -> List[List[str]]:
     """Function to write the value of the net gain or net loss to the graph"""
 
+    # Imports numpy here because it is slow to import and only needed to draw graphs
+    import numpy
+
     # Convert the net value to a string after rounding to 3 significant figures
     net_str = str(numpy.format_float_positional(net, precision=3, unique=False, fractional=False, trim="-"))
 
@@ -258,10 +184,10 @@ class ASCIIGraph:
       start_pos = 0
 
     # Checks if the end position of the string is greater than the length of the line
-    elif start_pos + net_length > self.MAX_WIDTH:
+    elif start_pos + net_length > self.width:
 
       # Sets the start position to the length of the line minus the length of the string
-      start_pos = self.MAX_WIDTH - net_length
+      start_pos = self.width - net_length
       
     # Adds the net value to the line
     row_list[row][start_pos: start_pos + net_length] = net_str
@@ -270,8 +196,8 @@ class ASCIIGraph:
     return row_list
   
   
-  def write_column(self, row_list: List[List[str]], line_position: int, length: int, x_axis_row: int, net: int) -> List[List[str]]:
-    """Function to create the lines on the graph"""
+  def write_column(self, row_list: List[List[str]], line_position: int, length: int, x_axis_row: int, net: int, symbol: str = "|", label: bool = True) -> List[List[str]]:
+    """Function to create the lines on the graph, drawn with the symbol and labelled with the value unless label is False"""
     
     # Checks if the value is negative
     if net < 0:
@@ -280,7 +206,8 @@ class ASCIIGraph:
       row_range = range(x_axis_row + 1, x_axis_row + 1 + length)
 
       # Calls the function to write the value of net to the graph
-      row_list = self.write_value_to_the_graph(row_list, x_axis_row + length + 1, line_position, net)
+      if label:
+        row_list = self.write_value_to_the_graph(row_list, x_axis_row + length + 1, line_position, net)
 
     # If the value isn't negative
     else:
@@ -289,41 +216,26 @@ class ASCIIGraph:
       row_range = range(x_axis_row - length, x_axis_row)
 
       # Calls the function to write the value of net to the graph
-      row_list = self.write_value_to_the_graph(row_list, x_axis_row - length - 1, line_position, net)
+      if label:
+        row_list = self.write_value_to_the_graph(row_list, x_axis_row - length - 1, line_position, net)
 
     # Iterates the row range
     for i in row_range:
 
-      # Sets the value of the line position inside each row to a pipe character
-      row_list[i][line_position] = "|"
+      # Sets the value of the line position inside each row to the symbol
+      row_list[i][line_position] = symbol
 
     # Returns the edited row list
     return row_list
 
-    
-  def construct(self) -> str:
-    """Function to build an ascii graph with the list of months"""
 
-    # The values in the dictionary
-    values = self.month_net_dict.values()
+  def get_scale(self, values: Iterable[float]) -> Tuple[float, int]:
+    """Function to get the scale factor (how much ether for 1 pipe character) and the x axis row that fit the values"""
 
-    # Gets the length of the dictionary
-    dict_length = len(values)
-      
-    # Highest net
-    highest = max(values)
-  
-    # Lowest net
-    lowest = min(values)
-  
-    # Checks if the lowest is more than zero
-    if lowest >= 0:
-
-      # Sets the lowest to 0
-      lowest = 0
-  
-    # The list of rows
-    row_list: List[List[str]] = [[" "] * self.MAX_WIDTH for i in range(self.MAX_ROWS + 1)]
+    # Gets the highest and lowest values, keeping 0 in the range so the x axis is always drawn
+    values = list(values)
+    highest = max(max(values), 0)
+    lowest = min(min(values), 0)
 
     # Scale factor (how much ether for 1 pipe character)
     scale_factor: float = (highest - lowest) / (self.MAX_ROWS - 3)
@@ -341,13 +253,32 @@ class ASCIIGraph:
     else:
 
       # Gets the number of pipe characters the lowest value will take up
-      num_pipe_chars: int = abs(lowest // scale_factor)
+      num_pipe_chars = int(abs(lowest // scale_factor))
 
-      # Gets the x axis row
-      x_axis_row = -1 + num_pipe_chars
+      # Gets the x axis row, leaving room below it for the lowest line and its value
+      x_axis_row = self.MAX_ROWS - 1 - num_pipe_chars
+
+    # Returns the scale factor and the x axis row
+    return scale_factor, x_axis_row
+
+    
+  def construct(self) -> str:
+    """Function to build an ascii graph with the list of months"""
+
+    # The values in the dictionary
+    values = self.month_net_dict.values()
+
+    # Gets the length of the dictionary
+    dict_length = len(values)
+
+    # The list of rows
+    row_list: List[List[str]] = [[" "] * self.width for i in range(self.MAX_ROWS + 1)]
+
+    # Gets the scale factor and the x axis row
+    scale_factor, x_axis_row = self.get_scale(values)
 
     # Change the x axis row to have "-" characters
-    row_list[x_axis_row] = ["-"] * self.MAX_WIDTH
+    row_list[x_axis_row] = ["-"] * self.width
 
     # Gets the positions from the length of the dictionary
     positions = self.position_dict[dict_length]
@@ -380,15 +311,197 @@ class ASCIIGraph:
     return "\n".join("".join(row) for row in row_list)
 
 
+class MultiSeriesGraph(ASCIIGraph):
+  """Class that represents an ascii graph of several wallets, with a group of side by side columns for every month and a symbol for every wallet"""
+
+  # The symbols of the wallets, which also limit the number of wallets on one graph
+  SYMBOLS = "|#*+o"
+
+
+  def __init__(self, series: Dict[str, Dict[int, float]]) -> None:
+
+    # The dictionary that maps the label of each wallet to its month net dictionary
+    self.series = series
+
+    # The months, which are the same for every wallet
+    self.months = list(next(iter(series.values()), {}))
+
+    # The width of the group of each month, with room for the month name and a gap after the columns
+    self.group_width = self.get_group_width(len(series))
+
+    # The width of the graph
+    self.width = self.group_width * len(self.months)
+
+
+  @staticmethod
+  def get_group_width(number_of_wallets: int) -> int:
+    """Function to get the width of the group of each month, with room for the month name and a gap after the columns"""
+    return max(4, number_of_wallets + 1)
+
+
+  @classmethod
+  def max_months(cls, number_of_wallets: int) -> int:
+    """Function to get the most months whose groups fit in the maximum width for a number of wallets"""
+    return cls.MAX_WIDTH // cls.get_group_width(number_of_wallets)
+
+
+  def construct(self) -> str:
+    """Function to build an ascii graph with a column for every wallet in every month, followed by the legend"""
+
+    # The list of rows
+    row_list: List[List[str]] = [[" "] * self.width for i in range(self.MAX_ROWS + 1)]
+
+    # Gets the scale factor and the x axis row that fit the values of every wallet
+    scale_factor, x_axis_row = self.get_scale([net_value for month_net_dict in self.series.values() for net_value in month_net_dict.values()] or [0])
+
+    # Change the x axis row to have "-" characters
+    row_list[x_axis_row] = ["-"] * self.width
+
+    # Iterates the months
+    for index, month_num in enumerate(self.months):
+
+      # Gets the position of the group of the month
+      group_position = index * self.group_width
+
+      # Writes the month to the x axis row
+      row_list[x_axis_row][group_position: group_position + 3] = self.month_dict[month_num]
+
+      # Writes the column of every wallet next to each other, without values as they would overlap
+      for wallet_index, (symbol, month_net_dict) in enumerate(zip(self.SYMBOLS, self.series.values())):
+        net_value = month_net_dict[month_num]
+        row_list = self.write_column(row_list, group_position + wallet_index, abs(int(net_value / scale_factor)), x_axis_row, net_value, symbol, label=False)
+
+    # Creates the legend with the symbol of every wallet and the scale
+    legend = [f"{symbol} {label}" for symbol, label in zip(self.SYMBOLS, self.series)]
+    legend.append(f"1 character = {scale_factor:.4g} ETH")
+
+    # Returns the ascii graph and its legend
+    return "\n".join("".join(row).rstrip() for row in row_list).rstrip() + "\n\n" + "\n".join(legend)
+
+
+def render_graph(address: str, number_of_months: int, timezone: pytz.timezone) -> str:
+  """Function to render the ascii graph for the past n months, reusing the graph rendered for the same history"""
+
+  # Gets the transaction history from the store and the end of the window, which version the graph
+  batch = transaction_store.store.get(address)
+  _, end_time = time_series.month_window(number_of_months, timezone)
+
+  # The key of the graph in the shared cache
+  key = f"{addresses.to_hex(addresses.normalize(address))}:{number_of_months}:{timezone.zone}"
+
+  def compute() -> str:
+    """Function to get the graph from another replica if it rendered it for the same history, rendering it otherwise"""
+
+    # Returns the graph rendered by another replica
+    shared = cache.cache.get("graph", key, local=False)
+    if shared is not None and shared["version"] == [len(batch), batch.last_block(), end_time]:
+      return shared["graph"]
+
+    # Renders the ascii graph of the month net dictionary
+    graph = ASCIIGraph(net_for_past_months(address, number_of_months, timezone)).construct()
+
+    # Notes the months of the window that were moved from another timezone without the transactions near their start
+    first_exact_month = monthly_aggregates.table.first_exact_month(address, timezone)
+    if first_exact_month is not None and first_exact_month > monthly_aggregates.month_index(local_time.now(timezone)) - number_of_months:
+      graph += f"\n\n(months before {ASCIIGraph.month_dict[first_exact_month % 12 + 1]} {first_exact_month // 12} may be off by the transactions near their start, which are no longer kept)"
+
+    # Shares the graph with the other replicas
+    cache.cache.set("graph", key, {"version": [len(batch), batch.last_block(), end_time], "graph": graph}, GRAPH_TTL, local=False)
+    return graph
+
+  # Returns the graph from memory if it was rendered for the same history and the same current month
+  return hot_addresses.precomputer.cached((addresses.normalize(address), "graph", number_of_months, timezone.zone), (len(batch), batch.last_block(), end_time), compute)
+
+
 def get_graph(address:str, number_of_months: int, timezone: pytz.timezone) -> str:
   """Function to get the ascii graph for the past n months"""
 
-  # Gets the month net dictionary
-  month_net_dict = net_for_past_months(address, number_of_months, timezone)
+  # Counts the request with the task that renders the graph again, so it is ready in memory if the wallet is hot
+  hot_addresses.tracker.record(address, (render_graph, addresses.to_hex(addresses.normalize(address)), number_of_months, timezone))
 
   # Returns the ascii graph
-  return ASCIIGraph(month_net_dict).construct()
-  
+  return render_graph(address, number_of_months, timezone)
+
+
+def short_address(address: bytes) -> str:
+  """Function to shorten an address to its first and last characters for labels"""
+  address = addresses.to_hex(address)
+  return f"{address[:6]}...{address[-4:]}"
+
+
+def compare_wallets(address_list: List[str], number_of_months: int, timezone: pytz.timezone) -> str:
+  """Function to get the graph of the net gain or loss of several wallets for the past n months, with their totals and the combined totals
+
+  The histories are fetched at the same time, so the comparison takes about as long as the slowest wallet, and the
+  months of every wallet are summed in one pass over the stacked transactions.
+  """
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  # Normalizes the addresses, dropping the duplicates
+  wallets = list(dict.fromkeys(addresses.normalize(address) for address in address_list))
+
+  # Keeps the number of months to the groups that fit in the width of the graph
+  number_of_months = min(number_of_months, MultiSeriesGraph.max_months(len(wallets)))
+
+  # Counts the request for every wallet
+  for wallet in wallets:
+    hot_addresses.tracker.record(wallet)
+
+  # Gets the transaction histories from the store at the same time in the fetch pool, as this runs in the I/O pool (the
+  # fetches share the Etherscan rate limit)
+  futures = [io_pool.submit_fetch(transaction_store.store.get, wallet) for wallet in wallets]
+  batches = [future.result() for future in futures]
+
+  # Gets the month boundaries from the start of the first month to the start of the current month
+  start_time, end_time = time_series.month_window(number_of_months, timezone)
+  starts, boundaries = time_series.bucket_boundaries("month", timezone, start_time, end_time)
+
+  # Stacks the transactions of the window of every wallet
+  windows = [batch.window(start_time, end_time) for batch in batches]
+  stacked = TransactionBatch.join(windows)
+
+  # Gets the wallet of every row and its address, so the direction of every row is checked against its own wallet
+  owner = numpy.repeat(numpy.arange(len(wallets)), [len(window) for window in windows])
+  owner_address = numpy.array(wallets, dtype="S20")[owner]
+  incoming = stacked.receiver == owner_address
+  outgoing = stacked.sender == owner_address
+
+  # Failed transactions do not move any Ether, but the sender still pays for gas
+  succeeded = ~stacked.is_error
+
+  # Gets the group of every row, which is its month within its wallet
+  groups = owner * number_of_months + numpy.searchsorted(boundaries, stacked.timestamp, "right") - 1
+  number_of_groups = len(wallets) * number_of_months
+
+  # Gets the exact inflow, outflow and gas spent in wei of every month of every wallet
+  inflow = stacked.value.where(incoming & succeeded).group_sums(groups, number_of_groups).to_ints()
+  outflow = stacked.value.where(outgoing & succeeded).group_sums(groups, number_of_groups).to_ints()
+  gas = stacked.fees().where(outgoing).group_sums(groups, number_of_groups).to_ints()
+
+  # Creates the month net dictionary of every wallet
+  series = {
+    short_address(wallet): {
+      starts[month].month: (inflow[group] - outflow[group] - gas[group]) / WEI_PER_ETHER
+      for month, group in enumerate(range(index * number_of_months, (index + 1) * number_of_months))
+    }
+    for index, wallet in enumerate(wallets)
+  }
+
+  # Creates a line with the totals of every wallet
+  lines = []
+  for index, wallet in enumerate(wallets):
+    rows = slice(index * number_of_months, (index + 1) * number_of_months)
+    wallet_inflow, wallet_outflow, wallet_gas = sum(inflow[rows]), sum(outflow[rows]), sum(gas[rows])
+    lines.append(f"{short_address(wallet)}: +{wallet_inflow / WEI_PER_ETHER:.4f} / -{wallet_outflow / WEI_PER_ETHER:.4f} ETH, gas {wallet_gas / WEI_PER_ETHER:.4f} ETH, net {(wallet_inflow - wallet_outflow - wallet_gas) / WEI_PER_ETHER:.4f} ETH")
+
+  # Adds the combined totals of the wallets
+  lines.append(f"Combined: +{sum(inflow) / WEI_PER_ETHER:.4f} / -{sum(outflow) / WEI_PER_ETHER:.4f} ETH, gas {sum(gas) / WEI_PER_ETHER:.4f} ETH, net {(sum(inflow) - sum(outflow) - sum(gas)) / WEI_PER_ETHER:.4f} ETH")
+
+  # Returns the graph followed by the totals
+  return MultiSeriesGraph(series).construct() + "\n\n" + "\n".join(lines)
+
 
 if __name__ == "__main__":
 
@@ -1,9 +1,21 @@
-import os
+import os, re, asyncio, functools, logging
+import pytz
 import discord
 from discord.ext import commands
 from discord.commands import Option, OptionChoice
 import etherscan_api
+import balance_batcher
+import watcher
+import price_ticker
+import portfolio
 import data_analytics
+import io_pool
+import admission
+import circuit_breaker
+import chain_backend
+import export
+import transaction_store
+import timezone_store
 
 # DISCORD TOKEN
 discord_token = os.environ['DISCORD_TOKEN']
@@ -14,21 +26,116 @@ bot = commands.Bot(command_prefix='>')
 # Create a test server for faster slash command implementation
 test_guild_id = [962620301055778866]
 
+# The number of seconds a deferred command waits for its data before answering with cached or partial data
+RESPONSE_DEADLINE = float(os.environ.get("DISCORD_RESPONSE_DEADLINE", 8))
+
+# The largest attachment the bot can upload in bytes (without boosts)
+MAX_UPLOAD_SIZE = int(os.environ.get("DISCORD_MAX_UPLOAD_SIZE", 8 * 1024 * 1024))
+
 # convert hexadecimal to decimal
 def hex_to_dec(hex_string):
   return int(hex_string, 16)
 
+# Acknowledges a command so Discord does not drop it, unless it was already acknowledged while queued
+async def defer(ctx):
+  if not ctx.response.is_done():
+    await ctx.defer()
+
+# Runs a slash command through the admission controller, replying with a busy message if the command is turned away
+def admitted(command):
+  def decorator(handler):
+    @functools.wraps(handler)
+    async def wrapper(ctx, *args, **kwargs):
+      chat_id = ctx.guild.id if ctx.guild is not None else ctx.channel.id
+      try:
+        ticket = admission.controller.admit(f"discord:{ctx.author.id}", f"discord:{chat_id}", admission.get_cost(command))
+      except admission.Busy as e:
+        return await ctx.respond(admission.busy_message(e), ephemeral=True)
+      try:
+        # Acknowledges the command while it waits in the queue
+        if not ticket.future.done():
+          await defer(ctx)
+          await asyncio.wrap_future(ticket.future)
+        return await handler(ctx, *args, **kwargs)
+      # Tells the user to retry once the upstream has had time to recover
+      except circuit_breaker.CircuitOpen as e:
+        await ctx.respond(f"{e}.")
+      # Tells the user what was wrong with the input, like an invalid address
+      except ValueError as e:
+        await ctx.respond(f"{e}.")
+      finally:
+        ticket.release()
+    return wrapper
+  return decorator
+
+# Edits a partial answer with the full answer once the background work is done
+async def edit_when_done(message, task, make_embed):
+  try:
+    embed = make_embed(await task)
+  except Exception as e:
+    logging.error(e)
+    embed = discord.Embed(title="Crypto Analytics Bot", description="Sorry, the data could not be fetched. Please try again later.", color=discord.Color.dark_red())
+  await message.edit(embed=embed)
+
+# Answers a deferred command with the result of a background task, or with a partial answer that is edited once the task is done
+async def respond_by_deadline(ctx, task, make_embed, partial_embed):
+  done, _ = await asyncio.wait({task}, timeout=RESPONSE_DEADLINE)
+  if done:
+    await ctx.respond(embed=make_embed(task.result()))
+    return
+  message = await ctx.respond(embed=partial_embed)
+  asyncio.ensure_future(edit_when_done(message, task, make_embed))
+
+# Creates the embed of an ETH balance, with a note when the balance is cached or the price is missing
+def ethbalance_embed(address, balance, price, note=None):
+  embed = discord.Embed(title="Crypto Analytics bot", color=discord.Color.dark_red())
+  if balance is None:
+    embed.add_field(name="ETH Balance", value=f"{address} is not a valid ETH address")
+  elif price is None:
+    embed.add_field(name="ETH Balance", value=f"ETH balance of {address} is **{balance} ETH** (USD price not available yet)")
+  else:
+    embed.add_field(name="ETH Balance", value=f"ETH balance of {address} is **{balance} ETH** (**{balance * price} USD**)")
+  if note:
+    embed.add_field(name="Note", value=note, inline = False)
+  embed.set_footer(text="Data fetched from Etherscan.io and Coingecko.com")
+  return embed
+
 # Slash command for ETH Balance
 @bot.slash_command(name="ethbalance")
+@admitted("ethbalance")
 async def ethbalance(ctx, address: Option(str, 'Enter your ETH address', required = True)):
   """GET ETH BALANCE"""
 
-  data = etherscan_api.get_ether_balance(address)
-  converted_data = etherscan_api.convert_eth_to_usd(data)
-  embed = discord.Embed(title="Crypto Analytics bot", color=discord.Color.dark_red())
-  embed.add_field(name="ETH Balance", value=f"ETH balance of {address} is **{data} ETH** (**{converted_data} USD**)")
-  embed.set_footer(text="Data fetched from Etherscan.io and Coingecko.com")
-  await ctx.respond(embed=embed)
+  # Acknowledges the command right away so Discord does not drop it
+  await defer(ctx)
+
+  # Fetches the balance and the price at the same time
+  balance_task = asyncio.ensure_future(balance_batcher.batcher.get_balance_async(address))
+  price_task = io_pool.run_async(price_ticker.ticker.get_price, "ethereum", "usd")
+  await asyncio.wait({balance_task, price_task}, timeout=RESPONSE_DEADLINE)
+  price = price_task.result() if price_task.done() and not price_task.exception() else None
+
+  # Answers with the fresh balance if it arrived in time
+  if balance_task.done() and not isinstance(balance_task.exception(), circuit_breaker.CircuitOpen):
+    await ctx.respond(embed=ethbalance_embed(address, balance_task.result(), price))
+    return
+
+  # Answers with the last known balance if Etherscan is down
+  if balance_task.done():
+    cached = balance_batcher.batcher.get_cached_balance(address)
+    if cached is None:
+      raise balance_task.exception()
+    await ctx.respond(embed=ethbalance_embed(address, cached[0], price, f"Etherscan is unavailable, this balance is from {cached[1]:.0f} seconds ago"))
+    return
+
+  # Answers with the last known balance, or says the balance is still loading, and updates the answer once it arrives
+  cached = balance_batcher.batcher.get_cached_balance(address)
+  if cached is not None:
+    partial_embed = ethbalance_embed(address, cached[0], price, f"Etherscan is slow, this balance is from {cached[1]:.0f} seconds ago")
+  else:
+    partial_embed = discord.Embed(title="Crypto Analytics bot", description=f"Etherscan is slow, the balance of {address} is still loading...", color=discord.Color.dark_red())
+  message = await ctx.respond(embed=partial_embed)
+  asyncio.ensure_future(edit_when_done(message, balance_task, lambda balance: ethbalance_embed(address, balance, price_ticker.ticker.snapshot.get("ethereum", {}).get("usd"))))
 
 # Slash command for ETH to USD and USD to ETH with OptionChoice
 @bot.slash_command(name="convert")
@@ -36,35 +143,76 @@ async def convert(ctx, amount: Option(str, 'Enter the amount to convert', requir
   
   """CONVERT ETH TO USD OR USD TO ETH"""
 
+  # Checks the amount is a number
+  if not re.search(r"^\d+$|^\d+\.\d+$", amount):
+    return await ctx.respond("Invalid amount given, please enter a number")
+
+  if choice not in ("eth_to_usd", "usd_to_eth"):
+    return await ctx.respond("Please enter a valid choice")
+
+  # Converts the amount in the I/O pool, as the first price lookup can wait on CoinGecko, and tells the user to retry if the price is unavailable
+  try:
+    if choice == "eth_to_usd":
+      data = await io_pool.run_async(etherscan_api.convert_eth_to_usd, amount)
+    else:
+      data = await io_pool.run_async(etherscan_api.convert_usd_to_eth, amount)
+  except circuit_breaker.CircuitOpen as e:
+    return await ctx.respond(f"{e}.")
+
+  embed = discord.Embed(title="Crypto Analytics bot", color=discord.Color.dark_red())
   if choice == "eth_to_usd":
-    data = etherscan_api.convert_eth_to_usd(amount)
-    embed = discord.Embed(title="Crypto Analytics bot", color=discord.Color.dark_red())
     embed.add_field(name="ETH to USD", value=f"{amount} ETH is **{data} USD**")
-    embed.set_footer(text="Data fetched from Coingecko.com")
-    await ctx.respond(embed=embed)
-  elif choice == "usd_to_eth":
-    data = etherscan_api.convert_usd_to_eth(amount)
-    embed = discord.Embed(title="Crypto Analytics bot", color=discord.Color.dark_red())
+  else:
     embed.add_field(name="USD to ETH", value=f"{amount} USD is **{data} ETH**")
-    embed.set_footer(text="Data fetched from Coingecko.com")
-    await ctx.respond(embed=embed)
+  age = price_ticker.ticker.staleness()
+  if age is not None:
+    embed.add_field(name="Note", value=f"CoinGecko is unavailable, this price is from {age:.0f} seconds ago", inline = False)
+  embed.set_footer(text="Data fetched from Coingecko.com")
+  await ctx.respond(embed=embed)
+
+# Slash command for the price of a crypto asset
+@bot.slash_command(name="price")
+@admitted("price")
+async def price(ctx, asset: Option(str, 'Enter the CoinGecko ID of the asset', required = False, default = "ethereum"), currency: Option(str, 'Enter the currency', required = False, default = "usd")):
+  """GET THE PRICE OF A CRYPTO ASSET"""
+  data = price_ticker.ticker.get_price(asset, currency)
+  embed = discord.Embed(title="Crypto Analytics bot", color=discord.Color.dark_red())
+  if data is None:
+    embed.add_field(name="Price", value=f"The price of {asset} in {currency.upper()} is not tracked")
   else:
-    await ctx.respond("Please enter a valid choice")
+    embed.add_field(name="Price", value=f"The price of {asset} is **{data} {currency.upper()}**")
+  age = price_ticker.ticker.staleness()
+  if age is not None:
+    embed.add_field(name="Note", value=f"CoinGecko is unavailable, this price is from {age:.0f} seconds ago", inline = False)
+  embed.set_footer(text="Data fetched from Coingecko.com")
+  await ctx.respond(embed=embed)
 
 # Slash command for get transaction details
 @bot.slash_command(name="gettxdetails")
+@admitted("gettxdetails")
 async def gettxdetails(ctx, txhash: Option(str, 'Enter your transaction hash', required = True)):
   """GET TRANSACTION DETAILS"""
-  data = etherscan_api.get_transaction_receipt(txhash)
 
-  embed = discord.Embed(title="Crypto Analytics Bot", color=discord.Color.dark_red())
-  embed.add_field(name="From", value=f"{data['from']}", inline = False)
-  embed.add_field(name="To", value=f"{data['to']}", inline = False)
-  embed.add_field(name="Gas Used", value=f"{hex_to_dec(data['gasUsed'])}", inline = False)
-  embed.add_field(name="Status", value="Success" if hex_to_dec(data['status']) == 1 else "Failed", inline = False)
-  embed.add_field(name="Etherscan Link", value=f"https://etherscan.io/tx/{txhash}", inline = False)
-  embed.set_footer(text="Data fetched from Etherscan.io")
-  await ctx.respond(embed=embed)
+  # Acknowledges the command right away so Discord does not drop it
+  await defer(ctx)
+
+  def make_embed(data):
+    if data is None:
+      return discord.Embed(title="Crypto Analytics Bot", description="Transaction not found or still pending", color=discord.Color.dark_red())
+    embed = discord.Embed(title="Crypto Analytics Bot", color=discord.Color.dark_red())
+    embed.add_field(name="From", value=f"{data['from']}", inline = False)
+    embed.add_field(name="To", value=f"{data['to']}", inline = False)
+    embed.add_field(name="Gas Used", value=f"{hex_to_dec(data['gasUsed'])}", inline = False)
+    embed.add_field(name="Status", value="Success" if hex_to_dec(data['status']) == 1 else "Failed", inline = False)
+    embed.add_field(name="Etherscan Link", value=f"https://etherscan.io/tx/{txhash}", inline = False)
+    embed.set_footer(text="Data fetched from Etherscan.io")
+    return embed
+
+  # Answers with the link to the transaction while the receipt is still loading
+  partial_embed = discord.Embed(title="Crypto Analytics Bot", description="Etherscan is slow, the receipt is still loading...", color=discord.Color.dark_red())
+  partial_embed.add_field(name="Etherscan Link", value=f"https://etherscan.io/tx/{txhash}", inline = False)
+
+  await respond_by_deadline(ctx, io_pool.run_async(chain_backend.get_transaction_receipt, txhash), make_embed, partial_embed)
 
 # Implement moralis_api
 @bot.slash_command(name="get_nft_owners")
@@ -92,5 +240,93 @@ async def token_id_metadata(ctx, address: Option(str, 'Enter the NFT contract ad
   embed.set_footer(text="Data fetched from Moralis.io")
   await ctx.respond(embed=embed)
 
+# Slash command for the ERC-20 token portfolio of a wallet
+@bot.slash_command(name="portfolio")
+@admitted("portfolio")
+async def get_portfolio(ctx, address: Option(str, 'Enter your ETH address', required = True)):
+  """GET ERC-20 TOKEN PORTFOLIO"""
+
+  # Acknowledges the command right away so Discord does not drop it
+  await defer(ctx)
+
+  def make_embed(data):
+    holdings, complete = data
+    embed = discord.Embed(title="Crypto Analytics Bot", description=None if complete else portfolio.TRUNCATION_NOTE, color=discord.Color.dark_red())
+    total = sum(holding.value for holding in holdings if holding.value is not None)
+    embed.add_field(name="Total Value", value=f"**{total:,.2f} USD**", inline = False)
+    for holding in holdings[:20]:
+      value = f"{holding.balance:,.4f}" + (f" (**{holding.value:,.2f} USD**)" if holding.value is not None else "")
+      embed.add_field(name=f"{holding.symbol}", value=value, inline = True)
+    embed.set_footer(text="Data fetched from Etherscan.io and Coingecko.com")
+    return embed
+
+  partial_embed = discord.Embed(title="Crypto Analytics Bot", description=f"The portfolio of {address} is still loading...", color=discord.Color.dark_red())
+
+  await respond_by_deadline(ctx, io_pool.run_async(portfolio.get_portfolio, address), make_embed, partial_embed)
+
+# Slash command to export the full transaction history of a wallet as a compressed CSV file
+@bot.slash_command(name="export")
+@admitted("export")
+async def export_history(ctx, address: Option(str, 'Enter your ETH address', required = True)):
+  """EXPORT THE TRANSACTION HISTORY"""
+
+  # Acknowledges the command right away so Discord does not drop it
+  await defer(ctx)
+
+  history = await io_pool.run_async(export.export_history, address)
+  try:
+    if history.size > MAX_UPLOAD_SIZE:
+      return await ctx.respond(f"The history of {address} is too large to upload ({history.size / 1024 / 1024:.1f} MB)")
+    note = transaction_store.store.truncation_note(address)
+    await ctx.respond(f"{history.rows} transactions of {address}" + (f"\n{note}" if note is not None else ""), file=discord.File(history.file, filename=history.filename))
+  finally:
+    history.close()
+
+# The key of a channel in the saved timezones, which are shared with the Telegram chats
+def timezone_key(channel_id):
+  return f"discord:{channel_id}"
+
+# Slash command to set the timezone of the channel, used for the times in its alerts
+@bot.slash_command(name="settimezone")
+async def settimezone(ctx, timezone: Option(str, 'Enter the timezone, like Asia/Singapore', required = True)):
+  """SET THE TIMEZONE OF THIS CHANNEL"""
+  if timezone not in pytz.all_timezones_set:
+    return await ctx.respond("Invalid timezone entered, please enter a valid timezone in the format \"Continent/Country\".", ephemeral=True)
+  await io_pool.run_async(timezone_store.save_timezone_to_db, timezone_key(ctx.channel.id), timezone)
+  await ctx.respond(f"The timezone of this channel is now {timezone}")
+
+# Slash command to watch a wallet for new transactions
+@bot.slash_command(name="watch")
+@admitted("watch")
+async def watch(ctx, address: Option(str, 'Enter the ETH address to watch', required = True)):
+  """WATCH A WALLET FOR NEW TRANSACTIONS"""
+  await io_pool.run_async(watcher.watcher.subscribe, address, "discord", ctx.channel.id)
+  embed = discord.Embed(title="Crypto Analytics Bot", color=discord.Color.dark_red())
+  embed.add_field(name="Watching", value=f"This channel will be notified of new transactions for {address}", inline = False)
+  await ctx.respond(embed=embed)
+
+# Slash command to stop watching a wallet
+@bot.slash_command(name="unwatch")
+async def unwatch(ctx, address: Option(str, 'Enter the ETH address to stop watching', required = True)):
+  """STOP WATCHING A WALLET"""
+  if watcher.watcher.unsubscribe(address, "discord", ctx.channel.id):
+    await ctx.respond(f"This channel will no longer be notified of new transactions for {address}")
+  else:
+    await ctx.respond(f"{address} is not being watched in this channel")
+
+# Sends the new transactions of a watched wallet to a channel (called from the watcher thread)
+def send_watch_alert(channel_id, address, transactions):
+  channel = bot.get_channel(int(channel_id))
+  if channel is None:
+    return
+  timezone = timezone_store.get_timezone_from_db(timezone_key(channel_id))
+  embed = discord.Embed(title="Crypto Analytics Bot", color=discord.Color.dark_red())
+  for transaction in transactions[:25]:
+    embed.add_field(name=f"New transaction for {address}", value=transaction.read(timezone, False), inline = False)
+  embed.set_footer(text="Data fetched from Etherscan.io")
+  asyncio.run_coroutine_threadsafe(channel.send(embed=embed), bot.loop)
+
+watcher.watcher.add_notifier("discord", send_watch_alert)
+
 if __name__ == "__main__":
   bot.run(discord_token)
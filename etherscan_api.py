@@ -1,13 +1,81 @@
 # Module that wraps the Etherscan API
 
-import os, logging
+import logging
 import pytz
-from datetime import datetime
-from typing import List, Dict, Optional
-from httpx_client import s
+from typing import Callable, Dict, Iterator, List, Optional
+import httpx_client, single_flight, price_ticker, addresses, key_pool, circuit_breaker, local_time, txlist_stream
 
-# Get the Etherscan API key
-API_KEY = os.environ["ETHERSCAN_KEY"]
+
+def get_api_key() -> str:
+  """Function to get the first Etherscan API key (requests take their keys from the key pool)"""
+  return key_pool.etherscan.first_key()
+
+
+def request_json(request_str: str, parse: Optional[Callable[[Iterator[bytes]], dict]] = None) -> dict:
+  """Function to make a request to the API with a key from the pool, retrying until it succeeds or the circuit opens
+
+  If a parse function is given, the response body is streamed into it as chunks of bytes instead of being read whole.
+  """
+
+  # Keep trying until the request succeeds
+  while True:
+
+    # Fails fast with CircuitOpen if Etherscan is down
+    circuit_breaker.etherscan.allow()
+
+    # Takes a key with budget left from the pool
+    key = key_pool.etherscan.acquire()
+
+    try:
+
+      # Gets the json from the response
+      if parse is None:
+        json_response = httpx_client.get_client().get(f"{request_str}&apikey={key}").json()
+
+      # Streams the response into the parser
+      else:
+        with httpx_client.get_client().stream("GET", f"{request_str}&apikey={key}") as response:
+          json_response = parse(response.iter_bytes())
+
+    # Passes on invalid addresses, which are errors of the caller and not of Etherscan
+    except addresses.InvalidAddress:
+      raise
+
+    # Logs the error and counts the failure
+    except Exception as e:
+      logging.error(e)
+      circuit_breaker.etherscan.record_failure()
+      continue
+
+    # Etherscan answered, so it is up even if the key is rejected
+    circuit_breaker.etherscan.record_success()
+
+    # Gets the error message (Etherscan returns it as the result with a status of 0)
+    result = json_response.get("result")
+    error = result.lower() if json_response.get("status") == "0" and isinstance(result, str) else ""
+
+    # Rests the key and tries another one if the key was rate limited or rejected
+    if "rate limit" in error:
+      key_pool.etherscan.report_rate_limited(key)
+      continue
+
+    if "invalid api key" in error:
+      key_pool.etherscan.report_invalid(key)
+      continue
+
+    # Returns the json
+    key_pool.etherscan.report_success(key)
+    return json_response
+
+
+def __getattr__(name: str):
+  """Function to keep etherscan_api.API_KEY working without reading it at import time"""
+
+  # Checks if the API key is requested
+  if name == "API_KEY":
+    return get_api_key()
+
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Transaction:
@@ -17,41 +85,37 @@ class Transaction:
     self.__dict__.update(attributes)
 
   def __str__(self) -> str:
-    attr_list = [f"{attr}: {value}" for attr, value in self.__dict__.items()]
+    attr_list = [f"{attr}: {addresses.to_hex(value) if isinstance(value, bytes) else value}" for attr, value in self.__dict__.items()]
     return "\n".join(attr_list)
 
   def read(self, timezone: pytz.timezone, hash_given: bool) -> str:
     """Function to give the most important details about a transaction"""
 
     # Get the most important details of the transaction into one string")}"
-    details = f"Transaction {self.hash if not hash_given else ''}\nTime: {timezone.localize(datetime.fromtimestamp(int(self.timeStamp))).strftime('%d/%m/%Y, %-I:%M %p')} \nValue: {self.value} \nFrom: {self.__dict__['from']} \nTo: {self.to}"
+    details = f"Transaction {self.hash if not hash_given else ''}\nTime: {local_time.format_time(int(self.timeStamp), timezone)} \nValue: {self.value} \nFrom: {addresses.to_hex(self.__dict__['from'])} \nTo: {addresses.to_hex(self.to)}"
 
     # Return the details
     return details
 
 
-def convert_eth_to_usd(eth: float) -> float:
-  """Function to convert Ether to USD"""
-
-  # Keep trying until the request succeeds
-  while True:
-    try:
+def get_eth_usd_rate() -> float:
+  """Function to get the price of Ether in USD from the price ticker's snapshot, raising CircuitOpen if there is none"""
 
-      # Gets the response
-      response = s.get("https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd")
+  # Gets the price from the snapshot (this raises CircuitOpen if the first snapshot could not be loaded)
+  conversion_rate = price_ticker.ticker.get_price("ethereum", "usd")
 
-      # Gets the json from the response
-      json_response = response.json()
+  # Treats a snapshot without the price like CoinGecko being down, so the user is told to retry instead of getting an error
+  if conversion_rate is None:
+    raise circuit_breaker.CircuitOpen(circuit_breaker.coingecko.name, price_ticker.ticker.interval)
 
-      # Breaks the loop if successful
-      break
+  # Returns the price
+  return conversion_rate
 
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+def convert_eth_to_usd(eth: float) -> float:
+  """Function to convert Ether to USD"""
 
-  # Get conversion rate
-  conversion_rate = float(json_response["ethereum"]["usd"])
+  # Get conversion rate from the price ticker's snapshot
+  conversion_rate = get_eth_usd_rate()
 
   # Returns the amount in USD
   return float(eth) * conversion_rate
@@ -59,30 +123,24 @@ def convert_eth_to_usd(eth: float) -> float:
 def convert_usd_to_eth(usd: float) -> float:
   """Function to convert USD to Ether"""
 
-  # Keep trying until the request succeeds
-  while True:
-    try:
-
-      # Gets the response
-      response = s.get("https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd")
+  # Get conversion rate from the price ticker's snapshot
+  conversion_rate = get_eth_usd_rate()
 
-      # Gets the json from the response
-      json_response = response.json()
+  # Returns the amount in ETH
+  return float(usd) / conversion_rate
 
-      # Breaks the loop if successful
-      break
 
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+def query_address(address) -> str:
+  """Function to check an address before it is sent to Etherscan and get its hex form, raising InvalidAddress if it is not valid"""
 
-  # Get conversion rate
-  conversion_rate = float(json_response["ethereum"]["usd"])
+  # Checks if the address is empty, which normalize would take as the empty address of a contract creation
+  if isinstance(address, str) and address.strip().lower() in ("", "0x"):
+    raise addresses.InvalidAddress(f"Invalid ethereum address: {address!r}")
 
-  # Returns the amount in ETH
-  return float(usd) / conversion_rate
+  return addresses.to_hex(addresses.normalize(address))
 
 
+@single_flight.coalesced
 def get_ether_balance(address: str) -> float:
   """Function to get the ether balance of an ethereum wallet"""
 
@@ -90,26 +148,11 @@ def get_ether_balance(address: str) -> float:
   request_str = "https://api.etherscan.io/api" \
    "?module=account" \
    "&action=balance" \
-   f"&address={address}" \
-   "&tag=latest" \
-   f"&apikey={API_KEY}"
-
-  # Keep trying until the request succeeds
-  while True:
-    try:
+   f"&address={query_address(address)}" \
+   "&tag=latest"
 
-        # Gets the response
-        response = s.get(request_str)
-      
-        # Gets the json from the response
-        json_response = response.json()
-      
-        # Breaks the loop if it's successful
-        break
-
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(request_str)
 
   # Gets the balance from the dictionary
   balance = json_response.get("result")
@@ -121,6 +164,94 @@ def get_ether_balance(address: str) -> float:
     return float(balance) / (10**18)
 
 
+# The maximum number of addresses the balancemulti action accepts in one request
+MAX_BALANCEMULTI_ADDRESSES = 20
+
+
+def get_balances_chunk(chunk: List[str]) -> Dict[str, int]:
+  """Function to get the exact balances in wei of at most 20 valid addresses with one request, splitting the chunk if Etherscan rejects it"""
+
+  # The URL for the API
+  request_str = "https://api.etherscan.io/api" \
+   "?module=account" \
+   "&action=balancemulti" \
+   f"&address={','.join(chunk)}" \
+   "&tag=latest"
+
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(request_str)
+
+  # Gets the list of balances from the dictionary
+  results = json_response.get("result")
+
+  # Checks if the result is an error message, so one bad address does not cost the balances of the others
+  if not isinstance(results, list):
+
+    # Gives up on the address if it was alone
+    if len(chunk) == 1:
+      logging.error(f"Could not get the balance of {chunk[0]}: {results}")
+      return {}
+
+    # Splits the chunk in two and asks for each half
+    middle = len(chunk) // 2
+    return {**get_balances_chunk(chunk[:middle]), **get_balances_chunk(chunk[middle:])}
+
+  # Returns the balance of each account in wei
+  return {result["account"].lower(): int(result["balance"]) for result in results}
+
+
+def get_wei_balances(address_list: List[str]) -> Dict[str, int]:
+  """Function to get the exact balances in wei of many ethereum wallets, 20 addresses per request
+
+  The balances are keyed by the lowercased addresses as given. Invalid addresses are left out before any request is
+  made, so they get no balance without costing the others theirs.
+  """
+
+  # The dictionary that maps the hex form of every valid address to the lowercased addresses it was given as
+  given: Dict[str, List[str]] = {}
+  for address in address_list:
+    try:
+      given.setdefault(query_address(address), []).append(address.lower())
+
+    # Skips the invalid addresses
+    except addresses.InvalidAddress:
+      continue
+
+  # The dictionary that maps the lowercased address to its balance in wei
+  balances: Dict[str, int] = {}
+
+  # Iterates the addresses (without duplicates) in chunks of the maximum batch size
+  unique_addresses = list(given)
+  for start in range(0, len(unique_addresses), MAX_BALANCEMULTI_ADDRESSES):
+
+    # Gets the balances of the chunk and gives them to every form the address was given as
+    for address, balance in get_balances_chunk(unique_addresses[start : start + MAX_BALANCEMULTI_ADDRESSES]).items():
+      for given_address in given.get(address, []):
+        balances[given_address] = balance
+
+  # Returns the dictionary of balances
+  return balances
+
+
+def get_ether_balances(address_list: List[str]) -> Dict[str, float]:
+  """Function to get the ether balances of many ethereum wallets, 20 addresses per request, keyed by the lowercased addresses as given"""
+  return {address: balance / 10**18 for address, balance in get_wei_balances(address_list).items()}
+
+
+def normalize_addresses(result: Dict[str, str]) -> Dict[str, str]:
+  """Function to turn the from and to addresses of a result into interned 20-byte values"""
+
+  # Iterates the address fields
+  for field in ("from", "to"):
+
+    # Normalizes the field if the result has it
+    if isinstance(result.get(field), str):
+      result[field] = addresses.normalize(result[field])
+
+  # Returns the result
+  return result
+
+
 def get_results(json_response: List[Dict[str, str]]) -> List[Transaction]:
   """Function to get the result from the json response"""
 
@@ -131,47 +262,46 @@ def get_results(json_response: List[Dict[str, str]]) -> List[Transaction]:
   if results is not None:
 
     # Change the list of dictionaries into a list of transaction objects and returns the list
-    return [Transaction(**result) for result in results]
-
+    return [Transaction(**normalize_addresses(result)) for result in results]
 
-def get_normal_transactions(address: str, number_of_results: Optional[int] = 100) -> List[Transaction]:
-  """Function to get the transactions from a ethereum wallet"""
 
-  # The URL for the API
-  request_str = "https://api.etherscan.io/api" \
+def get_txlist_request(address: str, number_of_results: Optional[int], start_block: int, sort: str, end_block: int = 99999999) -> str:
+  """Function to get the URL of the txlist action without the API key"""
+  return "https://api.etherscan.io/api" \
    "?module=account" \
    "&action=txlist" \
-   f"&address={address}" \
-   "&startblock=0" \
-   "&endblock=99999999" \
+   f"&address={query_address(address)}" \
+   f"&startblock={start_block}" \
+   f"&endblock={end_block}" \
    "&page=1" \
    f"&offset={number_of_results}" \
-   "&sort=desc" \
-   f"&apikey={API_KEY}"
+   f"&sort={sort}"
 
-  # Keep trying until the request succeeds
-  while True:
-    try:
 
-        # Gets the response
-        response = s.get(request_str)
+def parse_transactions(chunks: Iterator[bytes]) -> dict:
+  """Function to parse a streamed txlist response with the rows turned into transaction objects a block at a time"""
+  return txlist_stream.parse_txlist(
+    chunks,
+    lambda rows: [Transaction(**normalize_addresses(row)) for row in rows],
+    lambda blocks: [transaction for block in blocks for transaction in block]
+  )
 
-        # Gets the json from the response
-        json_response = response.json()
 
-        # Breaks the loop if it's successful
-        break
+@single_flight.coalesced
+def get_normal_transactions(address: str, number_of_results: Optional[int] = 100, start_block: int = 0, sort: str = "desc", end_block: int = 99999999) -> List[Transaction]:
+  """Function to get the transactions from a ethereum wallet, parsing the response while it streams in"""
 
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+  # Gets the json from the API with a key from the pool, with the rows parsed into transactions block by block
+  json_response = request_json(get_txlist_request(address, number_of_results, start_block, sort, end_block), parse_transactions)
 
-  # Returns the results from the response
-  return get_results(json_response)
+  # Returns the transactions (an empty list if the result is an error message)
+  results = json_response.get("result")
+  return results if isinstance(results, list) else []
 
 
-def get_token_transactions(address: str, contract_address: bool, nft: bool, number_of_results: Optional[int] = 100) -> List[Transaction]:
-  """Function to get the token (ERC-20 or NFT) transactions by a wallet"""
+@single_flight.coalesced
+def get_token_transactions(address: str, contract_address: bool, nft: bool, number_of_results: Optional[int] = 100, end_block: Optional[int] = None) -> List[Transaction]:
+  """Function to get the token (ERC-20 or NFT) transactions by a wallet, newest first, up to the end block if one is given"""
 
   # The URL for the API
   request_str = "https://api.etherscan.io/api" \
@@ -179,9 +309,8 @@ def get_token_transactions(address: str, contract_address: bool, nft: bool, numb
    "&page=1" \
    f"&offset={number_of_results}" \
    "&startblock=0" \
-   "&endblock=27025780" \
-   "&sort=desc" \
-   f"&apikey={API_KEY}" \
+   f"&endblock={27025780 if end_block is None else end_block}" \
+   "&sort=desc"
 
   # Checks if the token type is NFT
   if nft:
@@ -199,30 +328,16 @@ def get_token_transactions(address: str, contract_address: bool, nft: bool, numb
   if contract_address:
 
     # Adds the contract address query to the request URL
-    request_str = f"&contractaddress={address}"
+    request_str += f"&contractaddress={query_address(address)}"
 
   # The address is a normal address
   else:
     
     # Adds the address query to the request URL
-    request_str += f"&address={address}"
-
-  # Keep trying until the request succeeds
-  while True:
-    try:
+    request_str += f"&address={query_address(address)}"
 
-      # Gets the response from the API
-      response = s.get(request_str)
-
-      # Gets the json from the response
-      json_response = response.json()
-
-      # Breaks the loop if it's successful
-      break
-
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(request_str)
 
   # Return the results from the request
   return get_results(json_response)
@@ -241,72 +356,32 @@ def get_transactions(address: str, contract_address: bool, number_of_results: Op
   return normal_transactions + nft_transactions
 
 
-def get_transaction_details(tx_hash: str) -> Transaction:
-  """Function to get the details of a transaction"""
-
-  # The URL for the API
-  request_str = "https://api.etherscan.io/api" \
-   "?module=proxy" \
-   "&action=eth_getTransactionByHash" \
-   f"&txhash={tx_hash}" \
-   f"&apikey={API_KEY}"
-
-  # Keep trying until the request succeeds
-  while True:
-    try:
-
-      # Gets the response from the API
-      response = s.get(request_str)
-
-      # Gets the json from the response
-      json_response = response.json()
-
-      # Breaks the loop if it's successful
-      break
+# The Etherscan parameter names of the arguments of each JSON-RPC method the proxy module supports
+PROXY_PARAMETERS = {
+  "eth_getTransactionByHash": ("txhash", ),
+  "eth_getTransactionReceipt": ("txhash", ),
+  "eth_getBlockByNumber": ("tag", "boolean"),
+}
 
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
-
-  # Returns the transaction object
-  return get_results(json_response)
 
-
-def get_transaction_receipt(tx_hash: str) -> List[Transaction]:
-  """Function to get the receipt of a transaction"""
+@single_flight.coalesced
+def call_proxy(method: str, params: tuple) -> Optional[Dict]:
+  """Function to make a JSON-RPC call through the proxy module and return its result"""
 
   # The URL for the API
   request_str = "https://api.etherscan.io/api" \
    "?module=proxy" \
-   "&action=eth_getTransactionReceipt" \
-   f"&txhash={tx_hash}" \
-   f"&apikey={API_KEY}"
-
-  # Keep trying until the request succeeds
-  while True:
-    try:
-
-      # Gets the response from the API
-      response = s.get(request_str)
-
-      # Gets the json from the response
-      json_response = response.json()
-
-      # Breaks the loop if it's successful
-      break
-
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+   f"&action={method}"
 
-  # Gets the result from the response
-  result = json_response.get("result")
+  # Adds the arguments under their Etherscan names (booleans are written in lowercase)
+  for name, value in zip(PROXY_PARAMETERS[method], params):
+    request_str += f"&{name}={str(value).lower() if isinstance(value, bool) else value}"
 
-  # Checks if the result is not None
-  if result is not None:
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(request_str)
 
-    # Returns the transaction json
-    return result
+  # Returns the result (None if the transaction or block is not found)
+  return json_response.get("result")
 
 if __name__ == "__main__":
   get_normal_transactions("0xde0b295669a9fd93d5f28d9ec85e40f4cb697bae")
\ No newline at end of file
@@ -0,0 +1,127 @@
+# Module that exports the transaction history of a wallet as a compressed CSV file, written chunk by chunk so memory stays bounded
+
+import os, csv, gzip, io, tempfile
+from typing import IO, Iterator, List, Tuple
+import addresses, hot_addresses, transaction_store
+from transaction_store import TransactionBatch
+
+
+# The number of rows formatted and written at a time
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 10000))
+
+# The size in bytes past which the compressed file is moved from memory to a temporary file on disk
+EXPORT_SPOOL_SIZE = int(os.environ.get("EXPORT_SPOOL_SIZE", 4 * 1024 * 1024))
+
+# The gzip compression level, as the highest levels barely make CSV smaller but take several times longer
+COMPRESSION_LEVEL = 6
+
+# The columns of the CSV file
+HEADER = ["hash", "block_number", "timestamp", "time_utc", "from", "to", "direction", "value_wei", "value_eth", "fee_wei", "is_error"]
+
+
+class Export:
+  """Class that represents an exported history, which is a compressed CSV file ready to be uploaded"""
+
+  def __init__(self, file: IO[bytes], filename: str, rows: int, size: int) -> None:
+
+    # The file, positioned at its start, and the name it is uploaded with
+    self.file = file
+    self.filename = filename
+
+    # The number of transactions and the size of the file in bytes
+    self.rows = rows
+    self.size = size
+
+
+  def close(self) -> None:
+    """Function to close the file, which deletes it if it was written to disk"""
+    self.file.close()
+
+
+def format_ether(wei: int) -> str:
+  """Function to format an amount of wei as exact Ether, without the rounding of a float"""
+  return f"{'-' if wei < 0 else ''}{abs(wei) // 10**18}.{abs(wei) % 10**18:018d}"
+
+
+def chunk_rows(batch: TransactionBatch, address: bytes) -> Iterator[List[Tuple]]:
+  """Function to format the rows of a batch as CSV rows, one chunk at a time"""
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  for start in range(0, len(batch), EXPORT_CHUNK_ROWS):
+
+    # Gets the rows of the chunk (the arrays are views, not copies)
+    chunk = batch.slice(start, min(start + EXPORT_CHUNK_ROWS, len(batch)))
+
+    # Formats the times of the whole chunk at once
+    times = numpy.datetime_as_string(chunk.timestamp.astype("datetime64[s]"))
+
+    # Gets the direction of every transaction
+    incoming = chunk.receiver == address
+    outgoing = chunk.sender == address
+    directions = numpy.where(incoming & outgoing, "self", numpy.where(outgoing, "out", numpy.where(incoming, "in", "")))
+
+    # Gets the exact values and fees as python integers
+    values = chunk.value.to_ints()
+    fees = chunk.fees().to_ints()
+
+    # Returns the rows of the chunk
+    yield [
+      (
+        chunk.hash[i],
+        int(chunk.block_number[i]),
+        int(chunk.timestamp[i]),
+        times[i],
+        addresses.to_hex(chunk.sender[i]),
+        addresses.to_hex(chunk.receiver[i]),
+        directions[i],
+        values[i],
+        format_ether(values[i]),
+        fees[i],
+        int(chunk.is_error[i])
+      )
+      for i in range(len(chunk))
+    ]
+
+
+def export_history(address: str) -> Export:
+  """Function to write the full transaction history of a wallet to a gzip compressed CSV file
+
+  The rows are formatted and compressed a chunk at a time, and the file moves to disk once it outgrows the spool
+  size, so exporting a long history takes little more memory than the history itself.
+  """
+
+  # Normalizes the address
+  address = addresses.normalize(address)
+
+  # Counts the request for the wallet
+  hot_addresses.tracker.record(address)
+
+  # Gets the transaction history from the store
+  batch = transaction_store.store.get(address)
+
+  # The name of the file
+  filename = f"transactions_{addresses.to_hex(address)}.csv.gz"
+
+  # Creates the file, which stays in memory while it is small
+  file = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+
+  # Writes the header and the rows through the compressor, chunk by chunk
+  with gzip.GzipFile(filename=filename[:-3], mode="wb", fileobj=file, compresslevel=COMPRESSION_LEVEL) as compressed:
+    text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(HEADER)
+    for rows in chunk_rows(batch, address):
+      writer.writerows(rows)
+
+    # Flushes the text and lets the compressor finish the file
+    text.flush()
+    text.detach()
+
+  # Gets the size of the file and moves back to its start for the upload
+  size = file.tell()
+  file.seek(0)
+
+  # Returns the export
+  return Export(file, filename, len(batch), size)
@@ -0,0 +1,153 @@
+# Module to do analytics on the gas fees paid by a wallet
+
+import pytz
+from typing import Dict, List, Optional, Tuple
+import transaction_store, time_series, addresses, local_time
+from transaction_store import TransactionBatch
+from wei import WeiArray, WEI_PER_ETHER
+from data_analytics import ASCIIGraph
+
+
+# The percentiles shown in the distribution of fees
+FEE_PERCENTILES = (25, 50, 75, 90, 99)
+
+
+def get_fee_wei(batch: TransactionBatch, address: str) -> WeiArray:
+  """Function to get the exact fee in wei of every transaction, which is 0 for transactions the wallet did not send"""
+
+  # Returns gasUsed x gasPrice for the transactions sent by the wallet
+  return batch.fees().where(batch.sender == addresses.normalize(address))
+
+
+def get_fees(batch: TransactionBatch, address: str):
+  """Function to get the fee in Ether of every transaction, which is 0 for transactions the wallet did not send"""
+  return get_fee_wei(batch, address).to_ether()
+
+
+def get_fee_distribution(fees) -> Dict[str, float]:
+  """Function to get the count, total, mean, percentiles and maximum of the fees of the transactions sent"""
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  # Gets only the fees of the transactions sent by the wallet
+  paid = fees[fees > 0]
+
+  # Checks if the wallet did not pay any fees
+  if len(paid) == 0:
+    return {"count": 0, "total": 0.0}
+
+  # Gets every percentile in one pass
+  percentiles = numpy.percentile(paid, FEE_PERCENTILES)
+
+  # Returns the distribution
+  return {
+    "count": int(len(paid)),
+    "total": float(paid.sum()),
+    "mean": float(paid.mean()),
+    **{f"p{percentile}": float(value) for percentile, value in zip(FEE_PERCENTILES, percentiles)},
+    "max": float(paid.max())
+  }
+
+
+def get_most_expensive(batch: TransactionBatch, fees, number_of_results: int) -> List[Tuple[str, float]]:
+  """Function to get the hashes and fees of the most expensive transactions in a batch"""
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  # Gets the number of results that can be returned
+  number_of_results = min(number_of_results, int((fees > 0).sum()))
+
+  # Checks if there are no results
+  if number_of_results == 0:
+    return []
+
+  # Finds the most expensive transactions without sorting the whole array
+  top = numpy.argpartition(fees, -number_of_results)[-number_of_results:]
+
+  # Sorts only the top transactions, most expensive first
+  top = top[numpy.argsort(fees[top])[::-1]]
+
+  # Returns the hashes and fees
+  return [(str(batch.hash[i]), float(fees[i])) for i in top]
+
+
+def gas_for_past_months(address: str, months: int, timezone: pytz.timezone) -> Dict[int, float]:
+  """Function to get the mapping of months to the gas fees paid in Ether"""
+
+  # Gets the transaction history from the store
+  batch = transaction_store.store.get(address)
+
+  # Gets the timestamps of the start of the first month and the start of the current month
+  start_time, end_time = time_series.month_window(months, timezone)
+
+  # Gets the cash flow of each month
+  series = time_series.CashFlowSeries(batch, address).resample("month", timezone, start_time, end_time)
+
+  # Returns the dictionary of the gas fees in Ether for each month
+  return {start.month: float(gas) for start, gas in zip(series.starts, series.gas)}
+
+
+def get_gas_report(address: str, months: int, timezone: pytz.timezone, number_of_results: int = 3) -> Tuple[str, Optional[str]]:
+  """Function to get the gas fee report (totals, distribution and most expensive transactions) and graph for the past n months"""
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  # Keeps the number of months to the most the graph can label
+  months = min(months, ASCIIGraph.MAX_MONTHS)
+
+  # Gets the transaction history from the store
+  batch = transaction_store.store.get(address)
+
+  # Gets the timestamps of the start of the first month and the start of the current month
+  start_time, end_time = time_series.month_window(months, timezone)
+
+  # Gets the transactions in the window and their fees
+  window = batch.window(start_time, end_time)
+  fee_wei = get_fee_wei(window, address)
+  fees = fee_wei.to_ether()
+
+  # Gets the distribution of the fees, with the exact total
+  distribution = get_fee_distribution(fees)
+  distribution["total"] = fee_wei.sum() / WEI_PER_ETHER
+
+  # Checks if there are no fees in the window
+  if distribution["count"] == 0:
+    return f"{address} did not pay any gas fees in the past {months} months.", None
+
+  # Creates the summary of the fees
+  lines = [
+    f"Gas fees of {address} for the past {months} months",
+    f"Total: {distribution['total']:.6f} ETH over {distribution['count']} transactions",
+    f"Mean: {distribution['mean']:.6f} ETH, maximum: {distribution['max']:.6f} ETH",
+    "Percentiles: " + ", ".join(f"p{percentile} {distribution[f'p{percentile}']:.6f}" for percentile in FEE_PERCENTILES)
+  ]
+
+  # Gets the timestamps of every month boundary
+  _, boundaries = time_series.bucket_boundaries("month", timezone, start_time, end_time)
+
+  # Gets the row of every month boundary with one binary search
+  indices = numpy.searchsorted(window.timestamp, boundaries, "left")
+
+  # Adds the most expensive transactions of each month
+  for start, end, boundary in zip(indices[:-1], indices[1:], boundaries[:-1]):
+    most_expensive = get_most_expensive(window.slice(start, end), fees[start:end], number_of_results)
+
+    # Skips months without fees
+    if not most_expensive:
+      continue
+
+    # Gets the name of the month
+    month = ASCIIGraph.month_dict[local_time.to_local(boundary, timezone).month]
+
+    # Adds the most expensive transactions of the month
+    lines.append(f"\nMost expensive in {month}:")
+    lines += [f"{tx_hash}: {fee:.6f} ETH" for tx_hash, fee in most_expensive]
+
+  # Creates the graph of the gas fees per month
+  graph = ASCIIGraph(gas_for_past_months(address, months, timezone)).construct()
+
+  # Returns the report
+  return "\n".join(lines), graph
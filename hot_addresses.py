@@ -0,0 +1,231 @@
+# Module that tracks the wallets asked about most often and precomputes their analytics while the bots are idle
+
+import os, heapq, logging, threading, time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+import addresses, admission, circuit_breaker, key_pool, transaction_store
+
+
+# The number of seconds after which a request counts half as much towards the score of a wallet
+HALF_LIFE = float(os.environ.get("HOT_ADDRESS_HALF_LIFE", 3600))
+
+# The maximum number of wallets kept hot, and the score a wallet needs to be hot
+HOT_ADDRESSES = int(os.environ.get("HOT_ADDRESSES", 20))
+MIN_SCORE = 3.0
+
+# The maximum number of wallets tracked, after which the coldest are forgotten
+MAX_TRACKED = 1000
+
+# The maximum number of precompute tasks (like a graph for a number of months and a timezone) kept per wallet
+MAX_TASKS = 4
+
+# The number of seconds between precompute rounds, which is shorter than the sync interval so hot wallets never need a sync on request
+PRECOMPUTE_INTERVAL = transaction_store.SYNC_INTERVAL / 2
+
+# The share of the Etherscan key budget that has to be unused for the bots to count as idle
+IDLE_BUDGET = 0.5
+
+# The type of a precompute task, which is the function followed by its arguments
+Task = Tuple
+
+
+class HotAddressTracker:
+  """Class that scores wallets by their number of requests with exponential decay, so the score follows recent demand (LFU with aging)"""
+
+  def __init__(self) -> None:
+
+    # The dictionary that maps the 20-byte address to its score and the time the score was last updated
+    self.scores: Dict[bytes, Tuple[float, float]] = {}
+
+    # The dictionary that maps the 20-byte address to its most recent precompute tasks, oldest first
+    self.tasks: Dict[bytes, "OrderedDict[Task, None]"] = {}
+
+    # The 20-byte addresses that are hot, updated by the precomputer every round
+    self.hot: Set[bytes] = set()
+
+    # The lock protecting the scores and the tasks
+    self.lock = threading.Lock()
+
+
+  def decayed(self, address: bytes, now: float) -> float:
+    """Function to get the score of a wallet at a time (must be called with the lock held)"""
+
+    score, updated_at = self.scores.get(address, (0.0, now))
+    return score * 2 ** ((updated_at - now) / HALF_LIFE)
+
+
+  def record(self, address: str, task: Optional[Task] = None) -> None:
+    """Function to count a request for a wallet, with the task that would precompute its answer"""
+
+    # Normalizes the address
+    address = addresses.normalize(address)
+
+    now = time.time()
+
+    with self.lock:
+
+      # Adds the request to the decayed score
+      self.scores[address] = (self.decayed(address, now) + 1, now)
+
+      # Remembers the task, moving it to the end if it was already known and forgetting the oldest one if there are too many
+      if task is not None:
+        tasks = self.tasks.setdefault(address, OrderedDict())
+        tasks[task] = None
+        tasks.move_to_end(task)
+        if len(tasks) > MAX_TASKS:
+          tasks.popitem(last=False)
+
+      # Forgets the coldest quarter of the wallets if too many are tracked
+      if len(self.scores) > MAX_TRACKED:
+        for cold in heapq.nsmallest(MAX_TRACKED // 4, self.scores, key=lambda tracked: self.decayed(tracked, now)):
+          del self.scores[cold]
+          self.tasks.pop(cold, None)
+
+
+  def update_hot(self) -> List[bytes]:
+    """Function to find the wallets with the highest scores, which become the hot wallets"""
+
+    now = time.time()
+
+    with self.lock:
+
+      # Gets the wallets with the highest scores above the minimum score
+      hot = [address for address in heapq.nlargest(HOT_ADDRESSES, self.scores, key=lambda address: self.decayed(address, now)) if self.decayed(address, now) >= MIN_SCORE]
+      self.hot = set(hot)
+
+    # Returns the hot wallets, hottest first
+    return hot
+
+
+  def get_tasks(self, address: bytes) -> List[Task]:
+    """Function to get the precompute tasks of a wallet"""
+
+    with self.lock:
+      return list(self.tasks.get(address, ()))
+
+
+  def is_hot(self, address: str) -> bool:
+    """Function to check if a wallet is hot"""
+    return addresses.normalize(address) in self.hot
+
+
+class Precomputer:
+  """Class that keeps hot wallets synced and their analytics computed, using the rate limit budget left over while the bots are idle"""
+
+  def __init__(self, tracker: HotAddressTracker) -> None:
+    self.tracker = tracker
+
+    # The dictionary that maps a result key (starting with the 20-byte address) to the version it was computed for and the result
+    self.results: Dict[Hashable, Tuple[Hashable, Any]] = {}
+
+    # The lock protecting the results
+    self.lock = threading.Lock()
+
+    # The precompute thread
+    self.thread: Optional[threading.Thread] = None
+
+
+  def cached(self, key: Tuple, version: Hashable, compute: Callable[[], Any]) -> Any:
+    """Function to get a result of a wallet from memory if it was computed for the same version, computing it otherwise
+
+    The key starts with the 20-byte address, and the version changes whenever the result would (like the number of
+    transactions and the current month). Only the results of hot wallets are kept.
+    """
+
+    # Returns the stored result if it is still up to date
+    with self.lock:
+      entry = self.results.get(key)
+    if entry is not None and entry[0] == version:
+      return entry[1]
+
+    # Computes the result
+    result = compute()
+
+    # Keeps the result if the wallet is hot
+    if key[0] in self.tracker.hot:
+      with self.lock:
+        self.results[key] = (version, result)
+
+    return result
+
+
+  def is_idle(self) -> bool:
+    """Function to check if no commands are waiting and most of the Etherscan budget is unused"""
+
+    # Checks if commands are running or queued
+    if admission.controller.running or admission.controller.queue:
+      return False
+
+    # Checks if Etherscan is down
+    if circuit_breaker.etherscan.is_open():
+      return False
+
+    # Checks if enough of the budget of the keys is unused
+    keys = key_pool.etherscan.get_keys()
+    return sum(api_key.bucket.available() for api_key in keys) >= IDLE_BUDGET * sum(api_key.bucket.capacity for api_key in keys)
+
+
+  def precompute(self, address: bytes) -> None:
+    """Function to sync a hot wallet and run its precompute tasks"""
+
+    # Syncs the history if it would need a sync before the next round
+    synced_at = transaction_store.store.synced_at.get(address, 0.0)
+    transaction_store.store.sync(address, force=time.time() - synced_at >= transaction_store.SYNC_INTERVAL - PRECOMPUTE_INTERVAL)
+
+    # Runs the tasks, which store their results with cached
+    for function, *arguments in self.tracker.get_tasks(address):
+      function(*arguments)
+
+
+  def run_round(self) -> None:
+    """Function to update the hot wallets and precompute them one by one while the bots stay idle"""
+
+    # Gets the hot wallets
+    hot = self.tracker.update_hot()
+
+    # Drops the results of the wallets that are not hot anymore
+    with self.lock:
+      for key in [key for key in self.results if key[0] not in self.tracker.hot]:
+        del self.results[key]
+
+    # Precomputes the hot wallets, hottest first, stopping as soon as commands need the budget
+    for address in hot:
+      if not self.is_idle():
+        break
+
+      try:
+        self.precompute(address)
+
+      # Logs the error so that one wallet does not stop the others
+      except Exception as e:
+        logging.error(e)
+
+
+  def run(self) -> None:
+    """Function to run a precompute round forever"""
+
+    while True:
+      try:
+        self.run_round()
+
+      # Logs the error and keeps the thread running
+      except Exception as e:
+        logging.error(e)
+
+      time.sleep(PRECOMPUTE_INTERVAL)
+
+
+  def start(self) -> None:
+    """Function to start the precompute thread"""
+
+    # Checks if the thread is already running
+    if self.thread is not None:
+      return
+
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+
+# The tracker and precomputer shared by both bots
+tracker = HotAddressTracker()
+precomputer = Precomputer(tracker)
@@ -1,6 +1,6 @@
 # Module that contains the httpx client
 
-import httpx
+import threading
 
 # Headers for the request
 headers = {
@@ -10,5 +10,40 @@ headers = {
  "Referer" : "https://www.google.com/",
 }
 
-# Httpx client
-s = httpx.Client(headers=headers, follow_redirects=True)
\ No newline at end of file
+# The httpx client, created on the first request instead of at import time
+_client = None
+
+# The lock to stop two threads from creating the client at the same time
+_client_lock = threading.Lock()
+
+
+def get_client():
+  """Function to get the shared httpx client, creating it on first use"""
+
+  global _client
+
+  # Checks if the client has not been created yet
+  if _client is None:
+    with _client_lock:
+
+      # Checks again in case another thread created it while waiting for the lock
+      if _client is None:
+
+        # Imports httpx here because it is slow to import
+        import httpx
+
+        # Creates the httpx client
+        _client = httpx.Client(headers=headers, follow_redirects=True)
+
+  # Returns the client
+  return _client
+
+
+def __getattr__(name: str):
+  """Function to keep "from httpx_client import s" working for older code"""
+
+  # Checks if the old client name is requested
+  if name == "s":
+    return get_client()
+
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
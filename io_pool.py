@@ -0,0 +1,55 @@
+# Module that contains the thread pool shared by the bots for blocking I/O
+
+import asyncio, functools, os, threading
+from typing import Any, Callable
+
+# The number of worker threads in the pool
+IO_POOL_SIZE = int(os.environ.get("IO_POOL_SIZE", 16))
+
+# The number of worker threads in the pool for the fetches that a task in the I/O pool starts and waits for
+FETCH_POOL_SIZE = int(os.environ.get("FETCH_POOL_SIZE", 8))
+
+# The thread pools by name, created on first use instead of at import time
+_executors = {}
+
+# The lock to stop two threads from creating a pool at the same time
+_executor_lock = threading.Lock()
+
+
+def get_executor(name: str = "io"):
+  """Function to get a thread pool ("io" for the shared pool or "fetch" for the nested fetches), creating it on first use"""
+
+  # Checks if the pool has not been created yet
+  if name not in _executors:
+    with _executor_lock:
+
+      # Checks again in case another thread created it while waiting for the lock
+      if name not in _executors:
+
+        # Imports the executor here as it is only needed once a command is served
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Creates the thread pool
+        _executors[name] = ThreadPoolExecutor(max_workers=IO_POOL_SIZE if name == "io" else FETCH_POOL_SIZE, thread_name_prefix=name)
+
+  # Returns the pool
+  return _executors[name]
+
+
+def submit(function: Callable, *args, **kwargs):
+  """Function to run a blocking function in the pool and return its concurrent future"""
+  return get_executor().submit(function, *args, **kwargs)
+
+
+def submit_fetch(function: Callable, *args, **kwargs):
+  """Function to run a blocking fetch in the fetch pool and return its concurrent future
+
+  Tasks in the I/O pool that wait for other blocking calls submit them here, as waiting for the I/O pool from inside it
+  deadlocks once every worker is waiting.
+  """
+  return get_executor("fetch").submit(function, *args, **kwargs)
+
+
+def run_async(function: Callable, *args, **kwargs) -> "asyncio.Future[Any]":
+  """Function to run a blocking function in the pool and return an asyncio future for the running event loop"""
+  return asyncio.get_running_loop().run_in_executor(get_executor(), functools.partial(function, *args, **kwargs))
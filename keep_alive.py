@@ -2,6 +2,7 @@
 
 from flask import Flask
 from threading import Thread
+import admission
 
 app = Flask("")
 
@@ -9,6 +10,10 @@ app = Flask("")
 def main() -> None:
   return "Your bot is alive!"
 
+@app.route("/metrics")
+def metrics():
+  return admission.controller.metrics_text(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
 def run() -> None:
   app.run(host="0.0.0.0", port=8080)
 
@@ -0,0 +1,164 @@
+# Module that spreads API requests across a pool of API keys, resting the keys that are rate limited or rejected
+
+import os, logging, threading, time
+from typing import List, Optional
+from rate_limiter import TokenBucket
+from circuit_breaker import CircuitOpen
+
+
+# The number of seconds a rate limited key rests for the first time (doubled every time it happens again in a row)
+RATE_LIMIT_COOLDOWN = 5.0
+
+# The number of seconds a key rejected as invalid rests before it is tried again
+INVALID_KEY_COOLDOWN = 600.0
+
+# The longest number of seconds a key rests for
+MAX_COOLDOWN = 3600.0
+
+
+class NoValidKey(CircuitOpen):
+  """Exception raised when every key of an API was rejected as invalid, so requests fail fast instead of waiting for a key to rest"""
+
+
+class ApiKey:
+  """Class that represents one API key with its own rate budget and error state"""
+
+  def __init__(self, key: str, rate: float) -> None:
+    self.key = key
+
+    # The rate limiter for the key's own rate budget
+    self.bucket = TokenBucket(rate, rate)
+
+    # The time the key can be used again after being rate limited or rejected
+    self.cooled_until = 0.0
+
+    # The number of errors in a row, used to back off a key that keeps failing
+    self.failures = 0
+
+    # Whether the key was rejected as invalid since its last successful request
+    self.invalid = False
+
+
+class KeyPool:
+  """Class that hands out the healthy key with the most budget left, so the throughput grows with the number of keys"""
+
+  def __init__(self, name: str, environment_variable: str, rate: float) -> None:
+
+    # The name of the API, used in the logs
+    self.name = name
+
+    # The environment variable holding the keys, separated by commas
+    self.environment_variable = environment_variable
+
+    # The number of requests per second allowed for each key
+    self.rate = rate
+
+    # The keys, read from the environment on first use
+    self.keys: Optional[List[ApiKey]] = None
+
+    # The lock protecting the keys
+    self.lock = threading.Lock()
+
+
+  def get_keys(self) -> List[ApiKey]:
+    """Function to get the keys, reading them from the environment the first time they are needed"""
+
+    # Checks if the keys have not been read yet
+    if self.keys is None:
+      with self.lock:
+        if self.keys is None:
+
+          # Reads the comma separated keys (a single key works as before)
+          keys = [key.strip() for key in os.environ[self.environment_variable].split(",") if key.strip()]
+          if not keys:
+            raise KeyError(self.environment_variable)
+          self.keys = [ApiKey(key, self.rate) for key in dict.fromkeys(keys)]
+
+    # Returns the keys
+    return self.keys
+
+
+  def find(self, key: str) -> Optional[ApiKey]:
+    """Function to get the state of a key"""
+    return next((api_key for api_key in self.get_keys() if api_key.key == key), None)
+
+
+  def acquire(self) -> str:
+    """Function to take one request from the budget of the best key, waiting if every key is used up or resting
+
+    Raises NoValidKey if every key is resting after being rejected as invalid, as waiting for them could take minutes.
+    """
+
+    while True:
+      now = time.time()
+
+      # Fails fast if every key was rejected as invalid and none can be tried again yet
+      if all(api_key.invalid and api_key.cooled_until > now for api_key in self.get_keys()):
+        raise NoValidKey(self.name, min(api_key.cooled_until for api_key in self.get_keys()) - now)
+
+      # Gets the keys that are not resting
+      healthy = [api_key for api_key in self.get_keys() if api_key.cooled_until <= now]
+
+      # Tries the keys with the most budget left first, which spreads the requests evenly
+      for api_key in sorted(healthy, key=lambda api_key: api_key.bucket.available(), reverse=True):
+        if api_key.bucket.try_acquire():
+          return api_key.key
+
+      # Waits until a key has budget again or stops resting
+      waits = [api_key.bucket.wait_time() for api_key in healthy] + [api_key.cooled_until - now for api_key in self.get_keys() if api_key.cooled_until > now]
+      time.sleep(max(0.01, min(waits)))
+
+
+  def cool_down(self, key: str, seconds: float) -> None:
+    """Function to rest a key for a number of seconds, doubling the rest every time it fails again in a row"""
+
+    api_key = self.find(key)
+    if api_key is None:
+      return
+
+    with self.lock:
+      api_key.failures += 1
+      api_key.cooled_until = time.time() + min(MAX_COOLDOWN, seconds * 2 ** (api_key.failures - 1))
+
+    logging.warning(f"{self.name} key ...{key[-4:]} is resting for {api_key.cooled_until - time.time():.0f}s")
+
+
+  def report_rate_limited(self, key: str) -> None:
+    """Function to rest a key that hit its rate limit"""
+    self.cool_down(key, RATE_LIMIT_COOLDOWN)
+
+
+  def report_invalid(self, key: str) -> None:
+    """Function to rest a key that was rejected as invalid, in case it was only revoked for a while"""
+
+    api_key = self.find(key)
+    if api_key is None:
+      return
+
+    # Marks the key as invalid and rests it
+    api_key.invalid = True
+    self.cool_down(key, INVALID_KEY_COOLDOWN)
+
+    # Logs an error if no key is left, as requests fail until a key is fixed
+    if all(api_key.invalid for api_key in self.get_keys()):
+      logging.error(f"Every {self.name} key in {self.environment_variable} was rejected as invalid")
+
+
+  def report_success(self, key: str) -> None:
+    """Function to reset the error count of a key after a successful request"""
+
+    api_key = self.find(key)
+    if api_key is not None and (api_key.failures or api_key.invalid):
+      with self.lock:
+        api_key.failures = 0
+        api_key.invalid = False
+
+
+  def first_key(self) -> str:
+    """Function to get the first configured key"""
+    return self.get_keys()[0].key
+
+
+# The key pools of the APIs, where each Etherscan key allows 5 requests per second on the free plan
+etherscan = KeyPool("Etherscan", "ETHERSCAN_KEY", float(os.environ.get("ETHERSCAN_KEY_RATE", 5)))
+moralis = KeyPool("Moralis", "MORALIS_KEY", float(os.environ.get("MORALIS_KEY_RATE", 25)))
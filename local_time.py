@@ -0,0 +1,116 @@
+# Module that converts unix timestamps to local times with the UTC offset tables of the pytz timezones, extracted once per timezone
+
+import bisect, functools, time
+from datetime import datetime, timedelta
+from typing import List, Tuple
+import pytz
+
+
+# The unix epoch as a naive datetime, which the transition times of pytz are counted from
+EPOCH = datetime(1970, 1, 1)
+
+# The format of the times shown with a transaction
+TIME_FORMAT = "%d/%m/%Y, %-I:%M %p"
+
+
+@functools.lru_cache(maxsize=None)
+def get_transitions(timezone: pytz.timezone) -> Tuple[List[int], List[int]]:
+  """Function to get the unix timestamps at which the UTC offset of a timezone changes and the offset in seconds from each of them
+
+  The first transition is far in the past, so every timestamp falls after one of them.
+  """
+
+  # Gets the table of a timezone with daylight saving time or historical changes
+  if hasattr(timezone, "_utc_transition_times"):
+    return (
+      [int((transition - EPOCH).total_seconds()) for transition in timezone._utc_transition_times],
+      [int(utc_offset.total_seconds()) for utc_offset, _, _ in timezone._transition_info]
+    )
+
+  # Gets the one offset of a fixed timezone, like UTC
+  return [int((datetime.min - EPOCH).total_seconds())], [int(timezone.utcoffset(EPOCH).total_seconds())]
+
+
+@functools.lru_cache(maxsize=None)
+def get_transition_arrays(timezone: pytz.timezone):
+  """Function to get the transitions of a timezone as numpy arrays for vectorized lookups"""
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  transitions, utc_offsets = get_transitions(timezone)
+  return numpy.array(transitions, dtype=numpy.int64), numpy.array(utc_offsets, dtype=numpy.int64)
+
+
+def utc_offset(timestamp: int, timezone: pytz.timezone) -> int:
+  """Function to get the UTC offset in seconds of a timezone at one timestamp with binary search"""
+
+  transitions, utc_offsets = get_transitions(timezone)
+  return utc_offsets[max(bisect.bisect_right(transitions, timestamp) - 1, 0)]
+
+
+def utc_offsets(timestamps, timezone: pytz.timezone):
+  """Function to get the UTC offsets in seconds of a timezone at an array of timestamps with one vectorized binary search"""
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  transitions, offsets = get_transition_arrays(timezone)
+  return offsets[numpy.maximum(numpy.searchsorted(transitions, timestamps, "right") - 1, 0)]
+
+
+def to_local(timestamp: int, timezone: pytz.timezone) -> datetime:
+  """Function to get the local time of a timestamp as a naive datetime"""
+  return EPOCH + timedelta(seconds=int(timestamp) + utc_offset(int(timestamp), timezone))
+
+
+def now(timezone: pytz.timezone) -> datetime:
+  """Function to get the current local time as a naive datetime"""
+  return to_local(int(time.time()), timezone)
+
+
+def to_timestamp(local: datetime, timezone: pytz.timezone) -> int:
+  """Function to turn a naive local time into a unix timestamp, picking standard time if it is ambiguous or missing because of daylight saving"""
+
+  # Gets the local time as seconds since the epoch
+  local_seconds = int((local - EPOCH).total_seconds())
+
+  # Gets the offsets in effect a day before and a day after, which include both sides of any transition near the time
+  before = utc_offset(local_seconds - 86400, timezone)
+  after = utc_offset(local_seconds + 86400, timezone)
+
+  # Gets the timestamps that are the local time with one of the offsets
+  timestamps = [local_seconds - offset for offset in {before, after} if utc_offset(local_seconds - offset, timezone) == offset]
+
+  # Returns the later timestamp if the time happens twice (standard time comes after daylight saving time), or the
+  # timestamp with the offset before the transition if the time is skipped
+  return max(timestamps) if timestamps else local_seconds - before
+
+
+def format_time(timestamp: int, timezone: pytz.timezone, time_format: str = TIME_FORMAT) -> str:
+  """Function to format the local time of a timestamp"""
+  return to_local(timestamp, timezone).strftime(time_format)
+
+
+class LocalFields:
+  """Class that holds the local calendar fields of an array of timestamps, one array per field"""
+
+  def __init__(self, timestamps, timezone: pytz.timezone) -> None:
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Gets the local times as seconds since the epoch, which numpy turns into calendar fields without a timezone
+    local = (numpy.asarray(timestamps, dtype=numpy.int64) + utc_offsets(timestamps, timezone)).astype("datetime64[s]")
+
+    # Gets the year, the month and the day
+    months = local.astype("datetime64[M]")
+    self.year = local.astype("datetime64[Y]").astype(numpy.int64) + 1970
+    self.month = months.astype(numpy.int64) % 12 + 1
+    self.day = (local.astype("datetime64[D]") - months).astype(numpy.int64) + 1
+
+    # Gets the time of the day
+    seconds = (local - local.astype("datetime64[D]")).astype(numpy.int64)
+    self.hour = seconds // 3600
+    self.minute = seconds // 60 % 60
+    self.second = seconds % 60
@@ -1,9 +1,19 @@
 # Main module to run everything
 
-import logging, threading
-import telegram_bot, discord_bot
-# import keep_alive
+import time
 
+# The time the process started loading, used to measure the startup time
+START_TIME = time.perf_counter()
+
+import os, sys, logging, threading
+import telegram_bot, discord_bot, watcher, price_ticker, hot_addresses, cache, snapshot
+
+
+# The maximum number of seconds the bots are allowed to take to load before the first command can be served
+STARTUP_BUDGET = float(os.environ.get("STARTUP_BUDGET", 1.0))
+
+# Whether the bots exit with an error when the startup is over the budget, so a regression fails the deployment
+STARTUP_BUDGET_STRICT = os.environ.get("STARTUP_BUDGET_STRICT", "0") == "1"
 
 # Set up logging
 logging.basicConfig(
@@ -11,21 +21,72 @@ logging.basicConfig(
   format = "%(levelname)s - %(asctime)s: %(message)s"
 )
 
-# Calls the keep_alive function to keep the bots alive
-# keep_alive.keep_alive()
+
+def check_startup_time() -> bool:
+  """Function to check if the time taken to load the bots is within the startup budget"""
+
+  # Gets the time taken to load the bots
+  startup_time = time.perf_counter() - START_TIME
+
+  # Checks if the startup time is over the budget
+  if startup_time > STARTUP_BUDGET:
+
+    # Logs the regression and returns False
+    logging.error(f"Startup took {startup_time:.3f}s, which is over the budget of {STARTUP_BUDGET:.3f}s")
+    return False
+
+  # Logs the startup time
+  logging.info(f"Startup took {startup_time:.3f}s (budget {STARTUP_BUDGET:.3f}s)")
+
+  # Returns True as the startup time is within the budget
+  return True
+
 
 # Function to run the bots
 def run_bots() -> None:
 
+  # Imports keep_alive here because flask is slow to import and is not needed to check the startup time
+  import keep_alive
+
+  # Starts the web server that keeps the bots alive and serves the admission metrics on /metrics
+  keep_alive.keep_alive()
+
+  # Loads the state saved before the last restart, so the first commands are served from warm caches
+  snapshot.snapshotter.load()
+
+  # Starts saving the state now and then
+  snapshot.snapshotter.start()
+
+  # Starts listening for the cache invalidations of the other replicas
+  cache.cache.start()
+
+  # Starts the price ticker that keeps the prices used by the conversion commands up to date
+  price_ticker.ticker.start()
+
+  # Starts the watcher that sends alerts for new transactions of watched wallets
+  watcher.watcher.start()
+
+  # Starts the precomputer that keeps the most requested wallets synced and their graphs rendered while the bots are idle
+  hot_addresses.precomputer.start()
+
   # Starts the telegram bot in a thread
   threading.Thread(target=telegram_bot.bot.infinity_polling).start()
-  
+
+  # Checks the startup time once the telegram bot can accept commands, exiting with an error if it is over the budget in strict mode
+  # (the telegram thread is already running, so the process is ended directly)
+  if not check_startup_time() and STARTUP_BUDGET_STRICT:
+    os._exit(1)
+
   # Starts the discord bot
   discord_bot.bot.run(discord_bot.discord_token)
-      
-  
+
+
 # Name safeguard
 if __name__ == "__main__":
 
+  # Only checks the startup time without running the bots, exiting with an error if it is over the budget
+  if "--check-startup" in sys.argv:
+    sys.exit(0 if check_startup_time() else 1)
+
   # Run the bots
-  run_bots()
\ No newline at end of file
+  run_bots()
@@ -0,0 +1,369 @@
+# Module that keeps a persistent table of the monthly inflow, outflow, gas and transaction counts of every wallet, updated as new transactions are synced
+
+import os, sqlite3, threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import pytz
+import transaction_store, time_series, addresses, local_time
+from transaction_store import TransactionBatch
+
+
+# The path of the SQLite file holding the table
+AGGREGATES_PATH = os.environ.get("AGGREGATES_PATH", "aggregates.db")
+
+# The number of seconds covering any UTC offset, used to find every month boundary near the history in two timezones
+MAX_OFFSET = 86400
+
+# The statements creating the tables, where the month is the year * 12 + the month - 1 and the wei amounts are decimal strings
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS monthly_aggregates (
+  address BLOB NOT NULL,
+  timezone TEXT NOT NULL,
+  month INTEGER NOT NULL,
+  inflow TEXT NOT NULL,
+  outflow TEXT NOT NULL,
+  gas TEXT NOT NULL,
+  incoming INTEGER NOT NULL,
+  outgoing INTEGER NOT NULL,
+  PRIMARY KEY (address, timezone, month)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS aggregated_blocks (
+  address BLOB NOT NULL,
+  timezone TEXT NOT NULL,
+  last_block INTEGER NOT NULL,
+  PRIMARY KEY (address, timezone)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS partial_months (
+  address BLOB NOT NULL,
+  timezone TEXT NOT NULL,
+  first_exact_month INTEGER NOT NULL,
+  PRIMARY KEY (address, timezone)
+) WITHOUT ROWID;
+"""
+
+
+class MonthAggregate:
+  """Class that represents the exact totals of a wallet in one month"""
+
+  __slots__ = ("month", "inflow", "outflow", "gas", "incoming", "outgoing", "partial")
+
+  def __init__(self, month: int, inflow: int = 0, outflow: int = 0, gas: int = 0, incoming: int = 0, outgoing: int = 0) -> None:
+
+    # The month as year * 12 + month - 1
+    self.month = month
+
+    # The wei received, sent and spent on gas
+    self.inflow = inflow
+    self.outflow = outflow
+    self.gas = gas
+
+    # The number of incoming and outgoing transactions
+    self.incoming = incoming
+    self.outgoing = outgoing
+
+    # Whether the month was derived from another timezone without the transactions near its start, so they may be in the wrong month
+    self.partial = False
+
+
+  @property
+  def net(self) -> int:
+    """The net change in wei after paying for gas"""
+    return self.inflow - self.outflow - self.gas
+
+
+  def add(self, other: "MonthAggregate", sign: int = 1) -> None:
+    """Function to add (or with a sign of -1, remove) the totals of another aggregate"""
+    self.inflow += sign * other.inflow
+    self.outflow += sign * other.outflow
+    self.gas += sign * other.gas
+    self.incoming += sign * other.incoming
+    self.outgoing += sign * other.outgoing
+
+
+def month_index(local: datetime) -> int:
+  """Function to get the month of a local time as year * 12 + month - 1"""
+  return local.year * 12 + local.month - 1
+
+
+def month_boundaries(timezone: pytz.timezone, start_time: int, end_time: int) -> Dict[int, int]:
+  """Function to get the timestamp of the start of every month between two timestamps in a timezone"""
+
+  starts, boundaries = time_series.bucket_boundaries("month", timezone, start_time, end_time)
+  return {month_index(start): boundary for start, boundary in zip(starts, boundaries)}
+
+
+def aggregate(batch: TransactionBatch, address: bytes, timezone: pytz.timezone) -> Dict[int, MonthAggregate]:
+  """Function to sum the transactions of a wallet by month in one vectorized pass"""
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  # Returns no months if there are no transactions
+  if not len(batch):
+    return {}
+
+  # Gets the month of every transaction from its local calendar fields
+  fields = local_time.LocalFields(batch.timestamp, timezone)
+  months, groups = numpy.unique(fields.year * 12 + fields.month - 1, return_inverse=True)
+
+  # Gets the direction of every transaction, the same way as the cash flow series
+  incoming = batch.receiver == address
+  outgoing = batch.sender == address
+  succeeded = ~batch.is_error
+
+  # Sums every column by month
+  inflow = batch.value.where(incoming & succeeded).group_sums(groups, len(months)).to_ints()
+  outflow = batch.value.where(outgoing & succeeded).group_sums(groups, len(months)).to_ints()
+  gas = batch.fees().where(outgoing).group_sums(groups, len(months)).to_ints()
+  incoming_counts = numpy.bincount(groups, weights=incoming, minlength=len(months))
+  outgoing_counts = numpy.bincount(groups, weights=outgoing, minlength=len(months))
+
+  # Returns the months that have transactions
+  return {
+    int(month): MonthAggregate(int(month), inflow[i], outflow[i], gas[i], int(incoming_counts[i]), int(outgoing_counts[i]))
+    for i, month in enumerate(months)
+  }
+
+
+class AggregateTable:
+  """Class that keeps the monthly aggregates of every wallet and timezone asked for, stored in SQLite
+
+  New transactions are added to the months they fall in after every sync, so reading n months costs O(n) rows
+  however long the history is. A new timezone for a wallet is derived from a timezone it already has by moving only
+  the transactions between the two zones' month boundaries. If the oldest transactions have been trimmed from the
+  history, the months before it can not be moved and are marked as partial.
+  """
+
+  def __init__(self, store: transaction_store.TransactionStore, path: str = AGGREGATES_PATH) -> None:
+
+    # The transaction store the aggregates are built from
+    self.store = store
+
+    # The path of the SQLite file
+    self.path = path
+
+    # The connection, opened on first use
+    self.connection: Optional[sqlite3.Connection] = None
+
+    # The lock protecting the connection and the tables
+    self.lock = threading.RLock()
+
+    # Adds new transactions to the aggregates whenever the store syncs
+    store.add_listener(self.on_sync)
+
+
+  def get_connection(self) -> sqlite3.Connection:
+    """Function to get the connection, opening the file and creating the tables the first time (must be called with the lock held)"""
+
+    # Checks if the connection has not been opened yet
+    if self.connection is None:
+      self.connection = sqlite3.connect(self.path, check_same_thread=False)
+      self.connection.executescript(SCHEMA)
+
+    return self.connection
+
+
+  def get_last_blocks(self, address: bytes) -> Dict[str, int]:
+    """Function to get the timezones aggregated for a wallet with the last block added to each (must be called with the lock held)"""
+
+    return dict(self.get_connection().execute(
+      "SELECT timezone, last_block FROM aggregated_blocks WHERE address = ?", (address, )
+    ).fetchall())
+
+
+  def get_first_exact_month(self, address: bytes, timezone: str) -> Optional[int]:
+    """Function to get the first month of a wallet in a timezone that is not partial, or None if none are (must be called with the lock held)"""
+
+    row = self.get_connection().execute(
+      "SELECT first_exact_month FROM partial_months WHERE address = ? AND timezone = ?", (address, timezone)
+    ).fetchone()
+    return row[0] if row is not None else None
+
+
+  def get_months(self, address: bytes, timezone: str, first_month: Optional[int] = None, end_month: Optional[int] = None) -> Dict[int, MonthAggregate]:
+    """Function to get the stored months of a wallet in a timezone, either all of them or only the ones from first_month up to end_month (must be called with the lock held)"""
+
+    query = "SELECT month, inflow, outflow, gas, incoming, outgoing FROM monthly_aggregates WHERE address = ? AND timezone = ?"
+    parameters: list = [address, timezone]
+
+    # Only reads the months of the range, found with the primary key
+    if first_month is not None:
+      query += " AND month >= ? AND month < ?"
+      parameters += [first_month, end_month]
+
+    return {
+      month: MonthAggregate(month, int(inflow), int(outflow), int(gas), incoming, outgoing)
+      for month, inflow, outflow, gas, incoming, outgoing in self.get_connection().execute(query, parameters)
+    }
+
+
+  def save_months(self, address: bytes, timezone: str, months: Dict[int, MonthAggregate], last_block: int) -> None:
+    """Function to save the changed months of a wallet in a timezone with the last block they include (must be called with the lock held)"""
+
+    connection = self.get_connection()
+
+    with connection:
+      connection.executemany(
+        "INSERT OR REPLACE INTO monthly_aggregates VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(address, timezone, month.month, str(month.inflow), str(month.outflow), str(month.gas), month.incoming, month.outgoing) for month in months.values()]
+      )
+      connection.execute("INSERT OR REPLACE INTO aggregated_blocks VALUES (?, ?, ?)", (address, timezone, last_block))
+
+
+  def add(self, address: bytes, timezone: str, batch: TransactionBatch, last_block: int) -> None:
+    """Function to add the transactions of a batch after the last block of a timezone to its months (must be called with the lock held)"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Skips the transactions that are already included
+    batch = batch.slice(int(numpy.searchsorted(batch.block_number, last_block, "right")), len(batch))
+    if not len(batch):
+      return
+
+    # Sums the new transactions by month
+    new_months = aggregate(batch, address, pytz.timezone(timezone))
+
+    # Adds them to the stored months they fall in
+    months = self.get_months(address, timezone, min(new_months), max(new_months) + 1)
+    for month, new_month in new_months.items():
+      months.setdefault(month, MonthAggregate(month)).add(new_month)
+
+    # Saves the changed months
+    self.save_months(address, timezone, months, int(batch.block_number[-1]))
+
+
+  def on_sync(self, address: bytes, new_batch: TransactionBatch) -> None:
+    """Function to add newly synced transactions to every timezone aggregated for the address"""
+
+    with self.lock:
+      for timezone, last_block in self.get_last_blocks(address).items():
+        self.add(address, timezone, new_batch, last_block)
+
+
+  def derive(self, address: bytes, batch: TransactionBatch, source: str, timezone: str, trimmed: bool = False) -> Tuple[Dict[int, MonthAggregate], Optional[int]]:
+    """Function to get the months of a wallet in a timezone from its months in another timezone (must be called with the lock held)
+
+    Only the transactions between the start of a month in one timezone and its start in the other move to another
+    month, so only those are summed again. If the history has been trimmed, the transactions near the starts of the
+    months before it are gone, so those months are left as they are in the source timezone.
+
+    Returns the months and the first month that is not partial (None if none are).
+    """
+
+    # Gets the months in the source timezone, which are only as exact as the source
+    months = self.get_months(address, source)
+    first_exact_month = self.get_first_exact_month(address, source)
+    if not len(batch):
+      return months, first_exact_month
+
+    # Gets the start of every month near the history in both timezones
+    first, last = int(batch.timestamp[0]) - MAX_OFFSET, int(batch.timestamp[-1]) + MAX_OFFSET
+    source_boundaries = month_boundaries(pytz.timezone(source), first, last)
+    boundaries = month_boundaries(pytz.timezone(timezone), first, last)
+
+    # Iterates the month boundaries
+    for month in sorted(source_boundaries.keys() & boundaries.keys()):
+
+      # Skips the boundaries before the trimmed history, as the transactions between them are gone (the months up to this one stay partial)
+      if trimmed and min(source_boundaries[month], boundaries[month]) <= int(batch.timestamp[0]):
+        first_exact_month = max(first_exact_month or month + 1, month + 1)
+        continue
+
+      # Gets the transactions between the two starts of the month
+      start, end = sorted((source_boundaries[month], boundaries[month]))
+      moved = batch.window(start, end)
+      if not len(moved):
+        continue
+
+      # Sums them, as they all fall in the same month in each timezone
+      moved_months = aggregate(moved, address, pytz.timezone(source))
+      total = MonthAggregate(month)
+      for moved_month in moved_months.values():
+        total.add(moved_month)
+
+      # Moves them to the previous month if the month starts later in the new timezone, or to this month if it starts earlier
+      from_month, to_month = (month, month - 1) if boundaries[month] > source_boundaries[month] else (month - 1, month)
+      months.setdefault(from_month, MonthAggregate(from_month)).add(total, -1)
+      months.setdefault(to_month, MonthAggregate(to_month)).add(total)
+
+    # Returns the months, dropping the ones left without transactions
+    return {month: aggregate_month for month, aggregate_month in months.items() if aggregate_month.incoming or aggregate_month.outgoing}, first_exact_month
+
+
+  def ensure(self, address: bytes, timezone: str) -> None:
+    """Function to build the months of a wallet in a timezone if they have not been built yet, or catch them up with the history (must be called with the lock held)"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Gets the latest history, which includes every transaction the listener has been or will be told about
+    batch = self.store.batches.get(address, TransactionBatch.empty())
+
+    # Adds any transactions the listener was not told about (like a history restored from a snapshot) if the timezone is already built
+    last_blocks = self.get_last_blocks(address)
+    if timezone in last_blocks:
+      self.add(address, timezone, batch, last_blocks[timezone])
+      return
+
+    # Derives the months from another timezone, using only the part of the history it includes
+    if last_blocks:
+      source, last_block = next(iter(last_blocks.items()))
+      months, first_exact_month = self.derive(address, batch.slice(0, int(numpy.searchsorted(batch.block_number, last_block, "right"))), source, timezone, address in self.store.trimmed)
+
+      # Remembers the months that could not be moved exactly
+      if first_exact_month is not None:
+        with self.get_connection() as connection:
+          connection.execute("INSERT OR REPLACE INTO partial_months VALUES (?, ?, ?)", (address, timezone, first_exact_month))
+
+    # Sums the whole history otherwise
+    else:
+      last_block = int(batch.block_number[-1]) if len(batch) else -1
+      months = aggregate(batch, address, pytz.timezone(timezone))
+
+    # Saves the months
+    self.save_months(address, timezone, months, last_block)
+
+    # Adds the transactions synced after the source timezone's last block
+    self.add(address, timezone, batch, last_block)
+
+
+  def first_exact_month(self, address: str, timezone: pytz.timezone) -> Optional[int]:
+    """Function to get the first month of a wallet in a timezone that is not partial, or None if none are"""
+
+    with self.lock:
+      return self.get_first_exact_month(addresses.normalize(address), timezone.zone)
+
+
+  def months(self, address: str, timezone: pytz.timezone, first_month: int, end_month: int) -> List[MonthAggregate]:
+    """Function to get the aggregates of a wallet for the months from first_month up to end_month, syncing it first"""
+
+    # Normalizes the address into its 20-byte value
+    address = addresses.normalize(address)
+
+    # Syncs the address, which adds its new transactions through the listener
+    self.store.get(address)
+
+    with self.lock:
+
+      # Builds the months of the timezone if this is the first time it is asked for
+      self.ensure(address, timezone.zone)
+
+      # Reads only the months of the window
+      stored = self.get_months(address, timezone.zone, first_month, end_month)
+      first_exact_month = self.get_first_exact_month(address, timezone.zone)
+
+    # Gets every month of the window, with empty months for the ones without transactions
+    months = [stored.get(month) or MonthAggregate(month) for month in range(first_month, end_month)]
+
+    # Marks the months derived without the transactions near their start
+    for month in months:
+      month.partial = first_exact_month is not None and month.month < first_exact_month
+
+    return months
+
+
+# The monthly aggregates of the shared transaction store
+table = AggregateTable(transaction_store.store)
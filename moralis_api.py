@@ -3,12 +3,80 @@
 # References
 # API Docs: https://docs.moralis.io/moralis-dapp/web3-sdk/nft-api
 
-import os, logging
+import logging
 from typing import List, Dict
-from httpx_client import s
+import httpx_client, single_flight, key_pool, circuit_breaker
 
 
-API_KEY = os.environ['MORALIS_KEY']
+def get_api_key() -> str:
+  """Function to get the first Moralis API key (requests take their keys from the key pool)"""
+  return key_pool.moralis.first_key()
+
+
+def request_json(url: str) -> dict:
+  """Function to make a request to the API with a key from the pool, retrying until it succeeds or the circuit opens"""
+
+  # Keep trying until the request succeeds
+  while True:
+
+    # Fails fast with CircuitOpen if Moralis is down
+    circuit_breaker.moralis.allow()
+
+    # Takes a key with budget left from the pool
+    key = key_pool.moralis.acquire()
+
+    try:
+
+      # Gets the response
+      response = httpx_client.get_client().get(url, headers={"Authorization": f"Bearer {key}"})
+
+    # Logs the error and counts the failure
+    except Exception as e:
+      logging.error(e)
+      circuit_breaker.moralis.record_failure()
+      continue
+
+    # Counts server errors as failures
+    if response.status_code >= 500:
+      logging.error(f"Moralis returned {response.status_code}")
+      circuit_breaker.moralis.record_failure()
+      continue
+
+    # Moralis answered, so it is up even if the key is rejected
+    circuit_breaker.moralis.record_success()
+
+    # Rests the key and tries another one if the key was rate limited or rejected
+    if response.status_code == 429:
+      key_pool.moralis.report_rate_limited(key)
+      continue
+
+    if response.status_code in (401, 403):
+      key_pool.moralis.report_invalid(key)
+      continue
+
+    try:
+
+      # Gets the json from the response
+      json_response = response.json()
+
+    # Logs the error
+    except Exception as e:
+      logging.error(e)
+      continue
+
+    # Returns the json
+    key_pool.moralis.report_success(key)
+    return json_response
+
+
+def __getattr__(name: str):
+  """Function to keep moralis_api.API_KEY working without reading it at import time"""
+
+  # Checks if the API key is requested
+  if name == "API_KEY":
+    return get_api_key()
+
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Result:
@@ -31,144 +99,84 @@ def get_results(json_response: List[Dict[str, str]]) -> List[Result]:
     return [Result(**result) for result in results]
 
 
+@single_flight.coalesced
 def get_nft_owners(address: str, token_id: int) -> List[Result]:
   """Returns the list of owners of the NFT with the given token ID"""
 
   # The URL for the API
   url = f"https://api.moralis.io/v2/nft/{address}/{token_id}/owners"
 
-  # Keep trying until the request succeeds
-  while True:
-    try:
-
-      # Gets the response
-      response = s.get(url, headers={"Authorization": f"Bearer {API_KEY}"})
-
-      # Breaks the loop if successful
-      break
-
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(url)
 
   # Returns the list of results
-  return get_results(response.json())
+  return get_results(json_response)
 
+@single_flight.coalesced
 def get_nfts(address: str) -> List[Result]:
   """Returns the list of NFTs owned by the given address"""
 
   # The URL for the API
   url = f"https://api.moralis.io/v2/{address}/nft"
   
-  # Keep trying until the request succeeds
-  while True:
-    try:
-
-      # Gets the response
-      response = s.get(url, headers={"Authorization": f"Bearer {API_KEY}"})
-      
-      # Breaks the loop if successful
-      break
-
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(url)
 
   # Returns the list of results
-  return get_results(response.json())
+  return get_results(json_response)
 
 
+@single_flight.coalesced
 def search_nfts(query: str) -> List[Dict]:
   """Returns the list of NFTs matching the given query"""
 
   # The URL for the API
   url = f"https://api.moralis.io/v2/nft/search?q={query}"
   
-  # Keep trying until the request succeeds
-  while True:
-    try:
-
-      # Gets the response
-      response = s.get(url, headers={"Authorization": f"Bearer {API_KEY}"})
-      
-      # Breaks the loop if successful
-      break
-
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(url)
 
   # Returns the list of results
-  return get_results(response.json())
+  return get_results(json_response)
 
 
+@single_flight.coalesced
 def get_nft_lowest_price(address: str) -> List[Result]:
   """Returns the lowest price of the NFTs owned by the given address"""
 
   # The URL for the API
   url = f"https://api.moralis.io/v2/nft/{address}/lowestprice"
   
-  # Keep trying until the request succeeds
-  while True:
-    try:
-
-      # Gets the response
-      response = s.get(url, headers={"Authorization": f"Bearer {API_KEY}"})
-      
-      # Breaks the loop if successful
-      break
-
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(url)
 
   # Returns the list of results
-  return get_results(response.json())
+  return get_results(json_response)
 
 
+@single_flight.coalesced
 def token_id_metadata(address: str, token_id: int) -> Result:
   """Returns the metadata of the NFT with the given token ID"""
 
   # The URL for the API
   url = f"https://api.moralis.io/v2/nft/{address}/{token_id}"
   
-  # Keep trying until the request succeeds
-  while True:
-    try:
-
-      # Gets the response
-      response = s.get(url, headers={"Authorization": f"Bearer {API_KEY}"})
-      
-      # Breaks the loop if successful
-      break
-
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(url)
 
   # Returns the result object
-  return Result(**response.json())
+  return Result(**json_response)
 
 
+@single_flight.coalesced
 def get_wallet_token_id_transfers(address: str, token_id: int) -> List[Result]:
   """Returns the list of transfers of the NFT with the given token ID"""
 
   # The URL for the API
   url = f"https://api.moralis.io/v2/nft/{address}/{token_id}/transfers"
 
-  # Keep trying until the request succeeds
-  while True:
-    try:
-
-      # Gets the response
-      response = s.get(url, headers={"Authorization": f"Bearer {API_KEY}"})
-
-      # Breaks the loop if successful
-      break
-
-    # Logs the error
-    except Exception as e:
-      logging.error(e)
+  # Gets the json from the API with a key from the pool
+  json_response = request_json(url)
 
   # Returns the list of results
-  return get_results(response.json())
+  return get_results(json_response)
@@ -0,0 +1,203 @@
+# Module to value the ERC-20 tokens held by a wallet from its token transfers
+
+import os
+from typing import List, Optional, Tuple
+import etherscan_api, price_ticker, addresses, cache
+from wei import WeiArray, TOKEN_LIMBS
+
+
+# The maximum number of token transfers Etherscan returns in one page
+MAX_TOKEN_TRANSFERS = 10000
+
+# The maximum number of pages of token transfers fetched for a wallet, which bounds the requests made for the busiest wallets
+MAX_TOKEN_PAGES = int(os.environ.get("MAX_TOKEN_PAGES", 10))
+
+# The number of seconds the balances of a wallet are cached for, which can be long as a new token transfer changes the key
+BALANCES_TTL = 86400.0
+
+# The note added to the portfolio when the wallet has more token transfers than are fetched
+TRUNCATION_NOTE = f"(partial history: only the latest token transfers, up to {MAX_TOKEN_PAGES * MAX_TOKEN_TRANSFERS:,}, are counted, so the balances may be off)"
+
+# Token balances smaller than this are treated as dust left by rounding and are not shown
+DUST_BALANCE = 1e-12
+
+
+class Holding:
+  """Class that represents the balance and value of one token held by a wallet"""
+
+  def __init__(self, contract_address: str, symbol: str, name: str, balance: float, price: Optional[float]) -> None:
+    self.contract_address = contract_address
+    self.symbol = symbol
+    self.name = name
+    self.balance = balance
+    self.price = price
+
+    # The value of the holding (None if the token has no known price)
+    self.value = balance * price if price is not None else None
+
+
+def get_latest_token_block(address: str) -> int:
+  """Function to get the block of the latest token transfer of a wallet"""
+
+  # Gets the latest token transfer
+  latest = etherscan_api.get_token_transactions(address, False, False, 1)
+
+  # Returns its block number (0 if the wallet has no token transfers)
+  return int(latest[0].blockNumber) if latest else 0
+
+
+def get_token_transfers(address: str) -> Tuple[List[etherscan_api.Transaction], bool]:
+  """Function to get the token transfers of a wallet, newest first, page by page up to the maximum number of pages
+
+  Etherscan returns at most one page for a query, so each page asks for the blocks before the oldest block of the
+  previous one. Returns the transfers and whether they are the full history (False if older transfers were left out).
+  """
+
+  # The transfers and the last block of the next page (None for the latest block)
+  transfers = []
+  end_block = None
+
+  for _ in range(MAX_TOKEN_PAGES):
+
+    # Gets the page
+    page = etherscan_api.get_token_transactions(address, False, False, MAX_TOKEN_TRANSFERS, end_block) or []
+
+    # Adds the page and stops if it is the last one
+    if len(page) < MAX_TOKEN_TRANSFERS:
+      transfers += page
+      return transfers, True
+
+    # Gets the oldest block of the page, which may have more transfers than the page holds
+    oldest_block = int(page[-1].blockNumber)
+
+    # Stops if the whole page is one block, as its other transfers can not be fetched
+    if oldest_block == end_block:
+      transfers += page
+      return transfers, False
+
+    # Adds the page without the oldest block, which the next page fetches in full
+    transfers += [transfer for transfer in page if int(transfer.blockNumber) > oldest_block]
+    end_block = oldest_block
+
+  # Returns the transfers fetched, which are not the full history
+  return transfers, False
+
+
+def compute_token_balances(transfers: List[etherscan_api.Transaction], address: str) -> List[Tuple[str, str, str, float]]:
+  """Function to reconstruct the balance of every token from the token transfers of a wallet"""
+
+  # Imports numpy here because it is slow to import
+  import numpy
+
+  # Checks if there are no transfers
+  if not transfers:
+    return []
+
+  # Normalizes the address into its 20-byte value
+  address = addresses.normalize(address)
+
+  # Gets the columns of the transfers
+  contracts = numpy.array([transfer.contractAddress.lower() for transfer in transfers])
+  senders = numpy.array([transfer.__dict__["from"] for transfer in transfers], dtype="S20")
+  receivers = numpy.array([transfer.to for transfer in transfers], dtype="S20")
+  values = WeiArray.from_values((transfer.value for transfer in transfers), TOKEN_LIMBS)
+
+  # Gets the sign of each transfer (+1 incoming, -1 outgoing, 0 for transfers to itself)
+  signs = (receivers == address).astype(numpy.int64) - (senders == address).astype(numpy.int64)
+
+  # Groups the transfers by contract address
+  unique_contracts, first_index, inverse = numpy.unique(contracts, return_index=True, return_inverse=True)
+
+  # Sums the signed amounts of each token exactly in the token's smallest unit
+  raw_balances = values.signed(signs).group_sums(inverse, len(unique_contracts)).to_ints()
+
+  # The list of token balances
+  balances = []
+
+  # Iterates the tokens
+  for contract, index, raw_balance in zip(unique_contracts.tolist(), first_index.tolist(), raw_balances):
+
+    # Gets the first transfer of the token for its symbol, name and decimals
+    transfer = transfers[index]
+
+    # Gets the balance in whole tokens
+    balance = raw_balance / 10**int(transfer.tokenDecimal or 0)
+
+    # Adds the token if the wallet still holds it
+    if balance > DUST_BALANCE:
+      balances.append((contract, transfer.tokenSymbol, transfer.tokenName, balance))
+
+  # Returns the token balances
+  return balances
+
+
+def get_token_balances(address: str) -> Tuple[List[Tuple[str, str, str, float]], bool]:
+  """Function to get the token balances of a wallet and whether they come from its full history, cached until the wallet has a new token transfer"""
+
+  # Gets the cache key from the address and the block of the latest token transfer
+  key = f"{addresses.to_hex(addresses.normalize(address))}:{get_latest_token_block(address)}"
+
+  # Returns the balances if they are cached in memory or by another replica
+  balances = cache.cache.get("portfolio_balances", key)
+  if balances is not None:
+    return balances
+
+  # Gets the token transfers and computes the balances
+  transfers, complete = get_token_transfers(address)
+  balances = compute_token_balances(transfers, address), complete
+
+  # Caches the balances for every replica
+  cache.cache.set("portfolio_balances", key, balances, BALANCES_TTL)
+
+  # Returns the balances
+  return balances
+
+
+def get_portfolio(address: str, currency: str = "usd") -> Tuple[List[Holding], bool]:
+  """Function to get the tokens held by a wallet with their value, highest value first, and whether they come from its full history"""
+
+  # Gets the token balances
+  balances, complete = get_token_balances(address)
+
+  # Gets the prices of every token in one batched lookup
+  prices = price_ticker.ticker.get_token_prices([contract for contract, _, _, _ in balances], currency)
+
+  # Creates the holdings
+  holdings = [Holding(contract, symbol, name, balance, prices.get(contract)) for contract, symbol, name, balance in balances]
+
+  # Sorts the holdings by value, with the tokens without a price last
+  holdings.sort(key=lambda holding: (holding.value is not None, holding.value or 0.0), reverse=True)
+
+  # Returns the holdings
+  return holdings, complete
+
+
+def get_portfolio_summary(address: str, currency: str = "usd", max_holdings: int = 20) -> str:
+  """Function to get the portfolio of a wallet as a message"""
+
+  # Gets the holdings
+  holdings, complete = get_portfolio(address, currency)
+
+  # Checks if the wallet holds no tokens
+  if not holdings:
+    return f"{address} does not hold any ERC-20 tokens."
+
+  # Gets the total value of the tokens with a known price
+  total = sum(holding.value for holding in holdings if holding.value is not None)
+
+  # Creates a line for each of the most valuable holdings
+  lines = [
+    f"{holding.symbol}: {holding.balance:,.4f}" + (f" ({holding.value:,.2f} {currency.upper()})" if holding.value is not None else "")
+    for holding in holdings[:max_holdings]
+  ]
+
+  # Mentions the holdings that are not shown
+  if len(holdings) > max_holdings:
+    lines.append(f"...and {len(holdings) - max_holdings} more tokens")
+
+  # Mentions that the balances leave out the oldest transfers
+  if not complete:
+    lines.append(f"\n{TRUNCATION_NOTE}")
+
+  # Returns the summary
+  return f"Token portfolio of {address}\nTotal value: {total:,.2f} {currency.upper()}\n\n" + "\n".join(lines)
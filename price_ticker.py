@@ -0,0 +1,281 @@
+# Module that keeps the prices of crypto assets up to date in the background
+
+import os, logging, threading, time
+from typing import Dict, List, Optional, Tuple
+import httpx_client, circuit_breaker, cache
+
+
+# The CoinGecko IDs of the assets to keep prices for
+PRICE_ASSETS = os.environ.get("PRICE_ASSETS", "ethereum,bitcoin,tether,usd-coin,binancecoin,matic-network,solana").split(",")
+
+# The fiat currencies to keep prices in
+PRICE_CURRENCIES = os.environ.get("PRICE_CURRENCIES", "usd,eur,gbp,sgd,inr").split(",")
+
+# The number of seconds between refreshes
+PRICE_REFRESH_INTERVAL = float(os.environ.get("PRICE_REFRESH_INTERVAL", 30))
+
+# The maximum number of contract addresses in one token price request
+MAX_TOKEN_PRICE_ADDRESSES = 100
+
+# The number of attempts at loading the first snapshot and the seconds waited after the first failed attempt (doubled after each one)
+FIRST_LOAD_ATTEMPTS = 3
+FIRST_LOAD_BACKOFF = 1.0
+
+# The number of seconds lookups fail fast after the first snapshot could not be loaded, instead of all trying again
+FIRST_LOAD_RETRY_AFTER = 10.0
+
+
+def check_prices(json_response) -> dict:
+  """Function to check that a CoinGecko response maps every asset to its prices, raising ValueError for errors like rate limit replies"""
+
+  # Checks if the response is not a dictionary or is an error message
+  if not isinstance(json_response, dict) or "status" in json_response or "error" in json_response:
+    raise ValueError(f"Unexpected CoinGecko response: {str(json_response)[:200]}")
+
+  # Checks if any of the prices is not a number
+  for prices in json_response.values():
+    if not isinstance(prices, dict) or not all(isinstance(price, (int, float)) and not isinstance(price, bool) for price in prices.values()):
+      raise ValueError(f"Unexpected CoinGecko prices: {str(prices)[:200]}")
+
+  # Returns the checked response
+  return json_response
+
+
+class PriceTicker:
+  """Class that refreshes the prices of many assets in one request per interval and keeps them in memory"""
+
+  def __init__(self, assets: List[str], currencies: List[str], interval: float) -> None:
+
+    # The CoinGecko IDs of the assets
+    self.assets = [asset.strip().lower() for asset in assets if asset.strip()]
+
+    # The fiat currencies
+    self.currencies = [currency.strip().lower() for currency in currencies if currency.strip()]
+
+    # The number of seconds between refreshes
+    self.interval = interval
+
+    # The snapshot of prices, mapping the asset to a dictionary mapping the currency to the price
+    self.snapshot: Dict[str, Dict[str, float]] = {}
+
+    # The time the snapshot was last refreshed
+    self.updated_at: Optional[float] = None
+
+    # The dictionary that maps (contract address, currency) to the token price and the time it was fetched
+    self.token_prices: Dict[Tuple[str, str], Tuple[Optional[float], float]] = {}
+
+    # The lock making sure only one thread loads the first snapshot
+    self.first_load_lock = threading.Lock()
+
+    # The time the first snapshot last failed to load
+    self.first_load_failed_at: Optional[float] = None
+
+    # The refresh thread
+    self.thread: Optional[threading.Thread] = None
+
+
+  def get_json(self, url: str) -> dict:
+    """Function to make a request to CoinGecko through its circuit breaker, checking that the response holds prices"""
+
+    # Fails fast with CircuitOpen if CoinGecko is down
+    circuit_breaker.coingecko.allow()
+
+    try:
+
+      # Gets the response, raising for error statuses like 429
+      response = httpx_client.get_client().get(url)
+      response.raise_for_status()
+
+      # Gets the json from the response, raising ValueError if it is not prices
+      json_response = check_prices(response.json())
+
+    # Counts the failure (including error replies) and passes the error on
+    except Exception:
+      circuit_breaker.coingecko.record_failure()
+      raise
+
+    # Returns the json
+    circuit_breaker.coingecko.record_success()
+    return json_response
+
+
+  def load_shared(self) -> bool:
+    """Function to take the snapshot from the shared cache if another replica refreshed it within the interval"""
+
+    # Gets the shared snapshot of the same assets and currencies
+    shared = cache.cache.get("prices", f"{','.join(self.assets)}|{','.join(self.currencies)}", local=False)
+
+    # Checks if it is recent and newer than this one
+    if shared is None or time.time() - shared["updated_at"] >= self.interval or shared["updated_at"] <= (self.updated_at or 0.0):
+      return False
+
+    # Replaces the snapshot in one assignment
+    self.snapshot = shared["prices"]
+    self.updated_at = shared["updated_at"]
+    return True
+
+
+  def refresh(self) -> None:
+    """Function to fetch the prices of every asset in every currency with one request"""
+
+    # Uses the snapshot of another replica if it refreshed the prices recently, so the replicas share one request
+    if self.load_shared():
+      return
+
+    # The URL for the API
+    url = "https://api.coingecko.com/api/v3/simple/price" \
+     f"?ids={','.join(self.assets)}" \
+     f"&vs_currencies={','.join(self.currencies)}"
+
+    # Gets the json from the response
+    json_response = self.get_json(url)
+
+    # Replaces the snapshot with the new prices in one assignment, so readers never see a half updated snapshot
+    self.snapshot = {
+      asset: {currency: float(price) for currency, price in prices.items()}
+      for asset, prices in json_response.items()
+    }
+
+    # Sets the time of the refresh
+    self.updated_at = time.time()
+
+    # Writes the snapshot through to the shared cache for the other replicas
+    cache.cache.set("prices", f"{','.join(self.assets)}|{','.join(self.currencies)}", {"prices": self.snapshot, "updated_at": self.updated_at}, self.interval, local=False)
+
+
+  def ensure_loaded(self) -> None:
+    """Function to load the first snapshot if the ticker has not loaded one yet"""
+
+    # Checks if there is no snapshot yet
+    if self.updated_at is None:
+      with self.first_load_lock:
+
+        # Fails fast if the first snapshot has just failed to load, instead of every waiting thread trying again
+        if self.updated_at is None and self.first_load_failed_at is not None and time.time() - self.first_load_failed_at < FIRST_LOAD_RETRY_AFTER:
+          raise circuit_breaker.CircuitOpen(circuit_breaker.coingecko.name, self.first_load_failed_at + FIRST_LOAD_RETRY_AFTER - time.time())
+
+        # Tries a few times with a growing wait until the first snapshot is loaded (another thread may have loaded it while waiting)
+        backoff = FIRST_LOAD_BACKOFF
+        for attempt in range(FIRST_LOAD_ATTEMPTS):
+          if self.updated_at is not None:
+            return
+
+          try:
+            self.refresh()
+
+          # Gives up if CoinGecko is down, as there is no snapshot to fall back on
+          except circuit_breaker.CircuitOpen:
+            self.first_load_failed_at = time.time()
+            raise
+
+          # Logs the error and waits before the next attempt
+          except Exception as e:
+            logging.error(e)
+            if attempt < FIRST_LOAD_ATTEMPTS - 1:
+              time.sleep(backoff)
+              backoff *= 2
+
+        # Gives up once every attempt failed, as there is no snapshot to fall back on
+        if self.updated_at is None:
+          self.first_load_failed_at = time.time()
+          raise circuit_breaker.CircuitOpen(circuit_breaker.coingecko.name, FIRST_LOAD_RETRY_AFTER)
+
+
+  def get_price(self, asset: str = "ethereum", currency: str = "usd") -> Optional[float]:
+    """Function to get the price of an asset from the snapshot, returning None if it is not tracked"""
+
+    # Loads the first snapshot if needed (only the very first lookup before the ticker starts waits)
+    self.ensure_loaded()
+
+    # Returns the price from the snapshot
+    return self.snapshot.get(asset.lower(), {}).get(currency.lower())
+
+
+  def staleness(self) -> Optional[float]:
+    """Function to get the age of the snapshot in seconds if it is being served while CoinGecko is down, or None if it is fresh"""
+
+    # Returns the age of the snapshot if CoinGecko is down
+    if self.updated_at is not None and circuit_breaker.coingecko.is_open():
+      return time.time() - self.updated_at
+
+
+  def get_prices(self, assets: List[str], currency: str = "usd") -> Dict[str, Optional[float]]:
+    """Function to get the prices of many assets in a currency from the snapshot"""
+    return {asset: self.get_price(asset, currency) for asset in assets}
+
+
+  def get_token_prices(self, contract_addresses: List[str], currency: str = "usd") -> Dict[str, Optional[float]]:
+    """Function to get the prices of ERC-20 tokens by contract address, fetching the missing ones in batched requests"""
+
+    # Normalizes the contract addresses and the currency
+    contract_addresses = [contract_address.lower() for contract_address in contract_addresses]
+    currency = currency.lower()
+
+    # Gets the current time
+    now = time.time()
+
+    # Gets the contract addresses without a price fetched within the refresh interval
+    missing = [
+      contract_address for contract_address in contract_addresses
+      if now - self.token_prices.get((contract_address, currency), (None, 0.0))[1] > self.interval
+    ]
+
+    # Fetches the missing prices in batches of the maximum number of contract addresses per request
+    for start in range(0, len(missing), MAX_TOKEN_PRICE_ADDRESSES):
+
+      # Gets the batch of contract addresses
+      batch = missing[start : start + MAX_TOKEN_PRICE_ADDRESSES]
+
+      # The URL for the API
+      url = "https://api.coingecko.com/api/v3/simple/token_price/ethereum" \
+       f"?contract_addresses={','.join(batch)}" \
+       f"&vs_currencies={currency}"
+
+      try:
+
+        # Gets the json from the response
+        json_response = self.get_json(url)
+
+      # Logs the error and leaves the old prices in place
+      except Exception as e:
+        logging.error(e)
+        continue
+
+      # Saves the price of every contract address in the batch (None if CoinGecko does not know the token)
+      for contract_address in batch:
+        price = json_response.get(contract_address, {}).get(currency)
+        self.token_prices[(contract_address, currency)] = (float(price) if price is not None else None, now)
+
+    # Returns the prices of the tokens
+    return {contract_address: self.token_prices.get((contract_address, currency), (None, 0.0))[0] for contract_address in contract_addresses}
+
+
+  def run(self) -> None:
+    """Function to refresh the snapshot forever"""
+
+    while True:
+      try:
+        self.refresh()
+
+      # Logs the error and keeps the old snapshot
+      except Exception as e:
+        logging.error(e)
+
+      # Waits until the next refresh
+      time.sleep(self.interval)
+
+
+  def start(self) -> None:
+    """Function to start the refresh thread"""
+
+    # Checks if the ticker is already running
+    if self.thread is not None:
+      return
+
+    # Starts the refresh thread
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+
+# The price ticker shared by both bots
+ticker = PriceTicker(PRICE_ASSETS, PRICE_CURRENCIES, PRICE_REFRESH_INTERVAL)
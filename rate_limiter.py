@@ -0,0 +1,90 @@
+# Module that contains the rate limiter used to stay within the API rate budgets
+
+import threading, time
+
+
+class TokenBucket:
+  """Class that represents a token bucket that refills at a fixed rate"""
+
+  def __init__(self, rate: float, capacity: float) -> None:
+
+    # The number of tokens added every second
+    self.rate = rate
+
+    # The maximum number of tokens in the bucket
+    self.capacity = capacity
+
+    # The number of tokens in the bucket, which starts full
+    self.tokens = capacity
+
+    # The time the bucket was last refilled
+    self.last_refill = time.monotonic()
+
+    # The lock protecting the bucket
+    self.lock = threading.Lock()
+
+
+  def refill(self) -> None:
+    """Function to add the tokens gained since the last refill (must be called with the lock held)"""
+
+    # Gets the current time
+    now = time.monotonic()
+
+    # Adds the tokens gained since the last refill without going over the capacity
+    self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+
+    # Sets the last refill time to now
+    self.last_refill = now
+
+
+  def try_acquire(self, tokens: float = 1) -> bool:
+    """Function to take tokens from the bucket if there are enough, without waiting"""
+
+    with self.lock:
+      self.refill()
+
+      # Checks if there are enough tokens
+      if self.tokens >= tokens:
+
+        # Takes the tokens
+        self.tokens -= tokens
+        return True
+
+    # Returns False as there are not enough tokens
+    return False
+
+
+  def wait_time(self, tokens: float = 1) -> float:
+    """Function to get the number of seconds until there are enough tokens in the bucket"""
+
+    with self.lock:
+      self.refill()
+
+      # Returns the time needed to gain the missing tokens
+      return max(0.0, (tokens - self.tokens) / self.rate)
+
+
+  def acquire(self, tokens: float = 1) -> None:
+    """Function to take tokens from the bucket, waiting until there are enough"""
+
+    # Keep trying until the tokens are taken
+    while not self.try_acquire(tokens):
+
+      # Waits until there should be enough tokens
+      time.sleep(self.wait_time(tokens))
+
+
+  def available(self) -> float:
+    """Function to get the number of tokens in the bucket"""
+
+    with self.lock:
+      self.refill()
+      return self.tokens
+
+
+  def give_back(self, tokens: float = 1) -> None:
+    """Function to return tokens that were taken for a request that was not made"""
+
+    with self.lock:
+      self.refill()
+      self.tokens = min(self.capacity, self.tokens + tokens)
@@ -0,0 +1,127 @@
+# Module that shares one upstream call between identical requests made at the same time
+
+import asyncio, functools, inspect, threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+import io_pool
+
+
+class SingleFlight:
+  """Class that makes concurrent calls with the same key share one call and one result"""
+
+  def __init__(self) -> None:
+
+    # The dictionary that maps the key of a call to the future of its result
+    self.in_flight: Dict[Hashable, Future] = {}
+
+    # The lock protecting the calls in flight
+    self.lock = threading.Lock()
+
+
+  def join(self, key: Hashable) -> Tuple[Future, bool]:
+    """Function to get the future of the call with the given key and whether the caller has to make the call"""
+
+    with self.lock:
+
+      # Gets the future of the call in flight
+      future = self.in_flight.get(key)
+
+      # Checks if there is a call in flight
+      if future is not None:
+        return future, False
+
+      # Otherwise, registers a new call that the caller has to make
+      future = Future()
+      self.in_flight[key] = future
+      return future, True
+
+
+  def run(self, key: Hashable, future: Future, function: Callable, args: tuple, kwargs: dict) -> None:
+    """Function to make the call and give the result to everyone waiting for it"""
+
+    try:
+
+      # Makes the call and stores the result
+      future.set_result(function(*args, **kwargs))
+
+    # Stores the error so every caller gets it
+    except BaseException as e:
+      future.set_exception(e)
+
+    # Removes the call so later requests fetch fresh data
+    finally:
+      with self.lock:
+        self.in_flight.pop(key, None)
+
+
+  def do(self, key: Hashable, function: Callable, *args, **kwargs) -> Any:
+    """Function to make the call, or wait for the identical call already in flight"""
+
+    # Gets the future for the call
+    future, leader = self.join(key)
+
+    # Makes the call if no identical call is in flight
+    if leader:
+      self.run(key, future, function, args, kwargs)
+
+    # Returns the shared result
+    return future.result()
+
+
+  async def do_async(self, key: Hashable, function: Callable, *args, **kwargs) -> Any:
+    """Function to make the call in a worker thread, or wait for the identical call already in flight"""
+
+    # Gets the future for the call
+    future, leader = self.join(key)
+
+    # Makes the call in the shared I/O pool if no identical call is in flight
+    if leader:
+      io_pool.submit(self.run, key, future, function, args, kwargs)
+
+    # Returns the shared result
+    return await asyncio.wrap_future(future)
+
+
+def normalize(value: Any) -> Any:
+  """Function to normalize an argument so that equivalent requests get the same key"""
+
+  # Checks if the value is a hex string (address or hash), which is case insensitive
+  if isinstance(value, str) and value.strip().lower().startswith("0x"):
+    return value.strip().lower()
+
+  # Returns the value unchanged otherwise
+  return value
+
+
+# The single flight group shared by the API wrappers
+group = SingleFlight()
+
+
+def coalesced(function: Callable) -> Callable:
+  """Decorator to make concurrent identical calls to an API function share one upstream request"""
+
+  # Gets the signature of the function to fill in the default arguments
+  signature = inspect.signature(function)
+
+  def make_key(args: tuple, kwargs: dict) -> Hashable:
+    """Function to build the key of the request from the function and its normalized arguments"""
+
+    # Binds the arguments to the parameters, so positional, keyword and default arguments give the same key
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+
+    # Returns the key
+    return (function.__module__, function.__qualname__, tuple(normalize(value) for value in bound.arguments.values()))
+
+  @functools.wraps(function)
+  def wrapper(*args, **kwargs):
+    return group.do(make_key(args, kwargs), function, *args, **kwargs)
+
+  async def call_async(*args, **kwargs):
+    return await group.do_async(make_key(args, kwargs), function, *args, **kwargs)
+
+  # Lets async callers use the function without blocking the event loop
+  wrapper.call_async = call_async
+
+  # Returns the wrapped function
+  return wrapper
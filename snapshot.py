@@ -0,0 +1,264 @@
+# Module that saves the hot in-memory state to a file now and then and loads it back on startup, so a restart does not begin with cold caches
+
+import os, atexit, json, logging, mmap, struct, threading, time
+from typing import Any, List, Optional, Tuple
+import addresses, price_ticker, hot_addresses, transaction_store
+from transaction_store import TransactionBatch
+from wei import WeiArray
+
+
+# The path of the snapshot file
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "snapshot.bin")
+
+# The number of seconds between snapshots
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 300))
+
+# The maximum number of transaction histories saved, taking the hot wallets first and then the most recently synced
+MAX_SNAPSHOT_HISTORIES = int(os.environ.get("MAX_SNAPSHOT_HISTORIES", 50))
+
+# The oldest snapshot loaded, and the oldest prices and histories loaded from it
+MAX_SNAPSHOT_AGE = 86400.0
+PRICE_MAX_AGE = 600.0
+HISTORY_MAX_AGE = 86400.0
+
+# The bytes the file starts with, which change whenever the layout does
+MAGIC = b"CABSNAP1"
+
+# The alignment of the arrays in the file, so they can be used straight from the mapped memory
+ALIGNMENT = 8
+
+
+def align(offset: int) -> int:
+  """Function to round an offset up to the alignment"""
+  return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class Snapshotter:
+  """Class that writes the prices, hot wallets, recent histories and rendered graphs to one file and loads them back
+
+  The file is a JSON header followed by the raw columns of the histories. Loading maps the file into memory and
+  uses the columns where they are, so a large snapshot loads in about the time it takes to read the header.
+  """
+
+  def __init__(self, path: str = SNAPSHOT_PATH, interval: float = SNAPSHOT_INTERVAL) -> None:
+
+    # The path of the snapshot file
+    self.path = path
+
+    # The number of seconds between snapshots
+    self.interval = interval
+
+    # The snapshot thread
+    self.thread: Optional[threading.Thread] = None
+
+    # The lock making sure one snapshot is written at a time
+    self.lock = threading.Lock()
+
+
+  def collect_histories(self) -> List[bytes]:
+    """Function to choose the histories to save, hot wallets first and then the most recently synced"""
+
+    store = transaction_store.store
+    synced_at = dict(store.synced_at)
+
+    # Orders the synced wallets by whether they are hot, then by the time of their last sync
+    chosen = sorted(synced_at, key=lambda address: (address in hot_addresses.tracker.hot, synced_at[address]), reverse=True)
+
+    return [address for address in chosen[:MAX_SNAPSHOT_HISTORIES] if address in store.batches]
+
+
+  def save(self) -> None:
+    """Function to write the snapshot to a temporary file and move it over the old one, so a crash never leaves half a snapshot"""
+
+    with self.lock:
+      store = transaction_store.store
+      ticker = price_ticker.ticker
+
+      # The (offset from the start of the data, array) pairs written after the header, and the offset of the next array
+      arrays: List[Tuple[int, Any]] = []
+      offset = 0
+
+      # Describes every saved history with its columns
+      histories = []
+      for address in self.collect_histories():
+
+        # Skips the histories evicted since they were chosen
+        batch = store.batches.get(address)
+        synced_at = store.synced_at.get(address)
+        if batch is None or synced_at is None:
+          continue
+
+        columns = []
+
+        # Saves the hashes as ASCII, a quarter of the size of the unicode column, and the wei values as their limbs
+        for column in TransactionBatch.columns:
+          array = getattr(batch, column)
+          array = array.astype("S66") if column == "hash" else array.limbs if column == "value" else array
+          columns.append([column, array.dtype.str, list(array.shape), offset])
+          arrays.append((offset, array))
+          offset = align(offset + array.nbytes)
+
+        histories.append({
+          "address": addresses.to_hex(address),
+          "last_block": store.last_blocks.get(address, -1),
+          "synced_at": synced_at,
+          "incomplete": address in store.incomplete,
+          "trimmed": address in store.trimmed,
+          "columns": columns
+        })
+
+      # Gets the rendered graphs, which are checked against the restored histories by their versions when they are used
+      with hot_addresses.precomputer.lock:
+        graphs = [
+          [addresses.to_hex(key[0]), list(key[1:]), list(version), result]
+          for key, (version, result) in hot_addresses.precomputer.results.items() if isinstance(result, str)
+        ]
+
+      # Gets the scores of the tracked wallets, which keep decaying from the time they were saved
+      with hot_addresses.tracker.lock:
+        scores = [[addresses.to_hex(address), score, updated_at] for address, (score, updated_at) in hot_addresses.tracker.scores.items()]
+        hot = [addresses.to_hex(address) for address in hot_addresses.tracker.hot]
+
+      # Creates the header
+      header = json.dumps({
+        "created_at": time.time(),
+        "prices": {"snapshot": ticker.snapshot, "updated_at": ticker.updated_at},
+        "token_prices": [[contract, currency, price, fetched_at] for (contract, currency), (price, fetched_at) in list(ticker.token_prices.items())],
+        "scores": scores,
+        "hot": hot,
+        "graphs": graphs,
+        "histories": histories
+      }).encode()
+
+      # Writes the magic bytes, the header and the aligned arrays
+      data_start = align(len(MAGIC) + 4 + len(header))
+      temporary_path = f"{self.path}.tmp"
+      with open(temporary_path, "wb") as file:
+        file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for array_offset, array in arrays:
+          file.seek(data_start + array_offset)
+          file.write(array.tobytes())
+
+        # Pads the file to the end of the last array, so even empty arrays lie inside it
+        file.truncate(data_start + offset)
+
+      # Replaces the old snapshot
+      os.replace(temporary_path, self.path)
+
+    logging.info(f"Saved a snapshot of {len(histories)} histories and {len(graphs)} graphs")
+
+
+  def load(self) -> bool:
+    """Function to restore the state saved in the snapshot, skipping anything too old, and return whether a snapshot was loaded"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    try:
+
+      # Maps the file into memory
+      with open(self.path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Starts cold if there is no snapshot
+    except (FileNotFoundError, ValueError):
+      return False
+
+    try:
+
+      # Checks the magic bytes and reads the header
+      if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError("Unknown snapshot format")
+      header_length, = struct.unpack_from("<I", mapped, len(MAGIC))
+      header = json.loads(mapped[len(MAGIC) + 4 : len(MAGIC) + 4 + header_length])
+      data_start = align(len(MAGIC) + 4 + header_length)
+
+      # Skips the whole snapshot if it is too old
+      now = time.time()
+      if now - header["created_at"] > MAX_SNAPSHOT_AGE:
+        logging.info("The snapshot is too old to load")
+        return False
+
+      # Reads the histories that are recent enough, using their columns straight from the mapped file, before
+      # restoring anything, so a truncated file is skipped whole instead of leaving half of it restored
+      store = transaction_store.store
+      histories = []
+      for history in header["histories"]:
+        address = addresses.normalize(history["address"])
+        if now - history["synced_at"] > HISTORY_MAX_AGE or address in store.batches:
+          continue
+
+        columns = {}
+        for column, dtype, shape, offset in history["columns"]:
+          array = numpy.frombuffer(mapped, dtype=dtype, count=int(numpy.prod(shape)), offset=data_start + offset).reshape(shape)
+          columns[column] = array.astype("<U66") if column == "hash" else WeiArray(array) if column == "value" else array
+        histories.append((address, history, TransactionBatch(**columns)))
+
+      # Restores the prices if they are recent enough, keeping their time so their age is reported honestly
+      ticker = price_ticker.ticker
+      prices = header["prices"]
+      if prices["updated_at"] is not None and now - prices["updated_at"] < PRICE_MAX_AGE and ticker.updated_at is None:
+        ticker.snapshot = prices["snapshot"]
+        ticker.updated_at = prices["updated_at"]
+      for contract, currency, price, fetched_at in header["token_prices"]:
+        if now - fetched_at < PRICE_MAX_AGE:
+          ticker.token_prices[(contract, currency)] = (price, fetched_at)
+
+      # Restores the scores of the tracked wallets and the hot wallets
+      with hot_addresses.tracker.lock:
+        for address, score, updated_at in header["scores"]:
+          hot_addresses.tracker.scores[addresses.normalize(address)] = (score, updated_at)
+        hot_addresses.tracker.hot = {addresses.normalize(address) for address in header["hot"]}
+
+      # Adds the histories, which the next sync only fetches the new blocks for
+      for address, history, batch in histories:
+        store.batches[address] = batch
+        store.last_blocks[address] = history["last_block"]
+        store.synced_at[address] = history["synced_at"]
+        store.set_flag(store.incomplete, address, history.get("incomplete", False))
+        store.set_flag(store.trimmed, address, history.get("trimmed", False))
+      restored = len(histories)
+
+      # Restores the rendered graphs, which are only used if their versions match the restored histories
+      with hot_addresses.precomputer.lock:
+        for address, key, version, graph in header["graphs"]:
+          hot_addresses.precomputer.results[(addresses.normalize(address), *key)] = (tuple(version), graph)
+
+    # Starts cold if the snapshot cannot be read
+    except Exception as e:
+      logging.error(f"Could not load the snapshot: {e}")
+      return False
+
+    logging.info(f"Loaded a snapshot from {now - header['created_at']:.0f}s ago with {restored} histories and {len(header['graphs'])} graphs")
+    return True
+
+
+  def run(self) -> None:
+    """Function to write a snapshot every interval forever"""
+
+    while True:
+      time.sleep(self.interval)
+
+      try:
+        self.save()
+
+      # Logs the error and tries again at the next interval
+      except Exception as e:
+        logging.error(f"Could not save the snapshot: {e}")
+
+
+  def start(self) -> None:
+    """Function to start the snapshot thread and save a last snapshot when the process exits"""
+
+    # Checks if the thread is already running
+    if self.thread is not None:
+      return
+
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+    atexit.register(self.save)
+
+
+# The snapshotter shared by both bots
+snapshotter = Snapshotter()
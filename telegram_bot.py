@@ -1,95 +1,103 @@
 # The telegram bot
 
-import os, re
-import etherscan_api, data_analytics
+import os, re, functools, logging
+import etherscan_api, addresses, data_analytics, gas_analytics, counterparty_index, balance_batcher, watcher, price_ticker, portfolio, admission, io_pool, circuit_breaker, transaction_store, chain_backend, timezone_picker, export
 import pytz
-from typing import Union, List
-from replit import db
+from typing import Union, List, Optional
 from telebot import TeleBot
-from telebot.types import Message, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from timezone_store import save_timezone_to_db, get_timezone_from_db
+from telebot.types import Message, CallbackQuery, ReplyKeyboardMarkup, ReplyKeyboardRemove
 
 # The telegram bot
 bot = TeleBot(token=os.environ["TELEGRAM_TOKEN"])
 
+# The largest file a bot can upload to Telegram in bytes
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
 
-def save_timezone_to_db(chat_id: Union[int, str], timezone: str) -> None:
-  """Function to save the timezone to the database if it's not inside"""
 
-  # The flag to signify the chat ID is in the database
-  in_db = False
-  
-  # The list of saved timezones
-  saved_tzs = db["timezones"]
+def admitted(command: str):
+  """Decorator to run a handler through the admission controller, replying with a busy message if the command is turned away"""
 
-  # Iterates the saved timezones in the database
-  for index, saved_tz in enumerate(saved_tzs):
+  def decorator(handler):
 
-    # Checks if the saved timezone starts with the chat ID
-    if saved_tz.startswith(str(chat_id)):
+    @functools.wraps(handler)
+    def wrapper(message: Message) -> None:
 
-      # Edits the saved timezone
-      saved_tzs[index] = f"{chat_id} {timezone}"
+      # Admits the command for the user and the chat
+      try:
+        ticket = admission.controller.admit(f"telegram:{message.from_user.id}", f"telegram:{message.chat.id}", admission.get_cost(command))
 
-      # Sets the flag to True
-      in_db = True
+      # Tells the user to retry later if the command is turned away
+      except admission.Busy as e:
+        return bot.send_message(message.chat.id, admission.busy_message(e))
 
-      # Breaks the loop
-      break
+      def run_handler() -> None:
+        """Function to run the command, telling the user if an upstream it needs is down"""
+        try:
+          handler(message)
 
-  # Checks if the timezone is not in the database
-  if not in_db:
+        # Tells the user to retry once the upstream has had time to recover
+        except circuit_breaker.CircuitOpen as e:
+          bot.send_message(message.chat.id, f"{e}.")
 
-    # Appends to the list of saved timezones
-    saved_tzs.append(f"{chat_id} {timezone}")
+        # Tells the user what was wrong with the input, like an invalid address
+        except ValueError as e:
+          bot.send_message(message.chat.id, f"{e}.")
 
-  # Assigns the edited saved timezone list to the database one
-  db["timezones"] = saved_tzs
+      # Runs cheap commands right away
+      if not ticket.queued:
+        return run_handler()
 
+      def run() -> None:
+        """Function to run the queued command and free its slot"""
+        try:
+          run_handler()
 
-def get_timezone_from_db(chat_id: Union[str, int]) -> pytz.timezone:
-  """Function to get the timezone from the database"""
+        # Logs the error so the slot is always freed
+        except Exception as e:
+          logging.error(e)
 
-  # Gets the filtered list of the saved timezone
-  saved_tz = [tz for tz in db["timezones"] if tz.startswith(str(chat_id))]
+        finally:
+          ticket.release()
 
-  # Checks if the list is not empty
-  if saved_tz:
+      # Runs the command in the I/O pool once it is its turn, so the bot's own threads are not held up by the queue
+      ticket.future.add_done_callback(lambda _: io_pool.submit(run))
 
-    # Returns the timezone
-    return pytz.timezone(saved_tz[0].split()[1])
+    return wrapper
 
-  # Returns UTC otherwise
-  return pytz.timezone("UTC")
+  return decorator
 
 
-def create_timezone_keyboard(timezone_list: [pytz.all_timezones, pytz.common_timezones]) -> ReplyKeyboardMarkup:
-  """Function to create the reply keyboard for timezones"""
+def staleness_suffix(age: Optional[float]) -> str:
+  """Function to get the note added to a reply that uses cached data, which is empty if the data is fresh"""
+  return f" {circuit_breaker.staleness_note(age)}" if age is not None else ""
 
-  # Create the reply keyboard
-  keyboard = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
 
-  # Adds all the timezones in the list to the reply keyboard
-  for timezone in timezone_list:
-    keyboard.row(timezone)
+def history_note(address: str) -> str:
+  """Function to get the note added to replies built from the stored history of an address when it is not complete"""
 
-  # Returns the keyboard
-  return keyboard
+  note = transaction_store.store.truncation_note(address)
+  return f"\n\n{note}" if note is not None else ""
 
 
 def get_timezone(message: Message) -> None:
   """Function to get the timezone from the user"""
 
   # Gets the text from the message
-  timezone = message.text
+  timezone = (message.text or "").strip()
 
   # Checks if the timezone is not in the list of all timezones
   if timezone not in pytz.all_timezones_set:
 
-    # Creates the invalid timezone message
-    bot_msg = "Invalid timezone entered, please enter a valid timezone in the format \"Continent/Country\"."
-    
-    # Sends the message with the keyboard again
-    bot.send_message(message.chat.id, bot_msg, reply_markup=create_timezone_keyboard(pytz.all_timezones))
+    # Checks if the text does not start any timezone name or city
+    if not timezone_picker.search(timezone):
+
+      # Sends the invalid timezone message with the list of regions
+      bot.send_message(message.chat.id, "Invalid timezone entered, please enter a valid timezone in the format \"Continent/Country\" or pick a region.", reply_markup=timezone_picker.regions_keyboard())
+
+    # Otherwise, treats the text as a search and sends the matching timezones
+    else:
+      bot.send_message(message.chat.id, f"Timezones matching \"{timezone}\":", reply_markup=timezone_picker.search_keyboard(timezone, 0))
 
     # Exits the function and call this function again after the next message
     return bot.register_next_step_handler(message, get_timezone)
@@ -97,8 +105,44 @@ def get_timezone(message: Message) -> None:
   # Otherwise, save the timezone to the database
   save_timezone_to_db(message.chat.id, timezone)
 
-  # Sends the message that the timezone has been saved
+  # Sends the message that the timezone has been saved (removing the keyboard of older versions of the bot)
   bot.send_message(message.chat.id, f"Your timezone has been saved as {timezone}.", reply_markup=ReplyKeyboardRemove())
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(timezone_picker.CALLBACK_PREFIX))
+def timezone_picker_handler(call: CallbackQuery) -> None:
+  """Function to handle the buttons of the timezone picker"""
+
+  # Gets the action and its arguments from the callback data
+  action, _, argument = call.data[len(timezone_picker.CALLBACK_PREFIX):].partition(":")
+
+  # Checks if a timezone is picked
+  if action == "s" and argument in pytz.all_timezones_set:
+
+    # Saves the timezone and stops waiting for a typed timezone
+    save_timezone_to_db(call.message.chat.id, argument)
+    bot.clear_step_handler_by_chat_id(call.message.chat.id)
+
+    # Replaces the picker with the confirmation
+    bot.edit_message_text(f"Your timezone has been saved as {argument}.", call.message.chat.id, call.message.message_id)
+
+  # Otherwise, shows the page of the region or the search (or the list of regions)
+  else:
+    name, _, page = argument.rpartition(":")
+    page = int(page) if page.isdigit() else 0
+
+    if action == "r" and name in timezone_picker.get_regions():
+      keyboard = timezone_picker.region_keyboard(name, page)
+    elif action == "q":
+      keyboard = timezone_picker.search_keyboard(name, page)
+    else:
+      keyboard = timezone_picker.regions_keyboard()
+
+    # Swaps the keyboard of the message, which only sends the small cached page
+    bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+
+  # Stops the loading animation on the button
+  bot.answer_callback_query(call.id)
   
 
 @bot.message_handler(commands=["start"])
@@ -106,10 +150,10 @@ def start_handler(message: Message) -> None:
   """Function to handle the /start command"""
 
   # The bot message to send to the user
-  bot_msg = "Hello! This is a bot that perform data analytics on your crypto wallet. To start, please enter your timezone in the format \"Continent/Country\" or pick one of the timezones in the list. \n\nUse the /help command to get more information about how to use the bot."
+  bot_msg = "Hello! This is a bot that perform data analytics on your crypto wallet. To start, please enter your timezone in the format \"Continent/Country\" or pick your region and timezone from the list. \n\nUse the /help command to get more information about how to use the bot."
 
   # Sends the message
-  bot.send_message(message.chat.id, bot_msg, reply_markup=create_timezone_keyboard(pytz.common_timezones))
+  bot.send_message(message.chat.id, bot_msg, reply_markup=timezone_picker.regions_keyboard())
 
   # Register the next function
   bot.register_next_step_handler(message, get_timezone)
@@ -128,12 +172,15 @@ def help_handler(message: Message) -> None:
 /currenttimezone
 -> Shows the current timezone the bot is set to
 
-/ethbalance <address>
--> Gets the account balance of your ethereum wallet
+/ethbalance <address> <more addresses (optional)>
+-> Gets the account balance of your ethereum wallets
 
 /ethprice
 -> Gets the current price of Ether in USD
 
+/price <asset (optional)> <currency (optional)>
+-> Gets the current price of a crypto asset (defaults to Ether in USD)
+
 /convert
 -> Converts USD to Ether and vice versa
 
@@ -146,8 +193,35 @@ def help_handler(message: Message) -> None:
 /getpasttxs <address> <number of months (n) (optional)>
 -> Gets the transactions for the past n months (defaults to 6 months)
 
-/getanalytics <address> <number of months (n) (optional, maximum of 6 months)>
--> Gets the analytics graph for given number of months (defaults to the maximum of 6 months)
+/getanalytics <address> <number of months (n) (optional, maximum of 12 months)>
+-> Gets the analytics graph for given number of months (defaults to 6 months)
+
+/compare <address> <more addresses (maximum of 5 addresses)> <number of months (n) (optional, maximum of 12 months)>
+-> Gets one analytics graph comparing the wallets for the past n months, with their totals and the combined totals (defaults to 6 months)
+
+/getgas <address> <number of months (n) (optional, maximum of 6 months)>
+-> Gets the gas fees paid, their distribution and the most expensive transactions for the past n months (defaults to 6 months)
+
+/topcounterparties <address> <number of counterparties (k) (optional)> <count or volume (optional)>
+-> Gets the k wallets this wallet transacts with the most (defaults to the top 10 by number of transactions)
+
+/getcashflow <address> <day, week or month (optional)> <number of periods (n) (optional)>
+-> Gets the inflow, outflow, gas spent and balance for the past n periods (defaults to 6 months)
+
+/portfolio <address>
+-> Gets the ERC-20 tokens held by the wallet and their value in USD
+
+/export <address>
+-> Sends the full transaction history of the wallet as a compressed CSV file
+
+/watch <address>
+-> Notifies this chat of new transactions for the wallet
+
+/unwatch <address>
+-> Stops notifying this chat of new transactions for the wallet
+
+/watchlist
+-> Shows the wallets this chat is watching
   """
 
   # Sends the help message to the user
@@ -174,7 +248,7 @@ def change_timezone(message: Message) -> None:
     return bot.send_message(message.chat.id, f"Timezone has been changed to {msg}.")
 
   # Otherwise, send the message telling the user to enter a timezone
-  bot.send_message(message.chat.id, "Please enter your timezone or select one from the list.", reply_markup=create_timezone_keyboard(pytz.common_timezones))
+  bot.send_message(message.chat.id, "Please enter your timezone, type the start of its name to search, or pick a region.", reply_markup=timezone_picker.regions_keyboard())
 
   # Register the get timezone function as the next function
   bot.register_next_step_handler(message, get_timezone)
@@ -192,6 +266,7 @@ def current_tz_handler(message: Message) -> None:
 
 
 @bot.message_handler(commands=["ethbalance", "ethbal"])
+@admitted("ethbalance")
 def eth_balance(message: Message) -> None:
   """Function to handle the /ethbalance command"""
   
@@ -204,11 +279,26 @@ def eth_balance(message: Message) -> None:
   # Checks if the message has an address behind
   if msg:
 
-    # Calls the etherscan API to get the balance of the address
-    balance = etherscan_api.get_ether_balance(msg)
+    # Gets the list of addresses in the message
+    addresses = msg.split()
+
+    # Checks if only one address is given
+    if len(addresses) == 1:
+
+      # Gets the balance of the address through the batcher shared with the discord bot (or the last known balance if Etherscan is down)
+      balance, age = balance_batcher.batcher.get_balance_with_age(msg)
+
+      # Sends the balance back to the user and exit the function
+      return bot.send_message(message.chat.id, f"Your ethereum wallet balance is {balance} ETH.{staleness_suffix(age)}")
 
-    # Sends the balance back to the user and exit the function
-    return bot.send_message(message.chat.id, f"Your ethereum wallet balance is {balance} ETH.")
+    # Calls the etherscan API to get the balances of all the addresses in as few requests as possible
+    balances = etherscan_api.get_ether_balances(addresses)
+
+    # Gets the balance of each address
+    details = [f"{address}: {balances.get(address.lower())} ETH" for address in addresses]
+
+    # Sends the balances back to the user and exit the function
+    return split_message(message.chat.id, "\n".join(details))
 
   # Sends the message to ask the user to input their address
   bot.send_message(message.chat.id, "Please input your ethereum wallet address.")
@@ -218,16 +308,45 @@ def eth_balance(message: Message) -> None:
 
 
 @bot.message_handler(commands=["ethprice"])
+@admitted("ethprice")
 def get_ether_price(message: Message) -> None:
   """Function to handle the /ethprice command to get the price of Ether in USD"""
 
   # Returns the ethereum price from the API
-  bot_msg = str(etherscan_api.convert_eth_to_usd(1))
+  bot_msg = str(etherscan_api.convert_eth_to_usd(1)) + staleness_suffix(price_ticker.ticker.staleness())
 
   # Sends the message to the user
   bot.send_message(message.chat.id, bot_msg)
 
 
+@bot.message_handler(commands=["price"])
+@admitted("price")
+def get_price_handler(message: Message) -> None:
+  """Function to handle the /price command to get the price of a crypto asset"""
+
+  # Gets the text from the message
+  msg = message.text
+
+  # Removes the command from the message and gets the list of words
+  msg_list = re.sub("/price", "", msg).strip().split()
+
+  # Gets the asset (defaults to ethereum) and the currency (defaults to USD)
+  asset = msg_list[0] if msg_list else "ethereum"
+  currency = msg_list[1] if len(msg_list) > 1 else "usd"
+
+  # Gets the price from the price ticker without making a request
+  price = price_ticker.ticker.get_price(asset, currency)
+
+  # Checks if the price is not tracked
+  if price is None:
+
+    # Sends the list of tracked assets and currencies to the user and exits the function
+    return bot.send_message(message.chat.id, f"The price of {asset} in {currency.upper()} is not tracked. Tracked assets: {', '.join(price_ticker.ticker.assets)}. Tracked currencies: {', '.join(price_ticker.ticker.currencies).upper()}.")
+
+  # Sends the price to the user
+  bot.send_message(message.chat.id, f"The price of {asset} is {price} {currency.upper()}.{staleness_suffix(price_ticker.ticker.staleness())}")
+
+
 @bot.message_handler(commands=["convert"])
 def handle_convert(message: Message) -> None:
   """Function to handle the /convert command"""
@@ -288,29 +407,36 @@ def convert(message: Message, type: str) -> None:
     # Registers this function as the next step handler and exits the function
     return bot.register_next_step_handler(message, convert, type)
 
-  # Checks if the type is ETH to USD
-  if type == "ETH to USD":
+  try:
 
-    # Calls the API to get the converted amount
-    converted_amt = etherscan_api.convert_eth_to_usd(float(msg))
+    # Checks if the type is ETH to USD
+    if type == "ETH to USD":
 
-    # The unit for the conversion
-    unit = "USD"
+      # Calls the API to get the converted amount
+      converted_amt = etherscan_api.convert_eth_to_usd(float(msg))
 
-  # Checks if the type is USD to ETH
-  elif type == "USD to ETH":
+      # The unit for the conversion
+      unit = "USD"
 
-    # Calls the API to get the converted amount
-    converted_amt = etherscan_api.convert_usd_to_eth(float(msg))
+    # Checks if the type is USD to ETH
+    elif type == "USD to ETH":
+
+      # Calls the API to get the converted amount
+      converted_amt = etherscan_api.convert_usd_to_eth(float(msg))
+
+      # The unit for the conversion
+      unit = "ETH"
+
+  # Tells the user to retry once CoinGecko has had time to recover, as the other price commands do (this step is not run through admitted)
+  except circuit_breaker.CircuitOpen as e:
+    return bot.send_message(message.chat.id, f"{e}.")
 
-    # The unit for the conversion
-    unit = "ETH"
-    
   # Sends the message to the user
-  bot.send_message(message.chat.id, f"The converted amount is {converted_amt} {unit}.")
+  bot.send_message(message.chat.id, f"The converted amount is {converted_amt} {unit}.{staleness_suffix(price_ticker.ticker.staleness())}")
 
 
 @bot.message_handler(commands=["gettxdetails", "gettxdeets"])
+@admitted("gettxdetails")
 def transaction_details_handler(message: Message) -> None:
   """Function to handle the /gettxdetails command"""
 
@@ -323,8 +449,14 @@ def transaction_details_handler(message: Message) -> None:
   # Checks if the message is not empty
   if msg:
 
-    # Calls the API to get the transaction object
-    transaction = etherscan_api.get_transaction_details(msg)
+    # Gets the transaction with its receipt and timestamp from the chain data provider
+    transaction = chain_backend.get_transaction(msg)
+
+    # Checks if the transaction is not found or not mined yet
+    if transaction is None:
+      return bot.send_message(message.chat.id, "Transaction not found.")
+    if not transaction.timeStamp:
+      return bot.send_message(message.chat.id, "Transaction is still pending.")
 
     # Gets the details of the transaction
     details = transaction.read(get_timezone_from_db(message.chat.id), True)
@@ -340,6 +472,7 @@ def transaction_details_handler(message: Message) -> None:
 
 
 @bot.message_handler(commands=["gettxs", "gettx"])
+@admitted("gettxs")
 def get_transactions_handler(message: Message) -> None:
   """Function to handle the /gettxs command"""
 
@@ -358,8 +491,8 @@ def get_transactions_handler(message: Message) -> None:
     # Checks if the length of the list is 1
     if len(msg_list) == 1:
 
-      # Calls the API to get the list of transactions
-      transactions = etherscan_api.get_normal_transactions(msg)
+      # Gets the list of transactions, from memory if the wallet is hot
+      transactions = data_analytics.get_latest_transactions(msg)
 
     # If the msg list is not 1
     else:
@@ -370,8 +503,8 @@ def get_transactions_handler(message: Message) -> None:
       # Gets the number of results
       number_of_results = int(second_word) if second_word.isdigit() else 100
 
-      # Calls the API to get the list of transactions
-      transactions = etherscan_api.get_normal_transactions(msg_list[0], number_of_results)
+      # Gets the list of transactions, from memory if the wallet is hot
+      transactions = data_analytics.get_latest_transactions(msg_list[0], number_of_results)
 
     # Gets the timezone
     timezone = get_timezone_from_db(message.chat.id)
@@ -390,6 +523,7 @@ def get_transactions_handler(message: Message) -> None:
 
 
 @bot.message_handler(commands=["getpasttxs", "getpasttx"])
+@admitted("getpasttxs")
 def get_past_transactions_handler(message: Message) -> None:
   """Function to handle the /getpasttxs command"""
 
@@ -429,6 +563,16 @@ def get_past_transactions_handler(message: Message) -> None:
     # Gets the details of the transactions
     details = [transaction.read(timezone, False) for transaction in transactions]
 
+    # Adds a note if the transactions are from the stored history because Etherscan is down
+    age = transaction_store.store.staleness(msg_list[0])
+    if age is not None:
+      details.insert(0, circuit_breaker.staleness_note(age))
+
+    # Adds a note if the stored history is not complete
+    note = transaction_store.store.truncation_note(msg_list[0])
+    if note is not None:
+      details.insert(0, note)
+
     # Sends the message to the user and exits the function
     return split_message(message.chat.id, "\n\n".join(details))
 
@@ -440,6 +584,7 @@ def get_past_transactions_handler(message: Message) -> None:
 
 
 @bot.message_handler(commands=["getanalytics", "getanalytic"])
+@admitted("getanalytics")
 def get_analytics_handler(message: Message) -> None:
   """Function to handle the /getanalytics function"""
 
@@ -473,14 +618,14 @@ def get_analytics_handler(message: Message) -> None:
       # Gets the number of months
       number_of_months = int(second_word) if second_word.isdigit() else 6
 
-      # Makes the number of months 6 if it's more than 6
-      number_of_months = 6 if number_of_months > 6 else number_of_months
+      # Keeps the number of months between 1 and the most months the graph can label
+      number_of_months = min(max(number_of_months, 1), data_analytics.ASCIIGraph.MAX_MONTHS)
 
       # Calls the API to get the graph
       graph = data_analytics.get_graph(msg_list[0], number_of_months, timezone)
     
     # Sends the graph to the user and exits the function
-    return bot.send_message(message.chat.id, f"```{graph}```", parse_mode="Markdown")
+    return bot.send_message(message.chat.id, f"```{graph}```{history_note(msg_list[0])}", parse_mode="Markdown")
 
   # Otherwise, sends a message to the user to input their transaction hash
   bot.send_message(message.chat.id, "Please enter your wallet address.")
@@ -489,6 +634,302 @@ def get_analytics_handler(message: Message) -> None:
   bot.register_next_step_handler(message, get_analytics_handler)
 
 
+@bot.message_handler(commands=["compare"])
+@admitted("compare")
+def compare_handler(message: Message) -> None:
+  """Function to handle the /compare command"""
+
+  # Gets the text from the message
+  msg = message.text
+
+  # Removes the command from the message
+  msg = re.sub("/compare", "", msg).strip()
+
+  # Gets the list of words in the message
+  msg_list = msg.split()
+
+  # Gets the number of months if the last word is a number (defaults to 6)
+  number_of_months = 6
+  if msg_list and msg_list[-1].isdigit():
+    number_of_months = int(msg_list.pop())
+
+  # Normalizes the addresses and drops the duplicates, so the same wallet written twice counts once
+  msg_list = list(dict.fromkeys(addresses.to_hex(addresses.normalize(address)) for address in msg_list))
+
+  # Checks if there are too few or too many addresses
+  if not 2 <= len(msg_list) <= len(data_analytics.MultiSeriesGraph.SYMBOLS):
+    return bot.send_message(message.chat.id, f"Please enter between 2 and {len(data_analytics.MultiSeriesGraph.SYMBOLS)} different wallet addresses.")
+
+  # Keeps the number of months between 1 and the most months the graph fits for the number of wallets
+  number_of_months = min(max(number_of_months, 1), data_analytics.MultiSeriesGraph.max_months(len(msg_list)))
+
+  # Gets the comparison
+  comparison = data_analytics.compare_wallets(msg_list, number_of_months, get_timezone_from_db(message.chat.id))
+
+  # Sends the comparison to the user
+  bot.send_message(message.chat.id, f"```\n{comparison}```" + "".join(history_note(address) for address in msg_list), parse_mode="Markdown")
+
+
+@bot.message_handler(commands=["getgas"])
+@admitted("getgas")
+def get_gas_handler(message: Message) -> None:
+  """Function to handle the /getgas command"""
+
+  # Gets the text from the message
+  msg = message.text
+
+  # Removes the command from the message
+  msg = re.sub("/getgas", "", msg).strip()
+
+  # Checks if the message is not empty
+  if msg:
+
+    # Gets the list of words in the message
+    msg_list = msg.split()
+
+    # Gets the number of months (defaults to 6)
+    number_of_months = int(msg_list[1]) if len(msg_list) > 1 and msg_list[1].isdigit() and int(msg_list[1]) > 0 else 6
+
+    # Keeps the number of months to the most the graph can label
+    number_of_months = min(number_of_months, data_analytics.ASCIIGraph.MAX_MONTHS)
+
+    # Gets the gas report and graph
+    report, graph = gas_analytics.get_gas_report(msg_list[0], number_of_months, get_timezone_from_db(message.chat.id))
+
+    # Sends the report to the user
+    split_message(message.chat.id, report + history_note(msg_list[0]))
+
+    # Sends the graph to the user if there is one and exits the function
+    if graph is not None:
+      bot.send_message(message.chat.id, f"```{graph}```", parse_mode="Markdown")
+    return
+
+  # Otherwise, sends a message to the user to input their wallet address
+  bot.send_message(message.chat.id, "Please enter your wallet address.")
+
+  # Registers this function as the next step handler
+  bot.register_next_step_handler(message, get_gas_handler)
+
+
+@bot.message_handler(commands=["topcounterparties", "topcp"])
+@admitted("topcounterparties")
+def top_counterparties_handler(message: Message) -> None:
+  """Function to handle the /topcounterparties command"""
+
+  # Gets the text from the message
+  msg = message.text
+
+  # Removes the command from the message
+  msg = re.sub("/topcounterparties|/topcp", "", msg).strip()
+
+  # Checks if the message is not empty
+  if msg:
+
+    # Gets the list of words in the message
+    msg_list = msg.split()
+
+    # Gets the number of counterparties (defaults to 10)
+    k = int(msg_list[1]) if len(msg_list) > 1 and msg_list[1].isdigit() and int(msg_list[1]) > 0 else 10
+
+    # Gets the metric to rank by (defaults to the number of transactions)
+    metric = msg_list[2].lower() if len(msg_list) > 2 and msg_list[2].lower() in counterparty_index.METRICS else "count"
+
+    # Sends the top counterparties to the user and exits the function
+    return split_message(message.chat.id, counterparty_index.get_top_counterparties(msg_list[0], k, metric) + history_note(msg_list[0]))
+
+  # Otherwise, sends a message to the user to input their wallet address
+  bot.send_message(message.chat.id, "Please enter your wallet address.")
+
+  # Registers this function as the next step handler
+  bot.register_next_step_handler(message, top_counterparties_handler)
+
+
+@bot.message_handler(commands=["getcashflow"])
+@admitted("getcashflow")
+def get_cash_flow_handler(message: Message) -> None:
+  """Function to handle the /getcashflow command"""
+
+  # Gets the text from the message
+  msg = message.text
+
+  # Removes the command from the message
+  msg = re.sub("/getcashflow", "", msg).strip()
+
+  # Checks if the message is not empty
+  if msg:
+
+    # Gets the list of words in the message
+    msg_list = msg.split()
+
+    # Gets the resolution (defaults to month)
+    resolution = msg_list[1].lower() if len(msg_list) > 1 and msg_list[1].lower() in data_analytics.time_series.RESOLUTIONS else "month"
+
+    # Gets the number of periods (defaults to 6)
+    periods = int(msg_list[2]) if len(msg_list) > 2 and msg_list[2].isdigit() and int(msg_list[2]) > 0 else 6
+
+    # Gets the cash flow
+    cash_flow = data_analytics.get_cash_flow(msg_list[0], resolution, periods, get_timezone_from_db(message.chat.id))
+
+    # Sends the cash flow to the user and exits the function
+    return split_message(message.chat.id, cash_flow + history_note(msg_list[0]))
+
+  # Otherwise, sends a message to the user to input their wallet address
+  bot.send_message(message.chat.id, "Please enter your wallet address.")
+
+  # Registers this function as the next step handler
+  bot.register_next_step_handler(message, get_cash_flow_handler)
+
+
+@bot.message_handler(commands=["export"])
+@admitted("export")
+def export_handler(message: Message) -> None:
+  """Function to handle the /export command"""
+
+  # Gets the text from the message
+  msg = message.text
+
+  # Removes the command from the message
+  msg = re.sub("/export", "", msg).strip()
+
+  # Checks if the message is not empty
+  if msg:
+
+    # Gets the address
+    address = msg.split()[0]
+
+    # Writes the history to a compressed CSV file
+    history = export.export_history(address)
+
+    try:
+
+      # Checks if the file is too large to upload
+      if history.size > MAX_UPLOAD_SIZE:
+        return bot.send_message(message.chat.id, f"The history of {address} is too large to upload ({history.size / 1024 / 1024:.1f} MB).")
+
+      # Uploads the file as one document
+      return bot.send_document(message.chat.id, history.file, caption=f"{history.rows} transactions of {address}{history_note(address)}", visible_file_name=history.filename)
+
+    # Deletes the file once it is uploaded
+    finally:
+      history.close()
+
+  # Otherwise, sends a message to the user to input their wallet address
+  bot.send_message(message.chat.id, "Please enter your wallet address.")
+
+  # Registers this function as the next step handler
+  bot.register_next_step_handler(message, export_handler)
+
+
+@bot.message_handler(commands=["portfolio"])
+@admitted("portfolio")
+def portfolio_handler(message: Message) -> None:
+  """Function to handle the /portfolio command"""
+
+  # Gets the text from the message
+  msg = message.text
+
+  # Removes the command from the message
+  msg = re.sub("/portfolio", "", msg).strip()
+
+  # Checks if the message is not empty
+  if msg:
+
+    # Sends the portfolio to the user and exits the function
+    return split_message(message.chat.id, portfolio.get_portfolio_summary(msg.split()[0]))
+
+  # Otherwise, sends a message to the user to input their wallet address
+  bot.send_message(message.chat.id, "Please enter your wallet address.")
+
+  # Registers this function as the next step handler
+  bot.register_next_step_handler(message, portfolio_handler)
+
+
+@bot.message_handler(commands=["watch"])
+@admitted("watch")
+def watch_handler(message: Message) -> None:
+  """Function to handle the /watch command"""
+
+  # Gets the text from the message
+  msg = message.text
+
+  # Removes the command from the message
+  msg = re.sub("/watch", "", msg).strip()
+
+  # Checks if the message is not empty
+  if msg:
+
+    # Subscribes the chat to the address
+    watcher.watcher.subscribe(msg, "telegram", message.chat.id)
+
+    # Sends the message to the user and exits the function
+    return bot.send_message(message.chat.id, f"You will be notified of new transactions for {msg}.")
+
+  # Otherwise, sends a message to the user to input their wallet address
+  bot.send_message(message.chat.id, "Please enter the wallet address to watch.")
+
+  # Registers this function as the next step handler
+  bot.register_next_step_handler(message, watch_handler)
+
+
+@bot.message_handler(commands=["unwatch"])
+def unwatch_handler(message: Message) -> None:
+  """Function to handle the /unwatch command"""
+
+  # Gets the text from the message
+  msg = message.text
+
+  # Removes the command from the message
+  msg = re.sub("/unwatch", "", msg).strip()
+
+  # Checks if the message is not empty
+  if msg:
+
+    # Unsubscribes the chat from the address
+    if watcher.watcher.unsubscribe(msg, "telegram", message.chat.id):
+      return bot.send_message(message.chat.id, f"You will no longer be notified of new transactions for {msg}.")
+
+    # Tells the user the address was not being watched and exits the function
+    return bot.send_message(message.chat.id, f"{msg} is not being watched in this chat.")
+
+  # Otherwise, sends a message to the user to input their wallet address
+  bot.send_message(message.chat.id, "Please enter the wallet address to stop watching.")
+
+  # Registers this function as the next step handler
+  bot.register_next_step_handler(message, unwatch_handler)
+
+
+@bot.message_handler(commands=["watchlist"])
+def watchlist_handler(message: Message) -> None:
+  """Function to handle the /watchlist command"""
+
+  # Gets the addresses the chat is subscribed to
+  addresses = watcher.watcher.subscriptions("telegram", message.chat.id)
+
+  # Checks if the chat is not watching any addresses
+  if not addresses:
+    return bot.send_message(message.chat.id, "This chat is not watching any wallets.")
+
+  # Sends the list of addresses to the user
+  bot.send_message(message.chat.id, "Watched wallets:\n" + "\n".join(addresses))
+
+
+def send_watch_alert(chat_id: str, address: str, transactions: List[etherscan_api.Transaction]) -> None:
+  """Function to send the new transactions of a watched wallet to a chat"""
+
+  # Gets the timezone of the chat
+  timezone = get_timezone_from_db(chat_id)
+
+  # Gets the details of the transactions
+  details = [transaction.read(timezone, False) for transaction in transactions]
+
+  # Sends the alert to the chat
+  split_message(chat_id, f"New transactions for {address}:\n\n" + "\n\n".join(details))
+
+
+# Registers the alert function with the watcher
+watcher.watcher.add_notifier("telegram", send_watch_alert)
+
+
 def split_message(chat_id: Union[str, int], bot_msg: str) -> None:
   """Function to split the message based on new lines"""
 
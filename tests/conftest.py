@@ -0,0 +1,10 @@
+# Shared setup of the tests, which import the bot modules from the root of the repository
+
+import os, sys, tempfile
+
+# Makes the modules at the root of the repository importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keeps the files the modules write out of the repository
+os.environ.setdefault("AGGREGATES_PATH", os.path.join(tempfile.gettempdir(), "test_aggregates.db"))
+os.environ.setdefault("SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "test_snapshot.bin"))
@@ -0,0 +1,94 @@
+# Tests of the admission controller, which lets cheap commands through and queues expensive ones in fair order
+
+import pytest
+import admission
+
+
+@pytest.fixture
+def controller(monkeypatch):
+  """Function to create a controller with one running slot and buckets large enough not to get in the way"""
+  monkeypatch.setattr(admission, "USER_BURST", 1000)
+  monkeypatch.setattr(admission, "CHAT_BURST", 1000)
+  return admission.AdmissionController(max_running=1, max_queue_depth=6, max_user_queue_depth=3)
+
+
+def run_in_order(controller, tickets):
+  """Function to finish the running command and every command after it, returning the users in the order they started"""
+  order = []
+  while tickets:
+    ticket = next(ticket for ticket in tickets if ticket.future.done())
+    order.append(ticket.user)
+    tickets.remove(ticket)
+    ticket.release()
+  return order
+
+
+def test_cheap_commands_bypass_the_queue(controller):
+
+  # Fills the running slot and the queue with expensive commands
+  running = controller.admit("user:1", "chat:1", admission.get_cost("getpasttxs"))
+  queued = controller.admit("user:2", "chat:1", admission.get_cost("getpasttxs"))
+  assert running.future.done() and not queued.future.done()
+
+  # Checks a cheap command starts right away without taking a slot
+  ticket = controller.admit("user:3", "chat:1", admission.get_cost("ethprice"))
+  assert ticket.future.done() and not ticket.queued
+  assert controller.running == 1 and len(controller.queue) == 1
+
+
+def test_saturated_queue_is_shared_fairly(controller):
+  running = controller.admit("user:1", "chat:1", 5)
+
+  # Queues three commands of one user, then one of another user
+  tickets = [controller.admit("user:1", "chat:1", 5) for _ in range(3)] + [controller.admit("user:2", "chat:2", 5)]
+
+  # Checks the other user's command runs after the first user's first queued command instead of after all three
+  assert run_in_order(controller, [running] + tickets) == ["user:1", "user:1", "user:2", "user:1", "user:1"]
+
+
+def test_weights_give_a_larger_share(controller):
+  running = controller.admit("user:0", "chat:0", 5)
+
+  # Queues two commands each for a user of weight 1 and a user of weight 2
+  tickets = []
+  for _ in range(2):
+    tickets.append(controller.admit("user:1", "chat:1", 5, weight=1))
+    tickets.append(controller.admit("user:2", "chat:2", 5, weight=2))
+
+  # Checks both commands of the heavier user finish in the virtual time of one command of the other
+  assert run_in_order(controller, [running] + tickets) == ["user:0", "user:2", "user:1", "user:2", "user:1"]
+
+
+def test_overflow_is_rejected_with_the_reply_the_bots_send(controller):
+  controller.admit("user:0", "chat:0", 5)
+
+  # Checks one user can not queue more than their share
+  for _ in range(3):
+    controller.admit("user:1", "chat:1", 5)
+  with pytest.raises(admission.Busy) as error:
+    controller.admit("user:1", "chat:1", 5)
+  assert error.value.reason == "user_queue"
+
+  # Fills the rest of the queue and checks the next command is turned away with the wait before retrying
+  for user in ("user:2", "user:3", "user:4"):
+    controller.admit(user, "chat:2", 5)
+  with pytest.raises(admission.Busy) as error:
+    controller.admit("user:5", "chat:3", 5)
+  assert error.value.reason == "queue_full" and error.value.retry_after >= 1
+  assert admission.busy_message(error.value) == f"The bot is busy, please retry in {error.value.retry_after:.0f} s."
+
+  # Checks the rejections are counted
+  assert controller.rejected["user_queue"] == 1 and controller.rejected["queue_full"] == 1
+
+
+def test_rate_limited_user_does_not_spend_the_chats_tokens(monkeypatch):
+  monkeypatch.setattr(admission, "USER_BURST", 2)
+  controller = admission.AdmissionController()
+
+  # Spends the user's tokens and checks the next command is turned away by the user's bucket before the chat's
+  controller.admit("user:1", "chat:1")
+  controller.admit("user:1", "chat:1")
+  with pytest.raises(admission.Busy) as error:
+    controller.admit("user:1", "chat:1")
+  assert error.value.reason == "user_rate"
+  assert controller.chat_buckets["chat:1"].available() == pytest.approx(admission.CHAT_BURST - 2, abs=0.1)
@@ -0,0 +1,49 @@
+# Tests of the balance batcher
+
+import pytest
+import balance_batcher, etherscan_api
+
+
+GOOD = "0x" + "ab" * 20
+OTHER = "0x" + "CD" * 20
+
+
+@pytest.fixture
+def requests(monkeypatch):
+  """Fixture that answers balancemulti requests like Etherscan, rejecting the whole request if any address is invalid"""
+
+  requests = []
+
+  def request_json(request_str):
+    chunk = request_str.split("&address=")[1].split("&")[0].split(",")
+    requests.append(chunk)
+    if any(len(address) != 42 for address in chunk):
+      return {"status": "0", "message": "NOTOK", "result": "Error! Invalid address format"}
+    return {"status": "1", "message": "OK", "result": [{"account": address, "balance": str(10**18)} for address in chunk]}
+
+  monkeypatch.setattr(etherscan_api, "request_json", request_json)
+  return requests
+
+
+def test_invalid_address_is_rejected_before_queueing(requests):
+  batcher = balance_batcher.BalanceBatcher(window=0.01)
+
+  with pytest.raises(ValueError):
+    batcher.submit("hello")
+
+  assert batcher.get_balance(GOOD) == 1.0
+  assert requests == [[GOOD]]
+
+
+def test_invalid_addresses_do_not_cost_the_others_their_balances(requests):
+  balances = etherscan_api.get_ether_balances([GOOD, "hello", OTHER, ""])
+  assert balances == {GOOD: 1.0, OTHER.lower(): 1.0}
+  assert requests == [[GOOD, OTHER.lower()]]
+
+
+def test_rejected_chunk_is_split(requests, monkeypatch):
+
+  # Lets an address that looks valid through, which Etherscan still rejects
+  monkeypatch.setattr(etherscan_api.addresses, "to_hex", lambda address: "0x" + address.hex() + ("0" if address[0] == 0xee else ""))
+  balances = etherscan_api.get_ether_balances([GOOD, "0x" + "ee" * 20, OTHER])
+  assert balances == {GOOD: 1.0, OTHER.lower(): 1.0}
@@ -0,0 +1,177 @@
+# Tests of the two cache tiers, with a small Redis-protocol server standing in for the shared tier
+
+import socketserver, threading, time
+import pytest
+import cache, circuit_breaker
+from transaction_store import TransactionBatch
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+  """Class that answers the commands of one connection the way a Redis server does, for the commands the cache uses"""
+
+  def read_command(self):
+    """Function to read one command sent as an array of bulk strings (None once the connection is closed)"""
+    line = self.rfile.readline()
+    if not line:
+      return None
+    assert line[:1] == b"*"
+    arguments = []
+    for _ in range(int(line[1:-2])):
+      length = int(self.rfile.readline()[1:-2])
+      arguments.append(self.rfile.read(length + 2)[:-2])
+    return arguments
+
+  def write(self, data):
+    with self.server.lock:
+      self.wfile.write(data)
+      self.wfile.flush()
+
+  def handle(self):
+    while True:
+      arguments = self.read_command()
+      if arguments is None:
+        return
+      command = arguments[0].upper()
+      self.server.commands.append(command)
+
+      if command in (b"AUTH", b"SELECT"):
+        self.write(b"+OK\r\n")
+
+      elif command == b"GET":
+        expires, value = self.server.data.get(arguments[1], (0.0, None))
+        self.write(b"$-1\r\n" if value is None or expires <= time.time() else b"$%d\r\n%s\r\n" % (len(value), value))
+
+      elif command == b"SET":
+        assert arguments[3].upper() == b"PX"
+        self.server.data[arguments[1]] = (time.time() + int(arguments[4]) / 1000, arguments[2])
+        self.write(b"+OK\r\n")
+
+      elif command == b"DEL":
+        self.write(b":%d\r\n" % (self.server.data.pop(arguments[1], None) is not None))
+
+      elif command == b"SUBSCRIBE":
+        self.server.subscribers.setdefault(arguments[1], []).append(self)
+        self.write(b"*3\r\n$9\r\nsubscribe\r\n$%d\r\n%s\r\n:1\r\n" % (len(arguments[1]), arguments[1]))
+
+      elif command == b"PUBLISH":
+        subscribers = self.server.subscribers.get(arguments[1], [])
+        for subscriber in subscribers:
+          subscriber.write(b"*3\r\n$7\r\nmessage\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n" % (len(arguments[1]), arguments[1], len(arguments[2]), arguments[2]))
+        self.write(b":%d\r\n" % len(subscribers))
+
+      else:
+        self.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def server():
+  socketserver.ThreadingTCPServer.allow_reuse_address = True
+  server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RespHandler)
+  server.daemon_threads = True
+  server.data, server.subscribers, server.commands, server.lock = {}, {}, [], threading.Lock()
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  yield server
+  server.shutdown()
+  server.server_close()
+
+
+@pytest.fixture
+def replicas(server, monkeypatch):
+  """Function to create two replicas sharing the stand-in server, each with its own in-process tier"""
+
+  # Uses a fresh breaker so failures of other tests do not open the circuit
+  monkeypatch.setattr(circuit_breaker, "cache_server", circuit_breaker.CircuitBreaker("Cache server"))
+
+  url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+  first, second = cache.Cache(16, url, "test", "first"), cache.Cache(16, url, "test", "second")
+  first.register_codec(b"B", TransactionBatch, TransactionBatch.to_bytes, TransactionBatch.from_bytes)
+  second.register_codec(b"B", TransactionBatch, TransactionBatch.to_bytes, TransactionBatch.from_bytes)
+  return first, second
+
+
+def wait_for(condition, timeout=5.0):
+  """Function to wait until a condition holds, as the invalidation messages arrive on another thread"""
+  deadline = time.time() + timeout
+  while not condition():
+    assert time.time() < deadline
+    time.sleep(0.01)
+
+
+def test_write_through_and_hit_from_another_replica(server, replicas):
+  first, second = replicas
+
+  # Writes a value on the first replica, which keeps it in memory and stores it on the server under its namespaced key
+  first.set("prices", "eth", {"usd": 1234.5}, 60)
+  assert first.local.get("test:prices:eth") == {"usd": 1234.5}
+  assert b"test:prices:eth" in server.data
+
+  # Reads it on the second replica from the server, which then keeps it in memory
+  assert second.get("prices", "eth") == {"usd": 1234.5}
+  assert second.local.get("test:prices:eth") == {"usd": 1234.5}
+
+
+def test_values_expire_after_their_ttl(replicas):
+  first, second = replicas
+
+  first.set("prices", "eth", 1.0, 0.2)
+  time.sleep(0.3)
+
+  # Checks the value is gone from both tiers
+  assert first.get("prices", "eth", "missing") == "missing"
+  assert second.get("prices", "eth", "missing") == "missing"
+
+
+def test_namespaces_do_not_collide(replicas):
+  first, second = replicas
+
+  first.set("prices", "key", "price", 60)
+  first.set("graph", "key", "graph", 60)
+
+  assert second.get("prices", "key") == "price"
+  assert second.get("graph", "key") == "graph"
+
+
+def test_batch_round_trip(replicas):
+  import numpy
+
+  first, second = replicas
+  batch = TransactionBatch.from_rows([
+    {"hash": f"0x{i:064x}", "blockNumber": str(100 + i), "timeStamp": str(1600000000 + i), "from": "0x" + "11" * 20, "to": "0x" + "22" * 20,
+     "value": str(10**30 + i), "gasUsed": "21000", "gasPrice": str(10**9 + i), "isError": "1" if i % 3 == 0 else "0"}
+    for i in range(50)
+  ])
+
+  # Shares the batch without keeping it in memory, as the transaction store does, and reads it on the other replica
+  first.set("history", "wallet", batch, 60, local=False)
+  decoded = second.get("history", "wallet", local=False)
+
+  # Checks every column is equal, including the exact values
+  for column in TransactionBatch.columns:
+    if column == "value":
+      assert decoded.value.to_ints() == batch.value.to_ints()
+    else:
+      assert numpy.array_equal(getattr(decoded, column), getattr(batch, column))
+
+
+def test_invalidation_drops_the_other_replicas_local_value(server, replicas):
+  first, second = replicas
+  first.start()
+  second.start()
+  wait_for(lambda: len(server.subscribers.get(b"test:invalidate", [])) == 2)
+
+  # Warms the in-process tier of the second replica
+  first.set("prices", "eth", 1.0, 60)
+  assert second.get("prices", "eth") == 1.0
+
+  # Invalidates the value on the first replica, which drops it from the memory of the second one
+  first.invalidate("prices", "eth")
+  wait_for(lambda: second.local.get("test:prices:eth") is cache.MISSING)
+  assert second.get("prices", "eth", "missing") == "missing"
+
+  # Writes a new value, which drops the old one from the second replica but not the new one from the first replica
+  first.set("prices", "eth", 2.0, 60)
+  assert second.get("prices", "eth") == 2.0
+  first.set("prices", "eth", 3.0, 60)
+  wait_for(lambda: second.local.get("test:prices:eth") is cache.MISSING)
+  assert second.get("prices", "eth") == 3.0
+  assert first.local.get("test:prices:eth") == 3.0
@@ -0,0 +1,184 @@
+# Tests of the chain data providers: the Etherscan provider and the JSON-RPC provider against a stand-in node
+
+import json, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import chain_backend, etherscan_api, addresses, circuit_breaker
+
+
+SENDER = "0x" + "11" * 20
+OTHER_SENDER = "0x" + "22" * 20
+RECEIVER = "0x" + "33" * 20
+
+
+def make_details(tx_hash, sender, block_number):
+  """Function to create the JSON-RPC details of a transaction"""
+  return {"hash": tx_hash, "from": sender, "to": RECEIVER, "value": "0x1", "gas": "0x5208", "gasPrice": "0x1", "blockNumber": hex(block_number) if block_number else None}
+
+
+def make_listed(tx_hash, sender, block_number):
+  """Function to create a transaction the way txlist returns it"""
+  return etherscan_api.Transaction(**etherscan_api.normalize_addresses({
+    "hash": tx_hash, "blockNumber": str(block_number), "timeStamp": "1600000000", "from": sender, "to": RECEIVER, "value": "1", "gas": "21000",
+    "gasPrice": "1", "gasUsed": "21000", "isError": "0"
+  }))
+
+
+def serve(monkeypatch, details, listed, provider=True):
+  """Function to answer proxy calls and txlist queries from fixed data, recording every request, with Etherscan as the provider unless told otherwise"""
+  requests = []
+
+  def call_proxy(method, params):
+    requests.append(method)
+    if method == "eth_getTransactionByHash":
+      return details.get(params[0])
+    if method == "eth_getTransactionReceipt":
+      return {"gasUsed": "0x5208", "status": "0x1"}
+    return {"timestamp": hex(1600000000)}
+
+  def get_normal_transactions(address, number_of_results=100, start_block=0, sort="desc", end_block=99999999):
+    requests.append("txlist")
+    return [transaction for transaction in listed if transaction.__dict__["from"] == addresses.normalize(address) and start_block <= int(transaction.blockNumber) <= end_block]
+
+  monkeypatch.setattr(etherscan_api, "call_proxy", call_proxy)
+  monkeypatch.setattr(etherscan_api, "get_normal_transactions", get_normal_transactions)
+  if provider:
+    monkeypatch.setattr(chain_backend, "_backend", chain_backend.fallback)
+  return requests
+
+
+def test_etherscan_lookups_share_txlist_queries(monkeypatch):
+  hashes = ["0x" + "aa" * 32, "0x" + "bb" * 32, "0x" + "cc" * 32, "0x" + "dd" * 32]
+
+  # Two transactions of one sender in one block, one of another sender and one that does not exist
+  details = {hashes[0]: make_details(hashes[0], SENDER, 10), hashes[1]: make_details(hashes[1], SENDER, 10), hashes[2]: make_details(hashes[2], OTHER_SENDER, 12)}
+  listed = [make_listed(hashes[0], SENDER, 10), make_listed(hashes[1], SENDER, 10), make_listed(hashes[2], OTHER_SENDER, 12)]
+  requests = serve(monkeypatch, details, listed)
+
+  transactions = chain_backend.get_transactions(hashes)
+
+  # Checks there is one details request per hash and one txlist query per sender and block, without receipts or blocks
+  assert requests.count("eth_getTransactionByHash") == 4
+  assert requests.count("txlist") == 2
+  assert len(requests) == 6
+  assert [transaction.hash if transaction else None for transaction in transactions] == hashes[:3] + [None]
+  assert transactions[0].timeStamp == "1600000000" and transactions[0].gasUsed == "21000"
+
+
+def test_unlisted_and_pending_transactions(monkeypatch):
+  mined, pending = "0x" + "aa" * 32, "0x" + "bb" * 32
+
+  # A mined transaction Etherscan has not listed yet and a pending one
+  requests = serve(monkeypatch, {mined: make_details(mined, SENDER, 10), pending: make_details(pending, SENDER, None)}, [])
+
+  transactions = chain_backend.get_transactions([mined, pending])
+
+  # Checks the unlisted transaction gets its receipt and block, and the pending one has no timestamp
+  assert requests.count("eth_getTransactionReceipt") == 1
+  assert requests.count("eth_getBlockByNumber") == 1
+  assert transactions[0].timeStamp == "1600000000" and transactions[0].isError == "0"
+  assert transactions[1].timeStamp == ""
+
+
+class NodeHandler(BaseHTTPRequestHandler):
+  """Class that answers JSON-RPC batches like an Ethereum node, in reverse order to check the results are matched by ID"""
+
+  def do_POST(self):
+    batch = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+    self.server.batches.append(batch)
+
+    # Answers with an error object for the whole batch if the node is set to reject it
+    if self.server.reject:
+      body = {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "Invalid request"}}
+    else:
+      body = [{"jsonrpc": "2.0", "id": call["id"], "result": self.server.answer(call["method"], call["params"])} for call in reversed(batch)]
+
+    data = json.dumps(body).encode()
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, *args):
+    pass
+
+
+def answer(method, params):
+  """Function to answer a call with data derived from its parameters"""
+  if method == "eth_getTransactionByHash":
+    return make_details(params[0], SENDER, 10)
+  if method == "eth_getTransactionReceipt":
+    return {"gasUsed": "0x5208", "status": "0x1"}
+  if method == "eth_getBlockByNumber":
+    return {"timestamp": hex(1600000000)}
+  return params[0]
+
+
+@pytest.fixture
+def node(monkeypatch):
+  """Function to start the stand-in node and use it as the provider, with fresh breakers"""
+  server = ThreadingHTTPServer(("127.0.0.1", 0), NodeHandler)
+  server.batches, server.reject, server.answer = [], False, answer
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+
+  monkeypatch.setattr(chain_backend, "_backend", chain_backend.JsonRpcBackend(f"http://127.0.0.1:{server.server_address[1]}"))
+  monkeypatch.setattr(circuit_breaker, "node", circuit_breaker.CircuitBreaker("Ethereum node", 2, 60))
+  yield server
+  server.shutdown()
+  server.server_close()
+
+
+def test_calls_are_split_into_batches_and_matched_by_id(node):
+  calls = [("eth_echo", (i, )) for i in range(chain_backend.MAX_RPC_BATCH_SIZE * 2 + 50)]
+
+  results = chain_backend.call_many(calls)
+
+  # Checks the batch sizes, and that the results are in the order of the calls although the node answers in reverse
+  assert [len(batch) for batch in node.batches] == [chain_backend.MAX_RPC_BATCH_SIZE, chain_backend.MAX_RPC_BATCH_SIZE, 50]
+  assert results == list(range(len(calls)))
+
+
+def test_transactions_take_two_round_trips(node):
+  hashes = ["0x" + "aa" * 32, "0x" + "bb" * 32]
+
+  transactions = chain_backend.get_transactions(hashes)
+
+  # Checks the details and receipts share one batch and the block is fetched once in a second one
+  assert [len(batch) for batch in node.batches] == [4, 1]
+  assert [transaction.hash for transaction in transactions] == hashes
+  assert transactions[0].timeStamp == "1600000000" and transactions[0].gasUsed == "21000" and transactions[0].isError == "0"
+
+
+def test_rejected_batch_falls_back_to_etherscan(node, monkeypatch):
+  node.reject = True
+  tx_hash = "0x" + "aa" * 32
+  requests = serve(monkeypatch, {tx_hash: make_details(tx_hash, SENDER, 10)}, [make_listed(tx_hash, SENDER, 10)], False)
+
+  # Checks the error object counts as a node failure and the lookup is answered by Etherscan
+  transaction = chain_backend.get_transaction(tx_hash)
+  assert transaction.hash == tx_hash
+  assert circuit_breaker.node.failures == 1
+  assert requests == ["eth_getTransactionByHash", "txlist"]
+
+
+def test_open_circuit_skips_the_node_until_it_recovers(node, monkeypatch):
+  node.reject = True
+  requests = serve(monkeypatch, {}, [], False)
+
+  # Fails twice, which opens the circuit of the node (the threshold of the fixture's breaker)
+  chain_backend.call_many([("eth_getTransactionReceipt", ("0x01", ))])
+  chain_backend.call_many([("eth_getTransactionReceipt", ("0x02", ))])
+  assert circuit_breaker.node.is_open()
+  assert len(node.batches) == 2
+
+  # Checks the next calls go straight to Etherscan without reaching the node
+  chain_backend.call_many([("eth_getTransactionReceipt", ("0x03", ))])
+  assert len(node.batches) == 2
+  assert requests == ["eth_getTransactionReceipt"] * 3
+
+  # Lets one probe through once the node is due to be tried again, which closes the circuit when it succeeds
+  node.reject = False
+  circuit_breaker.node.opened_at -= circuit_breaker.node.reset_timeout
+  assert chain_backend.call_many([("eth_echo", (7, ))]) == [7]
+  assert not circuit_breaker.node.is_open() and circuit_breaker.node.failures == 0
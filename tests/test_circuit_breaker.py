@@ -0,0 +1,107 @@
+# Tests of the circuit breaker, with the clock moved by hand
+
+import threading
+import pytest
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  """Function to replace the time the breaker reads with a clock the tests move"""
+  now = [1000.0]
+  monkeypatch.setattr(circuit_breaker.time, "time", lambda: now[0])
+  return now
+
+
+def test_opens_at_the_threshold(clock):
+  breaker = CircuitBreaker("Upstream", failure_threshold=3, reset_timeout=30)
+
+  # Lets requests through until the failures in a row reach the threshold
+  for _ in range(2):
+    breaker.allow()
+    breaker.record_failure()
+  assert breaker.state == circuit_breaker.CLOSED and not breaker.is_open()
+
+  breaker.allow()
+  breaker.record_failure()
+  assert breaker.state == circuit_breaker.OPEN and breaker.is_open()
+
+  # Checks the next request fails fast with the time left until the probe
+  clock[0] += 10
+  with pytest.raises(CircuitOpen) as error:
+    breaker.allow()
+  assert error.value.upstream == "Upstream"
+  assert error.value.retry_after == 20
+  assert str(error.value) == "Upstream is unavailable, retry in 20 s"
+
+
+def test_a_success_resets_the_failures(clock):
+  breaker = CircuitBreaker("Upstream", failure_threshold=3, reset_timeout=30)
+
+  # Checks failures that are not in a row do not open the circuit
+  for _ in range(5):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+  assert breaker.state == circuit_breaker.CLOSED and breaker.failures == 0
+
+
+def test_one_probe_at_a_time_while_half_open(clock):
+  breaker = CircuitBreaker("Upstream", failure_threshold=1, reset_timeout=30)
+  breaker.record_failure()
+  clock[0] += 30
+
+  # Lets exactly one of many callers through once the reset timeout has passed
+  allowed, rejected = [], []
+  barrier = threading.Barrier(8)
+
+  def call():
+    barrier.wait()
+    try:
+      breaker.allow()
+      allowed.append(True)
+    except CircuitOpen as e:
+      rejected.append(e)
+
+  threads = [threading.Thread(target=call) for _ in range(8)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert len(allowed) == 1 and len(rejected) == 7
+  assert breaker.state == circuit_breaker.HALF_OPEN and breaker.probing
+
+  # Checks the waiting callers are told to retry in at least a second
+  assert all(error.retry_after >= 1 for error in rejected)
+
+
+def test_a_failed_probe_opens_the_circuit_again(clock):
+  breaker = CircuitBreaker("Upstream", failure_threshold=2, reset_timeout=30)
+  breaker.record_failure()
+  breaker.record_failure()
+  clock[0] += 30
+  breaker.allow()
+
+  # Opens again on a single failure of the probe, for a whole reset timeout from now
+  breaker.record_failure()
+  assert breaker.state == circuit_breaker.OPEN and breaker.opened_at == clock[0]
+  clock[0] += 29
+  with pytest.raises(CircuitOpen):
+    breaker.allow()
+
+
+def test_a_successful_probe_closes_the_circuit(clock):
+  breaker = CircuitBreaker("Upstream", failure_threshold=2, reset_timeout=30)
+  breaker.record_failure()
+  breaker.record_failure()
+  clock[0] += 30
+  breaker.allow()
+  breaker.record_success()
+
+  # Checks every request is let through again, and the failures count from zero
+  assert breaker.state == circuit_breaker.CLOSED and not breaker.probing and breaker.failures == 0
+  for _ in range(5):
+    breaker.allow()
+  breaker.record_failure()
+  assert not breaker.is_open()
@@ -0,0 +1,43 @@
+# Tests of the comparison of several wallets on one graph
+
+import pytz
+import data_analytics, io_pool, transaction_store
+
+
+WALLETS = ["0x" + "11" * 20, "0x" + "22" * 20, "0x" + "33" * 20]
+
+
+def test_compare_wallets_in_a_full_io_pool(monkeypatch):
+
+  # Uses an I/O pool with one worker, which the comparison itself takes
+  monkeypatch.setattr(io_pool, "IO_POOL_SIZE", 1)
+  monkeypatch.setattr(io_pool, "_executors", {})
+  monkeypatch.setattr(transaction_store.store, "get", lambda address: transaction_store.TransactionBatch.empty())
+
+  # Runs the comparison in the pool, which would wait forever if the histories were fetched in the same pool
+  comparison = io_pool.submit(data_analytics.compare_wallets, WALLETS, 3, pytz.utc).result(timeout=10)
+  assert "Combined" in comparison
+
+
+def test_graphs_fit_the_maximum_width(monkeypatch):
+  monkeypatch.setattr(transaction_store.store, "get", lambda address: transaction_store.TransactionBatch.empty())
+  wallets = ["0x" + f"{i:02x}" * 20 for i in range(1, 6)]
+
+  # Asks for a year for every number of wallets, which is cut to the months whose groups fit
+  for count in range(2, 6):
+    comparison = data_analytics.compare_wallets(wallets[:count], 12, pytz.utc)
+    graph = comparison.split("\n\n")[0]
+    assert max(len(line) for line in graph.split("\n")) <= data_analytics.ASCIIGraph.MAX_WIDTH
+
+  # Checks the single wallet graph fits with the most months it accepts
+  month_net_dict = {month: (-1) ** month * month * 1.5 for month in range(1, data_analytics.ASCIIGraph.MAX_MONTHS + 1)}
+  graph = data_analytics.ASCIIGraph(month_net_dict).construct()
+  assert max(len(line) for line in graph.split("\n")) <= data_analytics.ASCIIGraph.MAX_WIDTH
+
+
+def test_the_same_wallet_written_twice_is_compared_once(monkeypatch):
+  monkeypatch.setattr(transaction_store.store, "get", lambda address: transaction_store.TransactionBatch.empty())
+
+  # Writes the first wallet again in upper case
+  comparison = data_analytics.compare_wallets([WALLETS[0], WALLETS[0].upper().replace("0X", "0x"), WALLETS[1]], 3, pytz.utc)
+  assert comparison.count("0x1111...1111:") == 1 and comparison.count("0x2222...2222:") == 1
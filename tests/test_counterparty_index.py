@@ -0,0 +1,43 @@
+# Tests of the counterparty index
+
+from counterparty_index import CounterpartyIndex
+from transaction_store import TransactionBatch
+import addresses
+
+
+WALLET = "0x" + "11" * 20
+COUNTERPARTY = "0x" + "22" * 20
+OTHER = "0x" + "33" * 20
+
+
+def make_batch(transfers):
+  """Function to create a batch from (sender, receiver, value) transfers"""
+  return TransactionBatch.from_rows([
+    {"hash": f"0x{i:064x}", "blockNumber": str(i), "timeStamp": str(1600000000 + i), "from": sender, "to": receiver, "value": str(value), "gasUsed": "21000", "gasPrice": "1", "isError": "0"}
+    for i, (sender, receiver, value) in enumerate(transfers)
+  ])
+
+
+def test_zero_value_transfers_are_listed_once():
+  index = CounterpartyIndex()
+  wallet = addresses.normalize(WALLET)
+
+  # Adds two zero value transfers in separate updates, which leave the volume unchanged
+  index.update(make_batch([(WALLET, COUNTERPARTY, 0)]), wallet)
+  index.update(make_batch([(COUNTERPARTY, WALLET, 0)]), wallet)
+  index.update(make_batch([(WALLET, OTHER, 5)]), wallet)
+
+  for metric in ("volume", "count"):
+    top = [counterparty for counterparty, _ in index.top(5, metric)]
+    assert sorted(top) == sorted([addresses.normalize(COUNTERPARTY), addresses.normalize(OTHER)])
+
+
+def test_top_follows_updates():
+  index = CounterpartyIndex()
+  wallet = addresses.normalize(WALLET)
+
+  index.update(make_batch([(WALLET, COUNTERPARTY, 1), (WALLET, OTHER, 2)]), wallet)
+  assert index.top(1, "volume")[0][0] == addresses.normalize(OTHER)
+
+  index.update(make_batch([(COUNTERPARTY, WALLET, 10)]), wallet)
+  assert [counterparty for counterparty, _ in index.top(2, "volume")] == [addresses.normalize(COUNTERPARTY), addresses.normalize(OTHER)]
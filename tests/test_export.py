@@ -0,0 +1,73 @@
+# Tests that the exported CSV file holds the exact rows of a known history, however it is chunked and spooled
+
+import csv, gzip, io
+import pytest
+import export, transaction_store
+from transaction_store import TransactionBatch
+
+
+WALLET = "0x" + "11" * 20
+COUNTERPARTY = "0x" + "22" * 20
+
+
+def make_rows(count):
+  """Function to create the rows of a wallet sending, receiving, sending to itself and creating contracts"""
+  senders = [COUNTERPARTY, WALLET, WALLET, WALLET]
+  receivers = [WALLET, COUNTERPARTY, WALLET, ""]
+  return [
+    {"hash": f"0x{i:064x}", "blockNumber": str(100 + i), "timeStamp": str(1700000000 + 3600 * i), "from": senders[i % 4], "to": receivers[i % 4],
+     "value": str(12345678901234567890123 + i), "gasUsed": "21000", "gasPrice": str(10**9 + i), "isError": "1" if i % 5 == 0 else "0"}
+    for i in range(count)
+  ]
+
+
+def read(history):
+  """Function to decompress and parse an exported file"""
+  with gzip.open(history.file, "rt", encoding="utf-8", newline="") as text:
+    return list(csv.reader(text))
+
+
+@pytest.mark.parametrize("chunk_rows, spool_size", [(10000, 4 * 1024 * 1024), (3, 64)])
+def test_rows_match_the_history(monkeypatch, chunk_rows, spool_size):
+  monkeypatch.setattr(export, "EXPORT_CHUNK_ROWS", chunk_rows)
+  monkeypatch.setattr(export, "EXPORT_SPOOL_SIZE", spool_size)
+  rows = make_rows(10)
+  monkeypatch.setattr(transaction_store.store, "get", lambda address: TransactionBatch.from_rows(rows))
+
+  history = export.export_history(WALLET.upper().replace("0X", "0x"))
+  try:
+    assert history.filename == f"transactions_{WALLET}.csv.gz" and history.rows == 10
+    assert history.size == len(history.file.read()) and history.file.seek(0) == 0
+    lines = read(history)
+  finally:
+    history.close()
+
+  # Checks the header and every row, with exact wei amounts
+  assert lines[0] == export.HEADER
+  assert len(lines) == 11
+  for row, line in zip(rows, lines[1:]):
+    value, fee = int(row["value"]), 21000 * int(row["gasPrice"])
+    assert line == [
+      row["hash"], row["blockNumber"], row["timeStamp"], line[3], row["from"], row["to"] or "0x" + "00" * 20,
+      {COUNTERPARTY: "in", WALLET: "out"}[row["from"]] if row["to"] != row["from"] else "self",
+      str(value), export.format_ether(value), str(fee), row["isError"]
+    ]
+
+  # Checks the times are written in UTC
+  assert lines[1][3] == "2023-11-14T22:13:20"
+
+
+def test_empty_history(monkeypatch):
+  monkeypatch.setattr(transaction_store.store, "get", lambda address: TransactionBatch.empty())
+
+  history = export.export_history(WALLET)
+  try:
+    assert history.rows == 0 and read(history) == [export.HEADER]
+  finally:
+    history.close()
+
+
+def test_ether_is_formatted_exactly():
+  assert export.format_ether(12345678901234567890123) == "12345.678901234567890123"
+  assert export.format_ether(1) == "0.000000000000000001"
+  assert export.format_ether(-10**18) == "-1.000000000000000000"
@@ -0,0 +1,88 @@
+# Tests of the gas fee analytics on a fixed history spread over the past months
+
+import pytest
+import pytz
+import gas_analytics, transaction_store, time_series
+from transaction_store import TransactionBatch
+from wei import WEI_PER_ETHER
+
+
+WALLET = "0x" + "11" * 20
+COUNTERPARTY = "0x" + "22" * 20
+
+# The number of months of history, more than the report shows
+MONTHS = 9
+
+
+@pytest.fixture
+def history(monkeypatch):
+  """Function to serve a history with sent, received and failed transactions in every one of the past months, returning the fee in wei each month paid"""
+
+  timezone = pytz.timezone("Asia/Tokyo")
+  start_time, end_time = time_series.month_window(MONTHS, timezone)
+  starts, boundaries = time_series.bucket_boundaries("month", timezone, start_time, end_time)
+
+  rows, fees = [], {}
+  for index, (start, boundary) in enumerate(zip(starts[:-1], boundaries[:-1])):
+    fees[start.month] = 0
+    for i in range(4):
+
+      # Sends three transactions a month (the last one failed, which still pays for gas) and receives one
+      sent = i < 3
+      gas_price = 10**9 * (index + 1) * (i + 1)
+      rows.append({
+        "hash": f"0x{index * 4 + i:064x}", "blockNumber": str(index * 4 + i), "timeStamp": str(boundary + 3600 * (i + 1)),
+        "from": WALLET if sent else COUNTERPARTY, "to": COUNTERPARTY if sent else WALLET, "value": str(10**18),
+        "gasUsed": "21000", "gasPrice": str(gas_price), "isError": "1" if i == 2 else "0"
+      })
+      if sent:
+        fees[start.month] += 21000 * gas_price
+
+  monkeypatch.setattr(transaction_store.store, "get", lambda address: TransactionBatch.from_rows(rows))
+  return timezone, rows, fees
+
+
+def test_months_sum_the_fees_sent(history):
+  timezone, rows, fees = history
+
+  # Checks every month of the window has the fees of the transactions the wallet sent, in its own timezone
+  months = gas_analytics.gas_for_past_months(WALLET, 6, timezone)
+  assert list(months) == list(fees)[-6:]
+  for month, gas in months.items():
+    assert gas == pytest.approx(fees[month] / WEI_PER_ETHER)
+
+
+def test_report_is_capped_at_six_months(history):
+  timezone, rows, fees = history
+
+  # Asks for more months than the graph can label, which is cut to six
+  report, graph = gas_analytics.get_gas_report(WALLET, 12, timezone, number_of_results=2)
+  assert report.startswith(f"Gas fees of {WALLET} for the past 6 months")
+
+  # Checks the total and the count only include the six months sent by the wallet
+  total = sum(list(fees.values())[-6:])
+  assert f"Total: {total / WEI_PER_ETHER:.6f} ETH over 18 transactions" in report
+
+  # Checks the two most expensive transactions of each month are listed, the failed one first
+  assert report.count("Most expensive in") == 6
+  last = len(rows) // 4 - 1
+  assert f"0x{last * 4 + 2:064x}: {21000 * 10**9 * (last + 1) * 3 / WEI_PER_ETHER:.6f} ETH\n0x{last * 4 + 1:064x}" in report
+
+  # Checks the graph labels six months and fits the width of a phone
+  lines = graph.split("\n")
+  assert sum(line.count(month) for line in lines for month in gas_analytics.ASCIIGraph.month_dict.values()) == 6
+  assert max(len(line) for line in lines) <= gas_analytics.ASCIIGraph.MAX_WIDTH
+
+
+def test_distribution_of_the_fees():
+  import numpy
+
+  distribution = gas_analytics.get_fee_distribution(numpy.array([0.0, 1.0, 2.0, 3.0, 4.0, 0.0]))
+  assert distribution["count"] == 4 and distribution["total"] == 10.0 and distribution["max"] == 4.0
+  assert distribution["p50"] == 2.5
+  assert gas_analytics.get_fee_distribution(numpy.zeros(3)) == {"count": 0, "total": 0.0}
+
+
+def test_wallet_without_fees(monkeypatch):
+  monkeypatch.setattr(transaction_store.store, "get", lambda address: TransactionBatch.empty())
+  assert gas_analytics.get_gas_report(WALLET, 3, pytz.utc) == (f"{WALLET} did not pay any gas fees in the past 3 months.", None)
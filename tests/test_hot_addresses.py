@@ -0,0 +1,105 @@
+# Tests that wallets become hot with repeated requests, cool down as their scores decay and have their results kept only while hot
+
+import pytest
+import hot_addresses, addresses
+
+
+WALLETS = ["0x" + f"{i:02x}" * 20 for i in range(1, 5)]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  """Function to replace the time the tracker reads with a clock the tests move"""
+  now = [1000000.0]
+  monkeypatch.setattr(hot_addresses.time, "time", lambda: now[0])
+  return now
+
+
+def request(tracker, wallet, times, task=None):
+  """Function to count a number of requests for a wallet"""
+  for _ in range(times):
+    tracker.record(wallet, task)
+
+
+def test_wallets_asked_for_often_become_hot(clock, monkeypatch):
+  monkeypatch.setattr(hot_addresses, "HOT_ADDRESSES", 2)
+  tracker = hot_addresses.HotAddressTracker()
+
+  # Asks for the wallets a different number of times, the last one too few times to be hot at all
+  for wallet, times in zip(WALLETS, (5, 9, 4, 2)):
+    request(tracker, wallet, times)
+
+  # Checks only the highest scores are promoted, hottest first, up to the number of hot wallets
+  assert tracker.update_hot() == [addresses.normalize(WALLETS[1]), addresses.normalize(WALLETS[0])]
+  assert tracker.is_hot(WALLETS[0].upper().replace("0X", "0x")) and not tracker.is_hot(WALLETS[2])
+
+
+def test_scores_decay_with_the_half_life(clock):
+  tracker = hot_addresses.HotAddressTracker()
+  request(tracker, WALLETS[0], 8)
+  address = addresses.normalize(WALLETS[0])
+
+  # Halves the score with every half life
+  clock[0] += hot_addresses.HALF_LIFE
+  assert tracker.decayed(address, clock[0]) == pytest.approx(4)
+  assert tracker.update_hot() == [address]
+
+  # Drops the wallet from the hot set once its score falls under the minimum
+  clock[0] += 2 * hot_addresses.HALF_LIFE
+  assert tracker.decayed(address, clock[0]) == pytest.approx(1)
+  assert tracker.update_hot() == [] and not tracker.is_hot(WALLETS[0])
+
+  # Adds new requests to the decayed score rather than the old one
+  request(tracker, WALLETS[0], 2)
+  assert tracker.decayed(address, clock[0]) == pytest.approx(3)
+  assert tracker.update_hot() == [address]
+
+
+def test_recent_demand_beats_old_demand(clock):
+  tracker = hot_addresses.HotAddressTracker()
+
+  # Asks for one wallet many times long ago, and for another a few times now
+  request(tracker, WALLETS[0], 20)
+  clock[0] += 5 * hot_addresses.HALF_LIFE
+  request(tracker, WALLETS[1], 5)
+
+  assert tracker.update_hot()[0] == addresses.normalize(WALLETS[1])
+
+
+def test_only_the_latest_tasks_are_kept(clock):
+  tracker = hot_addresses.HotAddressTracker()
+
+  for months in range(1, hot_addresses.MAX_TASKS + 2):
+    tracker.record(WALLETS[0], ("graph", months))
+  tracker.record(WALLETS[0], ("graph", 2))
+
+  # Checks the oldest task is forgotten and a repeated task moves to the end
+  assert tracker.get_tasks(addresses.normalize(WALLETS[0])) == [("graph", 3), ("graph", 4), ("graph", 5), ("graph", 2)]
+
+
+def test_results_are_kept_only_for_hot_wallets_and_the_same_version(clock, monkeypatch):
+  tracker = hot_addresses.HotAddressTracker()
+  precomputer = hot_addresses.Precomputer(tracker)
+  hot, cold = addresses.normalize(WALLETS[0]), addresses.normalize(WALLETS[1])
+  request(tracker, WALLETS[0], 5)
+  tracker.update_hot()
+  calls = []
+
+  def compute():
+    calls.append(True)
+    return len(calls)
+
+  # Computes the result of the hot wallet once per version
+  assert precomputer.cached((hot, "graph"), 1, compute) == 1
+  assert precomputer.cached((hot, "graph"), 1, compute) == 1
+  assert precomputer.cached((hot, "graph"), 2, compute) == 2
+
+  # Computes the result of the cold wallet every time
+  assert precomputer.cached((cold, "graph"), 1, compute) == 3
+  assert precomputer.cached((cold, "graph"), 1, compute) == 4
+
+  # Drops the results of the wallet once it cools down (without precomputing, as the bots are not idle)
+  clock[0] += 3 * hot_addresses.HALF_LIFE
+  monkeypatch.setattr(precomputer, "is_idle", lambda: False)
+  precomputer.run_round()
+  assert not precomputer.results
@@ -0,0 +1,37 @@
+# Tests that invalid addresses are rejected before Etherscan is called and do not count as Etherscan failures
+
+import pytest
+import addresses, etherscan_api, circuit_breaker
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+  breaker = circuit_breaker.CircuitBreaker("Etherscan")
+  monkeypatch.setattr(circuit_breaker, "etherscan", breaker)
+  return breaker
+
+
+@pytest.mark.parametrize("address", ["hello", "", "0x", "0x" + "zz" * 20, "0x" + "ab" * 19])
+def test_invalid_address_is_rejected_before_any_request(monkeypatch, breaker, address):
+  monkeypatch.setattr(etherscan_api, "request_json", lambda *args: pytest.fail("Etherscan was called"))
+
+  with pytest.raises(addresses.InvalidAddress):
+    etherscan_api.get_ether_balance(address)
+  with pytest.raises(addresses.InvalidAddress):
+    etherscan_api.get_normal_transactions(address)
+  with pytest.raises(addresses.InvalidAddress):
+    etherscan_api.get_token_transactions(address, False, False)
+
+
+def test_invalid_address_while_parsing_is_not_an_etherscan_failure(monkeypatch, breaker):
+
+  class Client:
+    def get(self, url):
+      raise addresses.InvalidAddress("Invalid ethereum address: 0xhello")
+
+  monkeypatch.setattr(etherscan_api.httpx_client, "get_client", lambda: Client())
+  monkeypatch.setattr(etherscan_api.key_pool.etherscan, "acquire", lambda: "key")
+
+  with pytest.raises(addresses.InvalidAddress):
+    etherscan_api.request_json("https://api.etherscan.io/api?module=account")
+  assert breaker.failures == 0
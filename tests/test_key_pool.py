@@ -0,0 +1,47 @@
+# Tests that the key pool fails fast once every key was rejected as invalid
+
+import time
+import pytest
+import key_pool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+  monkeypatch.setenv("TEST_KEYS", "first,second")
+  return key_pool.KeyPool("Test", "TEST_KEYS", 100.0)
+
+
+def test_invalid_keys_fail_fast(pool):
+
+  # Rejects one key, which leaves the other one to use
+  pool.report_invalid("first")
+  assert pool.acquire() == "second"
+
+  # Rejects the other key, after which the pool raises instead of waiting for the keys to rest
+  pool.report_invalid("second")
+  start = time.perf_counter()
+  with pytest.raises(key_pool.NoValidKey) as error:
+    pool.acquire()
+  assert time.perf_counter() - start < 1.0
+  assert error.value.retry_after > key_pool.INVALID_KEY_COOLDOWN - 10
+
+
+def test_rested_invalid_key_is_tried_again(pool):
+
+  # Rejects both keys and lets the first one finish resting
+  pool.report_invalid("first")
+  pool.report_invalid("second")
+  pool.find("first").cooled_until = 0.0
+
+  # Checks the rested key is handed out again and is no longer invalid once a request with it succeeds
+  assert pool.acquire() == "first"
+  pool.report_success("first")
+  assert not pool.find("first").invalid
+
+
+def test_rate_limited_keys_still_wait(pool):
+
+  # Rests both keys for a moment because of their rate limit, which is waited for instead of raising
+  pool.find("first").cooled_until = time.time() + 0.05
+  pool.find("second").cooled_until = time.time() + 0.05
+  assert pool.acquire() in ("first", "second")
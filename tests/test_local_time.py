@@ -0,0 +1,53 @@
+# Tests that the cached offset tables agree with pytz
+
+import random
+from datetime import datetime, timedelta
+import pytz
+import local_time, monthly_aggregates
+
+
+# The timezones checked, which include daylight saving in both hemispheres, half hour offsets and no offset
+TIMEZONES = ["UTC", "Europe/London", "America/New_York", "Australia/Sydney", "Asia/Kolkata", "America/Sao_Paulo", "Australia/Lord_Howe"]
+
+
+def test_to_local_matches_pytz():
+  random.seed(0)
+
+  # Checks random times from 1970 to 2033 in every timezone
+  for name in TIMEZONES:
+    timezone = pytz.timezone(name)
+    for timestamp in random.sample(range(0, 2_000_000_000), 500):
+      assert local_time.to_local(timestamp, timezone) == datetime.fromtimestamp(timestamp, timezone).replace(tzinfo=None)
+
+
+def test_to_timestamp_matches_pytz_around_transitions():
+  for name in TIMEZONES:
+    timezone = pytz.timezone(name)
+
+    # Checks every half hour around every transition, which covers the skipped and the repeated local times
+    for transition in local_time.get_transitions(timezone)[0][1:200]:
+      for step in range(-6, 7):
+        local = local_time.to_local(transition, timezone).replace(minute=0, second=0) + timedelta(minutes=30 * step)
+        assert local_time.to_timestamp(local, timezone) == int(timezone.localize(local, is_dst=False).timestamp())
+
+
+def test_local_fields_match_to_local():
+  import numpy
+
+  timezone = pytz.timezone("America/New_York")
+
+  # Checks the fields of a whole array against the conversion of one timestamp at a time
+  timestamps = numpy.array(random.Random(1).sample(range(0, 2_000_000_000), 1000), dtype=numpy.int64)
+  fields = local_time.LocalFields(timestamps, timezone)
+  for i, timestamp in enumerate(timestamps):
+    local = local_time.to_local(int(timestamp), timezone)
+    assert (fields.year[i], fields.month[i], fields.day[i], fields.hour[i], fields.minute[i], fields.second[i]) == (local.year, local.month, local.day, local.hour, local.minute, local.second)
+
+
+def test_month_index_of_local_fields():
+  timezone = pytz.timezone("Australia/Sydney")
+
+  # The first second of 2024 in Sydney is still December 2023 in UTC
+  timestamp = int(timezone.localize(datetime(2024, 1, 1)).timestamp())
+  fields = local_time.LocalFields([timestamp - 1, timestamp], timezone)
+  assert list(fields.year * 12 + fields.month - 1) == [monthly_aggregates.month_index(datetime(2023, 12, 1)), monthly_aggregates.month_index(datetime(2024, 1, 1))]
@@ -0,0 +1,137 @@
+# Tests that the monthly aggregates built page by page and derived into other timezones match a full recompute
+
+import calendar, random
+from datetime import datetime
+import pytest
+import pytz
+import transaction_store, monthly_aggregates, addresses
+from transaction_store import TransactionBatch, TransactionStore
+
+
+WALLET = "0x" + "11" * 20
+COUNTERPARTY = "0x" + "22" * 20
+
+
+def make_rows(count, seed=5):
+  """Function to create the rows of a wallet over a year and a half, with many transactions in the hours around the starts of the months"""
+  random.seed(seed)
+
+  # Takes half the times near midnight UTC at the start of a month, which fall in another month in most timezones
+  month_starts = [calendar.timegm(datetime(2023 + month // 12, month % 12 + 1, 1).timetuple()) for month in range(18)]
+  times = sorted(
+    random.choice(month_starts) + random.randint(-14 * 3600, 14 * 3600) if i % 2 else random.randint(month_starts[0], month_starts[-1])
+    for i in range(count)
+  )
+
+  rows = []
+  for i, timestamp in enumerate(times):
+    incoming = random.random() < 0.5
+    rows.append({
+      "hash": f"0x{i:064x}", "blockNumber": str(i), "timeStamp": str(timestamp), "from": COUNTERPARTY if incoming else WALLET, "to": WALLET if incoming else COUNTERPARTY,
+      "value": str(random.randint(0, 10**21)), "gasUsed": "21000", "gasPrice": str(random.randint(1, 10**11)), "isError": "1" if random.random() < 0.1 else "0"
+    })
+  return rows
+
+
+def totals(months):
+  """Function to get the totals of every month, to compare aggregates by value"""
+  return {month: (aggregate.inflow, aggregate.outflow, aggregate.gas, aggregate.incoming, aggregate.outgoing) for month, aggregate in months.items() if aggregate.incoming or aggregate.outgoing}
+
+
+def recompute(rows, timezone):
+  """Function to sum the whole history again in a timezone"""
+  return totals(monthly_aggregates.aggregate(TransactionBatch.from_rows(rows), addresses.normalize(WALLET), pytz.timezone(timezone)))
+
+
+@pytest.fixture
+def chain(monkeypatch):
+  """Fixture that serves pages of a fake chain, which tests can extend"""
+
+  rows = make_rows(150)
+  served = [100]
+
+  def fetch_page(address, page_size, start_block):
+    return TransactionBatch.from_rows([row for row in rows[:served[0]] if int(row["blockNumber"]) >= start_block][:page_size])
+
+  monkeypatch.setattr(transaction_store, "fetch_page", fetch_page)
+  monkeypatch.setattr(transaction_store, "PAGE_SIZE", 10)
+  monkeypatch.setattr(transaction_store, "MAX_SYNC_PAGES", 3)
+  return rows, served
+
+
+@pytest.fixture
+def table(tmp_path):
+  store = TransactionStore()
+  return monthly_aggregates.AggregateTable(store, str(tmp_path / "aggregates.db"))
+
+
+def build(table, timezone):
+  """Function to build the months of the wallet in a timezone and read all of them"""
+  address = addresses.normalize(WALLET)
+  with table.lock:
+    table.ensure(address, timezone)
+    return table.get_months(address, timezone)
+
+
+def test_months_added_page_by_page_match_a_full_recompute(chain, table):
+  rows, served = chain
+
+  # Builds the months from the first pages, then adds the rest of the history over several syncs of a few pages each
+  table.store.sync(WALLET, force=True)
+  build(table, "UTC")
+  served[0] = len(rows)
+  while table.store.sync(WALLET, force=True).last_block() < len(rows) - 1:
+    pass
+
+  # Checks the months match the whole history summed at once
+  assert totals(build(table, "UTC")) == recompute(rows, "UTC")
+
+
+@pytest.mark.parametrize("timezone", ["Asia/Tokyo", "America/New_York", "Asia/Kolkata"])
+def test_derived_timezone_matches_a_full_recompute(chain, table, timezone):
+  rows, served = chain
+  served[0] = len(rows)
+  while table.store.sync(WALLET, force=True).last_block() < len(rows) - 1:
+    pass
+
+  # Builds the months in UTC, then derives the other timezone from them
+  build(table, "UTC")
+  derived = build(table, timezone)
+
+  # Checks the transactions near the starts of the months moved, and the derived months are exact
+  assert totals(derived) != recompute(rows, "UTC")
+  assert totals(derived) == recompute(rows, timezone)
+  assert table.first_exact_month(WALLET, pytz.timezone(timezone)) is None
+
+
+def test_months_derived_from_a_trimmed_history_are_marked_partial(chain, table, monkeypatch):
+  rows, served = chain
+
+  # Builds the months in UTC from the whole of the first rows
+  served[0] = 100
+  while table.store.sync(WALLET, force=True).last_block() < 99:
+    pass
+  build(table, "UTC")
+
+  # Syncs the rest of the history, dropping the oldest transactions
+  monkeypatch.setattr(transaction_store, "MAX_HISTORY_ROWS", 60)
+  served[0] = len(rows)
+  while table.store.sync(WALLET, force=True).last_block() < len(rows) - 1:
+    pass
+  first_time = int(table.store.batches[addresses.normalize(WALLET)].timestamp[0])
+  assert addresses.normalize(WALLET) in table.store.trimmed
+
+  # Derives Tokyo from UTC, which can not move the transactions near the starts of the months before the trimmed history
+  timezone = pytz.timezone("Asia/Tokyo")
+  derived = totals(build(table, "Asia/Tokyo"))
+  first_exact_month = table.first_exact_month(WALLET, timezone)
+  assert first_exact_month == monthly_aggregates.month_index(datetime.fromtimestamp(first_time, timezone)) + 1
+
+  # Checks the months from the first exact month match a full recompute, and the earlier ones are read as partial
+  expected = recompute(rows, "Asia/Tokyo")
+  assert {month: total for month, total in derived.items() if month >= first_exact_month} == {month: total for month, total in expected.items() if month >= first_exact_month}
+  months = table.months(WALLET, timezone, first_exact_month - 3, first_exact_month + 3)
+  assert [month.partial for month in months] == [True] * 3 + [False] * 3
+
+  # Checks the timezone it was derived from is still exact
+  assert totals(build(table, "UTC")) == recompute(rows, "UTC")
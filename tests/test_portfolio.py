@@ -0,0 +1,68 @@
+# Tests that the token transfers of a wallet are fetched past the one page Etherscan returns
+
+import addresses, etherscan_api, portfolio
+
+
+WALLET = "0x" + "11" * 20
+TOKEN = "0x" + "44" * 20
+
+
+def make_history(blocks):
+  """Function to create incoming token transfers of one unit, one per block in the list, newest first"""
+  return [
+    etherscan_api.Transaction(
+      hash=f"0x{i:064x}", blockNumber=str(block), contractAddress=TOKEN, tokenSymbol="TKN", tokenName="Token", tokenDecimal="0", value="1",
+      **{"from": addresses.normalize("0x" + "22" * 20), "to": addresses.normalize(WALLET)}
+    )
+    for i, block in enumerate(sorted(blocks, reverse=True))
+  ]
+
+
+def serve(monkeypatch, history, page_size, max_pages):
+  """Function to answer token transfer queries from a history the way Etherscan does, one page of the newest transfers up to the end block"""
+  requests = []
+
+  def get_token_transactions(address, contract_address, nft, number_of_results=100, end_block=None):
+    requests.append(end_block)
+    return [transfer for transfer in history if end_block is None or int(transfer.blockNumber) <= end_block][:number_of_results]
+
+  monkeypatch.setattr(etherscan_api, "get_token_transactions", get_token_transactions)
+  monkeypatch.setattr(portfolio, "MAX_TOKEN_TRANSFERS", page_size)
+  monkeypatch.setattr(portfolio, "MAX_TOKEN_PAGES", max_pages)
+  return requests
+
+
+def test_full_history_is_fetched_over_several_pages(monkeypatch):
+
+  # Creates 25 transfers with two in some blocks, which is more than two pages of 10
+  history = make_history(list(range(1, 21)) + [5, 10, 15, 20, 20])
+  requests = serve(monkeypatch, history, 10, 10)
+
+  # Checks every transfer is fetched once and the balance is exact
+  transfers, complete = portfolio.get_token_transfers(WALLET)
+  assert complete
+  assert sorted(transfer.hash for transfer in transfers) == sorted(transfer.hash for transfer in history)
+  assert portfolio.compute_token_balances(transfers, WALLET) == [(TOKEN, "TKN", "Token", 25.0)]
+  assert len(requests) > 2
+
+
+def test_history_past_the_page_limit_is_flagged(monkeypatch):
+
+  # Creates more transfers than two pages hold
+  serve(monkeypatch, make_history(range(1, 51)), 10, 2)
+
+  # Checks the newest transfers are returned and the history is flagged as incomplete
+  transfers, complete = portfolio.get_token_transfers(WALLET)
+  assert not complete
+  assert [int(transfer.blockNumber) for transfer in transfers] == list(range(50, 32, -1))
+
+
+def test_block_with_a_full_page_stops_the_paging(monkeypatch):
+
+  # Creates a block with more transfers than a page holds
+  serve(monkeypatch, make_history([7] * 15), 10, 10)
+
+  # Checks the paging stops instead of asking for the same block again
+  transfers, complete = portfolio.get_token_transfers(WALLET)
+  assert not complete
+  assert len(transfers) == 10
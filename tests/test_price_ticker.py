@@ -0,0 +1,74 @@
+# Tests of the price ticker
+
+import time
+import httpx
+import pytest
+import price_ticker, httpx_client, circuit_breaker, etherscan_api
+
+
+class FakeClient:
+  """Class that answers every request with the same status and json"""
+
+  def __init__(self, status_code, json_response):
+    self.status_code = status_code
+    self.json_response = json_response
+    self.requests = 0
+
+  def get(self, url):
+    self.requests += 1
+    return httpx.Response(self.status_code, json=self.json_response, request=httpx.Request("GET", url))
+
+
+@pytest.fixture
+def ticker(monkeypatch):
+  monkeypatch.setattr(price_ticker, "FIRST_LOAD_BACKOFF", 0.01)
+  monkeypatch.setattr(circuit_breaker, "coingecko", circuit_breaker.CircuitBreaker("CoinGecko"))
+  return price_ticker.PriceTicker(["ethereum"], ["usd"], 30)
+
+
+@pytest.mark.parametrize("status_code, json_response", [
+  (429, {"status": {"error_code": 429, "error_message": "You've exceeded the Rate Limit"}}),
+  (200, {"status": {"error_code": 429, "error_message": "You've exceeded the Rate Limit"}}),
+  (200, {"ethereum": {"usd": None}}),
+])
+def test_error_replies_fail_the_first_load(ticker, monkeypatch, status_code, json_response):
+  client = FakeClient(status_code, json_response)
+  monkeypatch.setattr(httpx_client, "get_client", lambda: client)
+
+  # Gives up after the attempts instead of retrying forever
+  started = time.time()
+  with pytest.raises(circuit_breaker.CircuitOpen):
+    ticker.get_price()
+  assert client.requests == price_ticker.FIRST_LOAD_ATTEMPTS
+  assert time.time() - started < 1
+
+  # Counts the bad replies as failures of CoinGecko
+  assert circuit_breaker.coingecko.failures == price_ticker.FIRST_LOAD_ATTEMPTS
+
+  # Fails fast right after instead of trying again
+  with pytest.raises(circuit_breaker.CircuitOpen):
+    ticker.get_price()
+  assert client.requests == price_ticker.FIRST_LOAD_ATTEMPTS
+
+
+def test_prices_are_loaded(ticker, monkeypatch):
+  monkeypatch.setattr(httpx_client, "get_client", lambda: FakeClient(200, {"ethereum": {"usd": 1234.5}}))
+  assert ticker.get_price("ethereum", "usd") == 1234.5
+
+
+@pytest.mark.parametrize("convert", [etherscan_api.convert_eth_to_usd, etherscan_api.convert_usd_to_eth])
+def test_conversions_without_a_price_tell_the_user_to_retry(ticker, monkeypatch, convert):
+  monkeypatch.setattr(price_ticker, "ticker", ticker)
+
+  # Loads a snapshot that is missing the price of Ether
+  monkeypatch.setattr(httpx_client, "get_client", lambda: FakeClient(200, {"ethereum": {"eur": 1000.0}}))
+  with pytest.raises(circuit_breaker.CircuitOpen) as error:
+    convert("2")
+  assert str(error.value).startswith("CoinGecko is unavailable")
+
+
+def test_conversions_use_the_snapshot(ticker, monkeypatch):
+  monkeypatch.setattr(price_ticker, "ticker", ticker)
+  monkeypatch.setattr(httpx_client, "get_client", lambda: FakeClient(200, {"ethereum": {"usd": 2000.0}}))
+  assert etherscan_api.convert_eth_to_usd("1.5") == 3000.0
+  assert etherscan_api.convert_usd_to_eth(500) == 0.25
@@ -0,0 +1,135 @@
+# Tests that concurrent identical calls share one call and its result or error
+
+import asyncio, threading, time
+import pytest
+import single_flight
+
+
+THREADS = 8
+
+
+class CountingFlight(single_flight.SingleFlight):
+  """Class that counts the callers that have joined a call, so the tests know when every thread is waiting"""
+
+  def __init__(self):
+    super().__init__()
+    self.joined = 0
+
+  def join(self, key):
+    result = super().join(key)
+    with self.lock:
+      self.joined += 1
+    return result
+
+
+def wait_for(condition, timeout=5.0):
+  """Function to wait until a condition holds, as the callers join on other threads"""
+  deadline = time.time() + timeout
+  while not condition():
+    assert time.time() < deadline
+    time.sleep(0.001)
+
+
+def call_from_threads(group, loader):
+  """Function to call the loader with the same key from many threads while it is blocked, returning the results and errors of every caller"""
+  results, errors = [], []
+
+  def call():
+    try:
+      results.append(group.do("key", loader))
+    except Exception as e:
+      errors.append(e)
+
+  threads = [threading.Thread(target=call) for _ in range(THREADS)]
+  for thread in threads:
+    thread.start()
+
+  # Lets the loader finish once every caller has joined the call
+  wait_for(lambda: group.joined == THREADS)
+  loader.release.set()
+  for thread in threads:
+    thread.join()
+
+  return results, errors
+
+
+class Loader:
+  """Class that blocks until released, counting its calls, and then returns its result or raises its error"""
+
+  def __init__(self, result=None, error=None):
+    self.result, self.error = result, error
+    self.calls = 0
+    self.release = threading.Event()
+
+  def __call__(self):
+    self.calls += 1
+    assert self.release.wait(5)
+    if self.error is not None:
+      raise self.error
+    return self.result
+
+
+def test_the_loader_runs_once_for_every_caller():
+  group = CountingFlight()
+  loader = Loader(result={"balance": 1})
+
+  results, errors = call_from_threads(group, loader)
+
+  # Checks every caller got the same result from one call, and the call is forgotten once done
+  assert loader.calls == 1 and not errors
+  assert len(results) == THREADS and all(result is results[0] for result in results)
+  assert not group.in_flight
+
+
+def test_an_error_reaches_every_caller_and_is_not_cached():
+  group = CountingFlight()
+  loader = Loader(error=ValueError("Invalid address"))
+
+  results, errors = call_from_threads(group, loader)
+
+  # Checks every caller got the error from one call
+  assert loader.calls == 1 and not results
+  assert len(errors) == THREADS and all(error is loader.error for error in errors)
+
+  # Checks the next call runs the loader again instead of getting the old error
+  loader.error, loader.result = None, "fresh"
+  assert group.do("key", loader) == "fresh" and loader.calls == 2
+
+
+def test_equivalent_arguments_share_a_key(monkeypatch):
+  monkeypatch.setattr(single_flight, "group", CountingFlight())
+  loader = Loader(result=5)
+
+  @single_flight.coalesced
+  def get_balance(address, tag="latest"):
+    return loader()
+
+  # Calls with the address in different cases and the default written out
+  results = []
+  threads = [threading.Thread(target=lambda arguments=arguments: results.append(get_balance(*arguments[0], **arguments[1]))) for arguments in [
+    (("0xABC",), {}), ((" 0xabc",), {"tag": "latest"}), (("0xAbC", "latest"), {})
+  ]]
+  for thread in threads:
+    thread.start()
+  wait_for(lambda: single_flight.group.joined == 3)
+  loader.release.set()
+  for thread in threads:
+    thread.join()
+
+  assert results == [5, 5, 5] and loader.calls == 1
+
+
+def test_async_callers_share_the_call():
+  group = CountingFlight()
+  loader = Loader(result="shared")
+
+  async def main():
+    tasks = [asyncio.ensure_future(group.do_async("key", loader)) for _ in range(THREADS)]
+
+    # Lets the loader finish once every task has joined the call
+    while group.joined < THREADS:
+      await asyncio.sleep(0.001)
+    loader.release.set()
+    return await asyncio.gather(*tasks)
+
+  assert asyncio.run(main()) == ["shared"] * THREADS and loader.calls == 1
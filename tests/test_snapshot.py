@@ -0,0 +1,107 @@
+# Tests that a snapshot loads back the state it saved, and that a damaged snapshot is skipped
+
+import os, time
+import pytest
+import snapshot, transaction_store, price_ticker, hot_addresses, addresses
+from transaction_store import TransactionBatch, TransactionStore
+
+
+WALLETS = ["0x" + "11" * 20, "0x" + "22" * 20]
+
+
+def make_batch(count, offset=0):
+  """Function to create a batch with every column filled, including values too large for 64 bits and contract creations"""
+  return TransactionBatch.from_rows([
+    {"hash": f"0x{offset + i:064x}", "blockNumber": str(100 + i), "timeStamp": str(1600000000 + i), "from": WALLETS[0], "to": WALLETS[1] if i % 3 else "",
+     "value": str(10**30 + i), "gasUsed": str(21000 + i), "gasPrice": str(10**9 + i), "isError": "1" if i % 4 == 0 else "0"}
+    for i in range(count)
+  ])
+
+
+@pytest.fixture
+def state(monkeypatch, tmp_path):
+  """Function to give the snapshotter fresh shared state, returning a function that replaces it again as a restart would"""
+
+  def restart():
+    monkeypatch.setattr(transaction_store, "store", TransactionStore())
+    monkeypatch.setattr(price_ticker, "ticker", price_ticker.PriceTicker(["ethereum"], ["usd"], 30))
+    tracker = hot_addresses.HotAddressTracker()
+    monkeypatch.setattr(hot_addresses, "tracker", tracker)
+    monkeypatch.setattr(hot_addresses, "precomputer", hot_addresses.Precomputer(tracker))
+
+  restart()
+  return restart
+
+
+def fill(store):
+  """Function to add two synced histories to a store, one of them trimmed"""
+  for index, (wallet, batch) in enumerate(zip(WALLETS, (make_batch(40), make_batch(3, 1000)))):
+    address = addresses.normalize(wallet)
+    store.batches[address] = batch
+    store.last_blocks[address] = batch.last_block()
+    store.synced_at[address] = time.time() - index
+  store.trimmed.add(addresses.normalize(WALLETS[0]))
+
+
+def assert_batches_equal(loaded, saved):
+  """Function to check every column of two batches is equal"""
+  assert len(loaded) == len(saved)
+  for column in TransactionBatch.columns:
+    if column == "value":
+      assert loaded.value.to_ints() == saved.value.to_ints()
+    else:
+      assert list(getattr(loaded, column)) == list(getattr(saved, column))
+
+
+def test_round_trip(state, tmp_path):
+  path = str(tmp_path / "snapshot.bin")
+  store = transaction_store.store
+  fill(store)
+  price_ticker.ticker.snapshot, price_ticker.ticker.updated_at = {"ethereum": {"usd": 1234.5}}, time.time()
+  saved = dict(store.batches)
+
+  snapshot.Snapshotter(path).save()
+  assert not os.path.exists(f"{path}.tmp")
+
+  # Loads the snapshot into the state of a new process
+  state()
+  assert snapshot.Snapshotter(path).load()
+
+  # Checks the columns, the sync state and the prices came back
+  store = transaction_store.store
+  for address, batch in saved.items():
+    assert_batches_equal(store.batches[address], batch)
+  assert store.last_blocks[addresses.normalize(WALLETS[0])] == 139
+  assert store.trimmed == {addresses.normalize(WALLETS[0])} and not store.incomplete
+  assert price_ticker.ticker.get_price("ethereum", "usd") == 1234.5
+
+
+def test_missing_file_starts_cold(state, tmp_path):
+  assert not snapshot.Snapshotter(str(tmp_path / "missing.bin")).load()
+  assert not transaction_store.store.batches
+
+
+@pytest.mark.parametrize("damage", ["empty", "magic", "header", "truncated"])
+def test_damaged_file_is_ignored(state, tmp_path, damage):
+  path = str(tmp_path / "snapshot.bin")
+  fill(transaction_store.store)
+  price_ticker.ticker.snapshot, price_ticker.ticker.updated_at = {"ethereum": {"usd": 1234.5}}, time.time()
+  snapshot.Snapshotter(path).save()
+
+  # Damages the file the way a full disk or another program could
+  with open(path, "rb") as file:
+    data = file.read()
+  data = {
+    "empty": b"",
+    "magic": b"XXXXXXXX" + data[8:],
+    "header": data[:16] + b"\xff" * 32 + data[48:],
+    "truncated": data[: len(data) - 200]
+  }[damage]
+  with open(path, "wb") as file:
+    file.write(data)
+
+  # Checks nothing is restored, not even the parts before the damage
+  state()
+  assert not snapshot.Snapshotter(path).load()
+  assert not transaction_store.store.batches
+  assert price_ticker.ticker.updated_at is None
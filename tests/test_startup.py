@@ -0,0 +1,53 @@
+# Tests that the modules load within the startup budget
+
+import os, subprocess, sys
+import pytest
+
+
+# The root of the repository, which the modules are imported from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The maximum number of seconds importing the modules may take, the same as the default budget of main
+STARTUP_BUDGET = 1.0
+
+# The modules the commands are served from, without the bot clients
+MODULES = [
+  "etherscan_api", "moralis_api", "data_analytics", "gas_analytics", "transaction_store", "monthly_aggregates", "counterparty_index",
+  "balance_batcher", "price_ticker", "portfolio", "watcher", "hot_addresses", "snapshot", "cache", "admission", "export", "chain_backend"
+]
+
+
+def run_python(*args):
+  """Function to run python in a fresh process from the root of the repository, so no module is imported already"""
+  environment = {key: value for key, value in os.environ.items() if key not in ("ETHERSCAN_KEY", "MORALIS_KEY")}
+  return subprocess.run([sys.executable, *args], cwd=ROOT, env=environment, capture_output=True, text=True, timeout=60)
+
+
+def test_modules_import_within_budget():
+
+  # Imports every module in a fresh process and prints the time taken and whether the heavy dependencies were loaded
+  result = run_python(
+    "-c",
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    f"import {', '.join(MODULES)}\n"
+    "print(time.perf_counter() - start, 'numpy' in sys.modules, 'httpx' in sys.modules)"
+  )
+  assert result.returncode == 0, result.stderr
+  seconds, numpy_loaded, httpx_loaded = result.stdout.split()
+
+  # Checks the budget, and that numpy and the HTTP client are only loaded on first use
+  assert float(seconds) < STARTUP_BUDGET
+  assert numpy_loaded == "False"
+  assert httpx_loaded == "False"
+
+
+def test_check_startup_exits_within_budget():
+
+  # Needs the bot clients, which main imports
+  pytest.importorskip("telebot")
+  pytest.importorskip("discord")
+
+  # Runs the startup check of main, which exits with an error if loading the bots is over the budget
+  result = run_python("main.py", "--check-startup")
+  assert result.returncode == 0, result.stderr
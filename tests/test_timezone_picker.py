@@ -0,0 +1,68 @@
+# Tests that the timezone picker pages through every timezone and that its buttons pick real pytz zones
+
+import json
+import pytest
+import pytz
+
+# Skips the tests where the Telegram library is not installed, as the keyboards are built with it
+pytest.importorskip("telebot")
+import timezone_picker
+
+
+def buttons(keyboard):
+  """Function to get the (text, callback data) of every button of a serialized keyboard"""
+  return [(button["text"], button["callback_data"]) for row in json.loads(keyboard)["inline_keyboard"] for button in row]
+
+
+def walk(keyboard_for_page):
+  """Function to follow the next page buttons from the first page, returning the timezones picked by each page's buttons"""
+  pages, page = [], 0
+  while True:
+    page_buttons = buttons(keyboard_for_page(page))
+    pages.append([data[len(timezone_picker.CALLBACK_PREFIX) + 2:] for _, data in page_buttons if data.startswith(timezone_picker.CALLBACK_PREFIX + "s:")])
+    next_pages = [data for text, data in page_buttons if text.startswith("Next")]
+    if not next_pages:
+      return pages
+    page = int(next_pages[0].rpartition(":")[2])
+    assert page == len(pages)
+
+
+def test_regions_lead_to_their_timezones():
+  regions = [data for _, data in buttons(timezone_picker.regions_keyboard())]
+
+  # Checks every region button opens the first page of a region with timezones
+  assert f"{timezone_picker.CALLBACK_PREFIX}r:Europe:0" in regions
+  for data in regions:
+    region = data[len(timezone_picker.CALLBACK_PREFIX) + 2:].rpartition(":")[0]
+    assert timezone_picker.get_regions()[region]
+
+
+@pytest.mark.parametrize("region", ["America", "Europe", "Other"])
+def test_pages_cover_the_region_once(region):
+  pages = walk(lambda page: timezone_picker.region_keyboard(region, page))
+
+  # Checks the pages are full except the last one and hold every timezone of the region once, in order
+  assert all(len(page) == timezone_picker.PAGE_SIZE for page in pages[:-1]) and 0 < len(pages[-1]) <= timezone_picker.PAGE_SIZE
+  assert [timezone for page in pages for timezone in page] == timezone_picker.get_regions()[region]
+
+
+def test_buttons_pick_pytz_zones_within_the_callback_limit():
+  for region in timezone_picker.get_regions():
+    for page in walk(lambda page: timezone_picker.region_keyboard(region, page)):
+      for timezone in page:
+        assert pytz.timezone(timezone).zone == timezone
+
+  # Checks a long search still fits Telegram's limit of 64 bytes of callback data
+  for _, data in buttons(timezone_picker.search_keyboard("a" * 200, 0)) + buttons(timezone_picker.search_keyboard("America/Argentina/", 1)):
+    assert len(data.encode()) <= 64
+
+
+def test_search_finds_zones_by_name_and_city():
+  assert "Asia/Singapore" in timezone_picker.search("sing")
+  assert "America/New_York" in timezone_picker.search("new y")
+  assert "America/New_York" in timezone_picker.search("America/New_")
+  assert timezone_picker.search("nowhere") == []
+
+  # Checks the search pages hold exactly the matches
+  pages = walk(lambda page: timezone_picker.search_keyboard("america/a", page))
+  assert [timezone for page in pages for timezone in page] == timezone_picker.search("america/a")
@@ -0,0 +1,20 @@
+# Tests of the timezones saved for the chats of both bots
+
+import pytz
+import timezone_store
+
+
+def test_timezones_are_saved_per_chat(monkeypatch):
+  db = {}
+  monkeypatch.setattr(timezone_store, "get_db", lambda: db)
+
+  # Saves the timezones of a Telegram chat and a Discord channel, whose IDs share a prefix
+  timezone_store.save_timezone_to_db(123, "Asia/Singapore")
+  timezone_store.save_timezone_to_db("discord:1234", "Europe/London")
+  timezone_store.save_timezone_to_db(123, "America/New_York")
+
+  # Checks each chat gets its own latest timezone and other chats get UTC
+  assert timezone_store.get_timezone_from_db(123) == pytz.timezone("America/New_York")
+  assert timezone_store.get_timezone_from_db("discord:1234") == pytz.timezone("Europe/London")
+  assert timezone_store.get_timezone_from_db(12) == pytz.utc
+  assert len(db["timezones"]) == 2
@@ -0,0 +1,86 @@
+# Tests of the limits of the transaction store
+
+import pytest
+import transaction_store, counterparty_index, addresses
+from transaction_store import TransactionBatch, TransactionStore
+
+
+WALLET = "0x" + "11" * 20
+COUNTERPARTY = "0x" + "22" * 20
+
+
+def make_rows(count):
+  """Function to create the rows of a wallet receiving 1 wei in every block"""
+  return [
+    {"hash": f"0x{i:064x}", "blockNumber": str(i), "timeStamp": str(1600000000 + i), "from": COUNTERPARTY, "to": WALLET, "value": "1", "gasUsed": "21000", "gasPrice": "1", "isError": "0"}
+    for i in range(count)
+  ]
+
+
+@pytest.fixture
+def chain(monkeypatch):
+  """Fixture that serves pages of a fake chain, which tests can extend"""
+
+  rows = make_rows(25)
+  requests = []
+
+  def fetch_page(address, page_size, start_block):
+    requests.append(start_block)
+    return TransactionBatch.from_rows([row for row in rows if int(row["blockNumber"]) >= start_block][:page_size])
+
+  monkeypatch.setattr(transaction_store, "fetch_page", fetch_page)
+  monkeypatch.setattr(transaction_store, "PAGE_SIZE", 5)
+  monkeypatch.setattr(transaction_store, "MAX_SYNC_PAGES", 2)
+  monkeypatch.setattr(transaction_store, "MAX_HISTORY_ROWS", 12)
+  return rows, requests
+
+
+def test_busy_address_is_fetched_over_several_syncs_and_trimmed(chain):
+  rows, requests = chain
+  store = TransactionStore()
+
+  # Stops at the maximum number of pages (each page leaves its last block for the next one) and says the history is partial
+  batch = store.sync(WALLET, force=True)
+  assert list(batch.block_number) == list(range(0, 8)) and len(requests) == 2
+  assert "blocks 0 to 7" in store.truncation_note(WALLET)
+
+  # Keeps only the latest rows once the history passes the maximum
+  batch = store.sync(WALLET, force=True)
+  assert list(batch.block_number) == list(range(4, 16))
+  store.sync(WALLET, force=True)
+  batch = store.sync(WALLET, force=True)
+  assert list(batch.block_number) == list(range(13, 25))
+  assert "latest 12 transactions" in store.truncation_note(WALLET)
+
+
+def test_histories_are_evicted(chain, monkeypatch):
+  monkeypatch.setattr(transaction_store, "MAX_STORED_ADDRESSES", 2)
+  store = TransactionStore()
+  wallets = ["0x" + f"{i:02x}" * 20 for i in range(1, 4)]
+
+  for wallet in wallets:
+    store.sync(wallet, force=True)
+
+  # Keeps only the most recently used histories
+  assert set(store.batches) == {addresses.normalize(wallet) for wallet in wallets[1:]}
+  assert set(store.synced_at) == set(store.batches) == set(store.last_blocks) == set(store.used_at)
+
+  # Drops the histories past their time to live
+  monkeypatch.setattr(transaction_store, "STORED_HISTORY_TTL", -1)
+  store.evict()
+  assert not store.batches and not store.synced_at and not store.last_blocks
+
+
+def test_counterparties_are_not_counted_twice_after_eviction(chain, monkeypatch):
+  monkeypatch.setattr(transaction_store, "MAX_SYNC_PAGES", 100)
+  monkeypatch.setattr(transaction_store, "MAX_HISTORY_ROWS", 100)
+  store = TransactionStore()
+  indexes = counterparty_index.CounterpartyIndexes(store)
+
+  assert indexes.top(WALLET, 1)[0][1].count == 25
+
+  # Evicts the history, which is fetched again in full
+  monkeypatch.setattr(transaction_store, "STORED_HISTORY_TTL", -1)
+  store.evict()
+  monkeypatch.setattr(transaction_store, "STORED_HISTORY_TTL", 3600)
+  assert indexes.top(WALLET, 1)[0][1].count == 25
@@ -0,0 +1,107 @@
+# Tests that streamed txlist responses parse the same as the whole body, however the chunks are cut
+
+import json, random
+import pytest
+import etherscan_api, txlist_stream
+from transaction_store import TransactionBatch
+
+
+def make_body(count):
+  """Function to create a txlist response body with a number of rows, including strings with escapes and brackets"""
+  rows = [
+    {"blockNumber": str(100 + i), "timeStamp": str(1600000000 + i), "hash": f"0x{i:064x}", "from": "0x" + "11" * 20, "to": "0x" + "22" * 20 if i % 4 else "",
+     "value": str(10**20 * i), "gasUsed": "21000", "gasPrice": str(10**9), "isError": "1" if i % 5 == 0 else "0", "functionName": 'transfer(address to, uint256 ["x"], string \\ note)',
+     "input": "0x" + "ab" * (i % 7)}
+    for i in range(count)
+  ]
+  return json.dumps({"status": "1", "message": "OK", "result": rows}, indent=1).encode(), rows
+
+
+def cut(body, sizes):
+  """Function to cut a body into chunks of the given sizes, repeated until the body ends"""
+  chunks, start, index = [], 0, 0
+  while start < len(body):
+    chunks.append(body[start : start + sizes[index % len(sizes)]])
+    start += sizes[index % len(sizes)]
+    index += 1
+  return chunks
+
+
+def parse(chunks):
+  return txlist_stream.parse_txlist(chunks, TransactionBatch.from_rows, TransactionBatch.join)
+
+
+@pytest.mark.parametrize("sizes", [[1], [2, 3], [7, 1, 13], [64], [10**6]])
+def test_columns_match_the_whole_body(sizes, monkeypatch):
+
+  # Decodes the rows a few at a time, so blocks end in the middle of the array
+  monkeypatch.setattr(txlist_stream, "BYTES_PER_BLOCK", 500)
+  body, rows = make_body(40)
+
+  response = parse(cut(body, sizes))
+  expected = TransactionBatch.from_rows(json.loads(body)["result"])
+
+  # Checks the fields before the result and every column
+  assert (response["status"], response["message"]) == ("1", "OK")
+  for column in TransactionBatch.columns:
+    if column == "value":
+      assert response["result"].value.to_ints() == expected.value.to_ints()
+    else:
+      assert list(getattr(response["result"], column)) == list(getattr(expected, column))
+
+
+def test_random_cuts():
+  random.seed(3)
+  body, rows = make_body(25)
+  for _ in range(50):
+    response = parse(cut(body, [random.randint(1, 40) for _ in range(20)]))
+    assert list(response["result"].hash) == [row["hash"] for row in rows]
+
+
+@pytest.mark.parametrize("sizes", [[1], [5], [1000]])
+def test_error_message_result(sizes):
+  body = b'{"status":"0","message":"NOTOK","result":"Max rate limit reached"}'
+  assert parse(cut(body, sizes)) == json.loads(body)
+
+
+@pytest.mark.parametrize("body", [b'{"status":"0","message":"No transactions found","result":[]}', b'{"status":"0","message":"No transactions found","result": [ ]\n}'])
+def test_empty_result(body):
+  for sizes in ([1], [3], [1000]):
+    response = parse(cut(body, sizes))
+    assert response["message"] == "No transactions found"
+    assert len(response["result"]) == 0
+
+
+def test_truncated_body_is_an_error():
+  body, _ = make_body(5)
+  with pytest.raises(ValueError):
+    parse(cut(body[:-40], [16]))
+
+
+def test_normal_transactions_are_parsed_from_the_stream(monkeypatch):
+  body, rows = make_body(12)
+
+  class Response:
+    def __enter__(self):
+      return self
+    def __exit__(self, *args):
+      return False
+    def iter_bytes(self):
+      return iter(cut(body, [9]))
+
+  class Client:
+    def get(self, url):
+      pytest.fail("The body was read whole")
+    def stream(self, method, url):
+      return Response()
+
+  monkeypatch.setattr(etherscan_api.httpx_client, "get_client", lambda: Client())
+  monkeypatch.setattr(etherscan_api.key_pool.etherscan, "acquire", lambda: "key")
+  monkeypatch.setattr(etherscan_api.key_pool.etherscan, "report_success", lambda key: None)
+
+  transactions = etherscan_api.get_normal_transactions("0x" + "11" * 20, 100)
+
+  # Checks the transactions have the fields of the rows, with the addresses normalized
+  assert [transaction.hash for transaction in transactions] == [row["hash"] for row in rows]
+  assert [transaction.functionName for transaction in transactions] == [row["functionName"] for row in rows]
+  assert transactions[1].__dict__["from"] == etherscan_api.addresses.normalize(rows[1]["from"])
@@ -0,0 +1,206 @@
+# Tests of the watcher, with Etherscan and the database replaced by fixed data
+
+import sys, time, types
+import pytest
+import watcher, etherscan_api
+from rate_limiter import TokenBucket
+
+
+ADDRESSES = ["0x" + f"{i:02x}" * 20 for i in range(1, 4)]
+
+
+class FakeDb(dict):
+  """Class that stands in for the Replit database, counting the writes"""
+
+  def __init__(self):
+    super().__init__()
+    self.writes = []
+
+  def __setitem__(self, key, value):
+    self.writes.append(key)
+    super().__setitem__(key, value)
+
+  def prefix(self, prefix):
+    return [key for key in self if key.startswith(prefix)]
+
+
+class FakeEtherscan:
+  """Class that answers the balance and txlist requests of the watcher from fixed data, recording every request"""
+
+  def __init__(self, monkeypatch):
+    self.balances = {address: 10**18 for address in ADDRESSES}
+    self.transactions = {address: [] for address in ADDRESSES}
+    self.balance_requests = []
+    self.txlist_requests = []
+    monkeypatch.setattr(etherscan_api, "get_wei_balances", self.get_wei_balances)
+    monkeypatch.setattr(etherscan_api, "get_normal_transactions", self.get_normal_transactions)
+
+  def get_wei_balances(self, address_list):
+    self.balance_requests.append(list(address_list))
+    return {address: self.balances[address] for address in address_list}
+
+  def get_normal_transactions(self, address, number_of_results=100, start_block=0, sort="desc", end_block=99999999):
+    self.txlist_requests.append((address, start_block))
+    transactions = [transaction for transaction in self.transactions[address] if int(transaction.blockNumber) >= start_block]
+    return transactions[:number_of_results] if sort == "asc" else transactions[::-1][:number_of_results]
+
+  def add_transaction(self, address, block_number, value=0):
+    """Function to add a transaction to the history of an address, changing its balance by the value"""
+    self.transactions[address].append(etherscan_api.Transaction(hash=f"0x{block_number:064x}", blockNumber=str(block_number), value=str(value)))
+    self.balances[address] += value
+
+
+@pytest.fixture
+def etherscan(monkeypatch):
+  return FakeEtherscan(monkeypatch)
+
+
+@pytest.fixture
+def db(monkeypatch):
+  db = FakeDb()
+  monkeypatch.setitem(sys.modules, "replit", types.SimpleNamespace(db=db))
+  return db
+
+
+@pytest.fixture
+def watch(etherscan, db):
+  """Function to create a watcher without a rate limit, with a notifier recording the alerts"""
+  watch = watcher.Watcher()
+  watch.limiter = TokenBucket(1000, 1000)
+  watch.alerts = []
+  watch.add_notifier("telegram", lambda chat_id, address, transactions: watch.alerts.append(("telegram", chat_id, address, [transaction.hash for transaction in transactions])))
+  watch.add_notifier("discord", lambda chat_id, address, transactions: watch.alerts.append(("discord", chat_id, address, [transaction.hash for transaction in transactions])))
+  return watch
+
+
+def test_subscription_starts_after_the_latest_block(watch, etherscan):
+  etherscan.add_transaction(ADDRESSES[0], 100)
+
+  watch.subscribe(ADDRESSES[0], "telegram", 1)
+
+  assert watch.watched[ADDRESSES[0]].last_seen_block == 100
+
+
+def test_due_addresses_are_grouped_by_the_window(watch, etherscan):
+  for address in ADDRESSES:
+    watch.subscribe(address, "telegram", 1)
+
+  # Moves the last address past the grouping window
+  now = time.time()
+  for address, delay in zip(ADDRESSES, (0, watcher.GROUPING_WINDOW / 2, watcher.GROUPING_WINDOW * 4)):
+    watch.watched[address].next_poll = now + delay
+    watch.schedule.append((now + delay, address))
+  watch.schedule.sort()
+
+  # Checks the addresses due within the window are taken together, and the later one is left on the schedule
+  assert [watched_address.address for watched_address in watch.take_due_addresses()] == ADDRESSES[:2]
+  assert watch.take_due_addresses() == []
+
+
+def test_new_transactions_are_fetched_after_the_last_seen_block_and_sent_to_every_subscriber(watch, etherscan):
+  address = ADDRESSES[0]
+  etherscan.add_transaction(address, 100)
+  watch.subscribe(address, "telegram", 1)
+  watch.subscribe(address, "discord", 2)
+  watched_address = watch.watched[address]
+
+  # Polls once to learn the balance, which finds nothing new
+  watch.poll_group([watched_address])
+  assert etherscan.txlist_requests[-1] == (address, 101)
+  assert watch.alerts == []
+
+  # Adds two transactions and polls again
+  etherscan.add_transaction(address, 105, 5)
+  etherscan.add_transaction(address, 107, 7)
+  watch.poll_group([watched_address])
+
+  # Checks only the blocks after the last seen block are asked for, and both subscribers get both transactions
+  assert etherscan.txlist_requests[-1] == (address, 101)
+  assert watched_address.last_seen_block == 107
+  assert sorted(watch.alerts) == [("discord", "2", address, [f"0x{105:064x}", f"0x{107:064x}"]), ("telegram", "1", address, [f"0x{105:064x}", f"0x{107:064x}"])]
+
+
+def test_interval_grows_while_idle_and_shrinks_with_activity(watch, etherscan):
+  address = ADDRESSES[0]
+  watch.subscribe(address, "telegram", 1)
+  watched_address = watch.watched[address]
+
+  # Grows the interval with every idle poll, up to the maximum
+  intervals = []
+  for _ in range(30):
+    watch.poll_group([watched_address])
+    intervals.append(watched_address.interval)
+  assert intervals[0] > watcher.MIN_INTERVAL
+  assert intervals == sorted(intervals)
+  assert intervals[-1] == watcher.MAX_INTERVAL
+
+  # Halves it when there is a new transaction
+  etherscan.add_transaction(address, 200, 1)
+  watch.poll_group([watched_address])
+  assert watched_address.interval == watcher.MAX_INTERVAL / 2
+
+
+def test_balance_changes_are_compared_exactly(watch, etherscan):
+  address = ADDRESSES[0]
+  watch.subscribe(address, "telegram", 1)
+  watched_address = watch.watched[address]
+  watch.poll_group([watched_address])
+
+  # Adds a transaction of one wei, which an Ether float of a balance of one Ether does not show
+  etherscan.add_transaction(address, 300, 1)
+  watch.poll_group([watched_address])
+
+  assert watch.alerts == [("telegram", "1", address, [f"0x{300:064x}"])]
+
+
+def test_transactions_that_keep_the_balance_are_found_by_the_periodic_check(watch, etherscan):
+  address = ADDRESSES[0]
+  watch.subscribe(address, "telegram", 1)
+  watched_address = watch.watched[address]
+  watch.poll_group([watched_address])
+  requests = len(etherscan.txlist_requests)
+
+  # Adds a transaction without value, which leaves the balance unchanged
+  etherscan.add_transaction(address, 400)
+
+  # Checks the transactions are not fetched while the balance is unchanged, until the periodic check
+  for _ in range(watcher.FULL_CHECK_POLLS - 1):
+    watch.poll_group([watched_address])
+  assert len(etherscan.txlist_requests) == requests
+  assert watch.alerts == []
+
+  watch.poll_group([watched_address])
+  assert watch.alerts == [("telegram", "1", address, [f"0x{400:064x}"])]
+
+
+def test_only_changed_addresses_are_saved(watch, etherscan, db):
+  for address in ADDRESSES:
+    watch.subscribe(address, "telegram", 1)
+  db.writes.clear()
+
+  # Polls every address with a new transaction for one of them
+  etherscan.add_transaction(ADDRESSES[1], 500, 1)
+  watch.poll_group([watch.watched[address] for address in ADDRESSES])
+  watch.save()
+
+  # Checks only the changed address is written, under its own key
+  assert db.writes == [watcher.DB_PREFIX + ADDRESSES[1]]
+  assert db[watcher.DB_PREFIX + ADDRESSES[1]]["last_seen_block"] == 500
+
+  # Unsubscribes the last chat of an address, which deletes its key
+  watch.unsubscribe(ADDRESSES[2], "telegram", 1)
+  assert watcher.DB_PREFIX + ADDRESSES[2] not in db
+
+
+def test_saved_subscriptions_are_loaded(etherscan, db):
+
+  # Saves subscriptions the way earlier versions did, under one key
+  db["watches"] = {ADDRESSES[0]: {"last_seen_block": 10, "subscribers": ["telegram 1", "discord 2"]}}
+
+  watch = watcher.Watcher()
+  watch.load()
+
+  # Checks the subscriptions are loaded and moved to a key per address
+  assert watch.watched[ADDRESSES[0]].subscribers == {("telegram", "1"), ("discord", "2")}
+  assert watch.watched[ADDRESSES[0]].last_seen_block == 10
+  assert "watches" not in db and watcher.DB_PREFIX + ADDRESSES[0] in db
@@ -0,0 +1,213 @@
+# Module to build running balance and cash flow time series from the stored transaction history
+
+import pytz
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from transaction_store import TransactionBatch
+import addresses, local_time
+from wei import WEI_PER_ETHER
+
+
+# The resolutions the time series can be resampled to
+RESOLUTIONS = ("day", "week", "month")
+
+
+def bucket_start(local: datetime, resolution: str) -> datetime:
+  """Function to get the start of the bucket (day, week or month) containing a local time, without the timezone"""
+
+  # Gets the start of the day
+  start = datetime(local.year, local.month, local.day)
+
+  # Checks if the resolution is weekly
+  if resolution == "week":
+
+    # Goes back to the Monday of the week
+    start -= timedelta(days=start.weekday())
+
+  # Checks if the resolution is monthly
+  elif resolution == "month":
+
+    # Goes back to the first day of the month
+    start = start.replace(day=1)
+
+  # Returns the start of the bucket
+  return start
+
+
+def next_bucket_start(start: datetime, resolution: str) -> datetime:
+  """Function to get the start of the bucket after the one starting at the given time"""
+
+  # Checks if the resolution is monthly
+  if resolution == "month":
+
+    # Returns the first day of the next month
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+  # Returns the start of the next day or week
+  return start + timedelta(days=7 if resolution == "week" else 1)
+
+
+def shift_months(start: datetime, months: int) -> datetime:
+  """Function to move the first day of a month back by a number of months"""
+
+  # Gets the month index counting from year 0
+  index = start.year * 12 + start.month - 1 - months
+
+  # Returns the first day of the month
+  return start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def to_timestamp(local: datetime, timezone: pytz.timezone) -> int:
+  """Function to turn a local time without a timezone into a unix timestamp"""
+
+  # Converts the time with the cached offsets of the timezone, picking standard time if it is ambiguous or missing because of daylight saving
+  return local_time.to_timestamp(local, timezone)
+
+
+def bucket_boundaries(resolution: str, timezone: pytz.timezone, start_time: int, end_time: int) -> Tuple[List[datetime], List[int]]:
+  """Function to get the local start times and unix timestamps of every bucket boundary between two timestamps"""
+
+  # Gets the start of the first bucket
+  start = bucket_start(local_time.to_local(start_time, timezone), resolution)
+
+  # The lists of bucket starts and their timestamps
+  starts: List[datetime] = []
+  boundaries: List[int] = []
+
+  # Adds the buckets until the end time is passed
+  while True:
+    boundary = to_timestamp(start, timezone)
+    starts.append(start)
+    boundaries.append(boundary)
+
+    # Stops after adding the boundary that closes the last bucket
+    if boundary >= end_time:
+      break
+
+    start = next_bucket_start(start, resolution)
+
+  # Returns the bucket starts and boundaries
+  return starts, boundaries
+
+
+class ResampledSeries:
+  """Class that represents the cash flow of a wallet per bucket (day, week or month)"""
+
+  def __init__(self, starts: List[datetime], inflow, outflow, gas, balance) -> None:
+
+    # The local start time of each bucket
+    self.starts = starts
+
+    # The Ether received, sent and spent on gas in each bucket
+    self.inflow = inflow
+    self.outflow = outflow
+    self.gas = gas
+
+    # The net change in Ether in each bucket, after paying for gas
+    self.net = inflow - outflow - gas
+
+    # The balance at the end of each bucket (from normal transactions only)
+    self.balance = balance
+
+
+  def __len__(self) -> int:
+    return len(self.starts)
+
+
+class CashFlowSeries:
+  """Class that holds the cumulative inflow, outflow and gas of a wallet, so any window can be summed in O(log n)"""
+
+  def __init__(self, batch: TransactionBatch, address: str) -> None:
+
+    # Normalizes the address into its 20-byte value
+    address = addresses.normalize(address)
+
+    # Gets the direction of every transaction
+    incoming = batch.receiver == address
+    outgoing = batch.sender == address
+
+    # Failed transactions do not move any Ether, but the sender still pays for gas
+    succeeded = ~batch.is_error
+
+    # The timestamps of the transactions
+    self.timestamps = batch.timestamp
+
+    # The exact cumulative sums in wei of the inflow, outflow and gas spent, starting with 0 so that the sum of rows i to j is cum[j] - cum[i]
+    self.cum_inflow = batch.value.where(incoming & succeeded).cumsum()
+    self.cum_outflow = batch.value.where(outgoing & succeeded).cumsum()
+    self.cum_gas = batch.fees().where(outgoing).cumsum()
+
+    # The running balance after every transaction
+    self.balance = self.cum_inflow - self.cum_outflow - self.cum_gas
+
+
+  def index(self, time: Optional[int]) -> int:
+    """Function to get the number of transactions before a timestamp using binary search"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Returns the index (all the transactions if there is no time)
+    return len(self.timestamps) if time is None else int(numpy.searchsorted(self.timestamps, time, "left"))
+
+
+  def totals(self, start_time: Optional[int] = None, end_time: Optional[int] = None) -> Tuple[float, float, float]:
+    """Function to get the inflow, outflow and gas spent with start_time <= timestamp < end_time"""
+
+    # Gets the rows of the window
+    start = 0 if start_time is None else self.index(start_time)
+    end = self.index(end_time)
+
+    # Returns the exact sums of the window in Ether
+    return (
+      (self.cum_inflow[end] - self.cum_inflow[start]).sum() / WEI_PER_ETHER,
+      (self.cum_outflow[end] - self.cum_outflow[start]).sum() / WEI_PER_ETHER,
+      (self.cum_gas[end] - self.cum_gas[start]).sum() / WEI_PER_ETHER
+    )
+
+
+  def balance_at(self, time: int) -> float:
+    """Function to get the running balance in Ether just before a timestamp"""
+    return self.balance[self.index(time)].sum() / WEI_PER_ETHER
+
+
+  def resample(self, resolution: str, timezone: pytz.timezone, start_time: Optional[int] = None, end_time: Optional[int] = None) -> ResampledSeries:
+    """Function to get the cash flow per day, week or month between two timestamps"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Checks if the resolution is valid
+    if resolution not in RESOLUTIONS:
+      raise ValueError(f"Invalid resolution {resolution!r}, expected one of {', '.join(RESOLUTIONS)}")
+
+    # Starts from the first transaction and ends now if no window is given
+    if start_time is None:
+      start_time = int(self.timestamps[0]) if len(self.timestamps) else int(datetime.now().timestamp())
+    if end_time is None:
+      end_time = int(datetime.now().timestamp())
+
+    # Gets the bucket boundaries
+    starts, boundaries = bucket_boundaries(resolution, timezone, start_time, end_time)
+
+    # Finds the row of every boundary with one vectorized binary search
+    indices = numpy.searchsorted(self.timestamps, boundaries, "left")
+
+    # Returns the sums of every bucket in Ether as exact differences of the cumulative sums
+    return ResampledSeries(
+      starts[:-1],
+      (self.cum_inflow[indices[1:]] - self.cum_inflow[indices[:-1]]).to_ether(),
+      (self.cum_outflow[indices[1:]] - self.cum_outflow[indices[:-1]]).to_ether(),
+      (self.cum_gas[indices[1:]] - self.cum_gas[indices[:-1]]).to_ether(),
+      self.balance[indices[1:]].to_ether()
+    )
+
+
+def month_window(months: int, timezone: pytz.timezone) -> Tuple[int, int]:
+  """Function to get the timestamps of the start of the month n months ago and the start of the current month"""
+
+  # Gets the start of the current month in the timezone
+  current_month = bucket_start(local_time.now(timezone), "month")
+
+  # Returns the start of the first month and the start of the current month
+  return to_timestamp(shift_months(current_month, months), timezone), to_timestamp(current_month, timezone)
@@ -0,0 +1,126 @@
+# Module that builds the paged inline keyboards used to pick a timezone, cached in their serialized form
+
+import bisect, functools
+from typing import Dict, List, Tuple
+import pytz
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+
+# The prefix of the callback data of the picker's buttons
+CALLBACK_PREFIX = "tz:"
+
+# The number of timezones shown on one page, and the number of buttons in a row
+PAGE_SIZE = 8
+ROW_WIDTH = 2
+
+# The region of the timezones without a region, like UTC
+OTHER_REGION = "Other"
+
+# The longest search prefix kept, so the callback data stays under Telegram's limit of 64 bytes
+MAX_QUERY_LENGTH = 32
+
+
+def get_region(timezone: str) -> str:
+  """Function to get the region of a timezone, which is the part before the first slash"""
+  return timezone.split("/", 1)[0] if "/" in timezone else OTHER_REGION
+
+
+@functools.lru_cache(maxsize=None)
+def get_regions() -> Dict[str, List[str]]:
+  """Function to group the common timezones by region"""
+
+  # The dictionary that maps the region to its timezones
+  regions: Dict[str, List[str]] = {}
+
+  # Adds every common timezone to its region
+  for timezone in pytz.common_timezones:
+    regions.setdefault(get_region(timezone), []).append(timezone)
+
+  # Returns the regions
+  return regions
+
+
+@functools.lru_cache(maxsize=None)
+def get_search_index() -> Tuple[List[str], List[str]]:
+  """Function to get the sorted lowercase search keys and the timezone of each key
+
+  Every timezone is found by its full name and by its city, so "sing" finds Asia/Singapore.
+  """
+
+  # Gets the (key, timezone) pairs
+  entries = set()
+  for timezone in pytz.all_timezones:
+    entries.add((timezone.lower().replace("_", " "), timezone))
+    entries.add((timezone.rsplit("/", 1)[-1].lower().replace("_", " "), timezone))
+
+  # Returns the keys and the timezones sorted by key
+  entries = sorted(entries)
+  return [key for key, _ in entries], [timezone for _, timezone in entries]
+
+
+def normalize_query(query: str) -> str:
+  """Function to normalize a search the same way as the keys, keeping only ASCII so it fits in the callback data"""
+  return query.encode("ascii", "ignore").decode().strip().lower().replace("_", " ")[:MAX_QUERY_LENGTH]
+
+
+def search(query: str) -> List[str]:
+  """Function to get the timezones with a name or city starting with the query, in O(log n + matches)"""
+
+  # Gets the index
+  keys, timezones = get_search_index()
+
+  # Normalizes the query
+  query = normalize_query(query)
+
+  # Finds the range of keys starting with the query
+  start = bisect.bisect_left(keys, query)
+  end = bisect.bisect_left(keys, query + "\uffff")
+
+  # Returns the matching timezones without duplicates, keeping the order of the keys
+  return list(dict.fromkeys(timezones[start:end]))
+
+
+def page_keyboard(timezones: List[str], page: int, callback: str) -> InlineKeyboardMarkup:
+  """Function to create the keyboard of one page of timezones with buttons to the other pages"""
+
+  # Creates the keyboard
+  keyboard = InlineKeyboardMarkup(row_width=ROW_WIDTH)
+
+  # Adds the timezones on the page
+  keyboard.add(*[
+    InlineKeyboardButton(timezone, callback_data=f"{CALLBACK_PREFIX}s:{timezone}")
+    for timezone in timezones[page * PAGE_SIZE : (page + 1) * PAGE_SIZE]
+  ])
+
+  # Adds the buttons to the previous and next pages and back to the regions
+  navigation = [InlineKeyboardButton("« Regions", callback_data=f"{CALLBACK_PREFIX}r")]
+  if page > 0:
+    navigation.append(InlineKeyboardButton("‹ Prev", callback_data=f"{callback}:{page - 1}"))
+  if (page + 1) * PAGE_SIZE < len(timezones):
+    navigation.append(InlineKeyboardButton("Next ›", callback_data=f"{callback}:{page + 1}"))
+  keyboard.row(*navigation)
+
+  # Returns the keyboard
+  return keyboard
+
+
+@functools.lru_cache(maxsize=None)
+def regions_keyboard() -> str:
+  """Function to get the serialized keyboard listing the regions"""
+
+  keyboard = InlineKeyboardMarkup(row_width=3)
+  keyboard.add(*[InlineKeyboardButton(region, callback_data=f"{CALLBACK_PREFIX}r:{region}:0") for region in get_regions()])
+  return keyboard.to_json()
+
+
+@functools.lru_cache(maxsize=256)
+def region_keyboard(region: str, page: int) -> str:
+  """Function to get the serialized keyboard of one page of the timezones in a region"""
+  return page_keyboard(get_regions().get(region, []), page, f"{CALLBACK_PREFIX}r:{region}").to_json()
+
+
+@functools.lru_cache(maxsize=1024)
+def search_keyboard(query: str, page: int) -> str:
+  """Function to get the serialized keyboard of one page of the timezones matching a search"""
+  query = normalize_query(query)
+  return page_keyboard(search(query), page, f"{CALLBACK_PREFIX}q:{query}").to_json()
@@ -0,0 +1,67 @@
+# Module that saves the timezone of every chat or channel in the Replit database, shared by both bots
+
+import pytz
+from typing import Union
+
+
+def get_db():
+  """Function to get the Replit database, importing it on first use"""
+
+  # Imports the database here because connecting to it slows down startup
+  from replit import db
+
+  # Returns the database
+  return db
+
+
+def save_timezone_to_db(chat_id: Union[int, str], timezone: str) -> None:
+  """Function to save the timezone to the database if it's not inside"""
+
+  # The flag to signify the chat ID is in the database
+  in_db = False
+  
+  # Gets the database
+  db = get_db()
+
+  # The list of saved timezones
+  saved_tzs = db.get("timezones", [])
+
+  # Iterates the saved timezones in the database
+  for index, saved_tz in enumerate(saved_tzs):
+
+    # Checks if the saved timezone is the one of the chat
+    if saved_tz.split(" ", 1)[0] == str(chat_id):
+
+      # Edits the saved timezone
+      saved_tzs[index] = f"{chat_id} {timezone}"
+
+      # Sets the flag to True
+      in_db = True
+
+      # Breaks the loop
+      break
+
+  # Checks if the timezone is not in the database
+  if not in_db:
+
+    # Appends to the list of saved timezones
+    saved_tzs.append(f"{chat_id} {timezone}")
+
+  # Assigns the edited saved timezone list to the database one
+  db["timezones"] = saved_tzs
+
+
+def get_timezone_from_db(chat_id: Union[str, int]) -> pytz.timezone:
+  """Function to get the timezone from the database"""
+
+  # Gets the filtered list of the saved timezone
+  saved_tz = [tz for tz in get_db().get("timezones", []) if tz.split(" ", 1)[0] == str(chat_id)]
+
+  # Checks if the list is not empty
+  if saved_tz:
+
+    # Returns the timezone
+    return pytz.timezone(saved_tz[0].split()[1])
+
+  # Returns UTC otherwise
+  return pytz.timezone("UTC")
@@ -0,0 +1,559 @@
+# Module that keeps the transaction history of wallets in memory as columns of numpy arrays
+
+import os, heapq, json, logging, struct, threading, time, zlib
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import etherscan_api, addresses, circuit_breaker, single_flight, txlist_stream, cache
+from wei import WeiArray
+from etherscan_api import Transaction
+
+
+# The maximum number of transactions Etherscan returns in one page
+PAGE_SIZE = 10000
+
+# The number of seconds a synced history is used before checking for new transactions
+SYNC_INTERVAL = 30.0
+
+# The number of seconds a history is kept in the shared cache after its last sync
+SHARED_HISTORY_TTL = 86400.0
+
+# The maximum number of histories kept in memory, after which the least recently used are evicted
+MAX_STORED_ADDRESSES = int(os.environ.get("MAX_STORED_ADDRESSES", 500))
+
+# The number of seconds a history is kept in memory after it was last used
+STORED_HISTORY_TTL = float(os.environ.get("STORED_HISTORY_TTL", 6 * 3600))
+
+# The maximum number of transactions kept per address, after which the oldest are dropped
+MAX_HISTORY_ROWS = int(os.environ.get("MAX_HISTORY_ROWS", 200000))
+
+# The maximum number of pages fetched in one sync, so a busy address is fetched over several syncs
+MAX_SYNC_PAGES = max(1, MAX_HISTORY_ROWS // PAGE_SIZE)
+
+
+class TransactionBatch:
+  """Class that represents a list of transactions stored as columns, sorted by timestamp"""
+
+  # The names of the columns
+  columns = ("hash", "block_number", "timestamp", "sender", "receiver", "value", "gas_used", "gas_price", "is_error")
+
+  def __init__(self, **columns) -> None:
+    self.__dict__.update(columns)
+
+
+  def __len__(self) -> int:
+    return len(self.timestamp)
+
+
+  @classmethod
+  def empty(cls) -> "TransactionBatch":
+    """Function to create a batch without transactions"""
+    return cls.from_transactions([])
+
+
+  @classmethod
+  def from_transactions(cls, transactions: List[Transaction]) -> "TransactionBatch":
+    """Function to create a batch from a list of transactions returned by the txlist action"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Returns the batch with one column per field
+    return cls(
+      hash = numpy.array([transaction.hash for transaction in transactions], dtype="<U66"),
+      block_number = numpy.array([transaction.blockNumber for transaction in transactions], dtype=numpy.int64),
+      timestamp = numpy.array([transaction.timeStamp for transaction in transactions], dtype=numpy.int64),
+
+      # The addresses are stored as their 20-byte values, which numpy compares as fixed-width bytes
+      sender = numpy.array([transaction.__dict__["from"] for transaction in transactions], dtype="S20"),
+      receiver = numpy.array([transaction.to for transaction in transactions], dtype="S20"),
+
+      # Wei values can be bigger than 2^64, so they are split into limbs that can be summed exactly
+      value = WeiArray.from_values(transaction.value for transaction in transactions),
+      gas_used = numpy.array([transaction.gasUsed for transaction in transactions], dtype=numpy.uint64),
+      gas_price = numpy.array([transaction.gasPrice for transaction in transactions], dtype=numpy.uint64),
+      is_error = numpy.array([transaction.isError == "1" for transaction in transactions], dtype=bool)
+    )
+
+
+  @classmethod
+  def from_rows(cls, rows: List[Dict[str, str]]) -> "TransactionBatch":
+    """Function to create a batch from the raw rows of a txlist response, decoding the addresses in one vectorized pass"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Returns the batch with one column per field
+    return cls(
+      hash = numpy.array([row["hash"] for row in rows], dtype="<U66"),
+      block_number = numpy.array([row["blockNumber"] for row in rows], dtype=numpy.int64),
+      timestamp = numpy.array([row["timeStamp"] for row in rows], dtype=numpy.int64),
+      sender = addresses.normalize_array([row["from"] for row in rows]),
+      receiver = addresses.normalize_array([row["to"] for row in rows]),
+      value = WeiArray.from_values(row["value"] for row in rows),
+      gas_used = numpy.array([row["gasUsed"] for row in rows], dtype=numpy.uint64),
+      gas_price = numpy.array([row["gasPrice"] for row in rows], dtype=numpy.uint64),
+      is_error = numpy.array([row["isError"] == "1" for row in rows], dtype=bool)
+    )
+
+
+  @classmethod
+  def join(cls, batches: List["TransactionBatch"]) -> "TransactionBatch":
+    """Function to join a list of batches into one batch"""
+
+    # Returns an empty batch if there are no batches
+    if not batches:
+      return cls.empty()
+
+    # Joins the batches one after the other
+    batch = batches[0]
+    for other in batches[1:]:
+      batch = batch.concatenate(other)
+
+    return batch
+
+
+  def concatenate(self, other: "TransactionBatch") -> "TransactionBatch":
+    """Function to create a batch with the transactions of this batch followed by the other batch"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Returns the joined batch
+    return TransactionBatch(**{
+      column: getattr(self, column).concatenate(getattr(other, column)) if isinstance(getattr(self, column), WeiArray) else numpy.concatenate((getattr(self, column), getattr(other, column)))
+      for column in self.columns
+    })
+
+
+  def last_block(self) -> int:
+    """Function to get the block of the last transaction, or -1 if there are none, which with the length tells histories apart even after their oldest rows are dropped"""
+    return int(self.block_number[-1]) if len(self) else -1
+
+
+  def slice(self, start: int, end: int) -> "TransactionBatch":
+    """Function to get the rows from start to end as a new batch (the arrays are views, not copies)"""
+    return TransactionBatch(**{column: getattr(self, column)[start:end] for column in self.columns})
+
+
+  def window(self, start_time: Optional[int] = None, end_time: Optional[int] = None) -> "TransactionBatch":
+    """Function to get the transactions with start_time <= timestamp < end_time using binary search"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Finds the first and last rows of the window
+    start = 0 if start_time is None else int(numpy.searchsorted(self.timestamp, start_time, "left"))
+    end = len(self) if end_time is None else int(numpy.searchsorted(self.timestamp, end_time, "left"))
+
+    # Returns the window
+    return self.slice(start, end)
+
+
+  def to_bytes(self) -> bytes:
+    """Function to encode the batch compactly as its raw columns, compressed, for the shared cache"""
+
+    # Gets the arrays of the columns, with the hashes as ASCII (a quarter of the size of the unicode column)
+    arrays = {column: getattr(self, column) for column in self.columns}
+    arrays["hash"] = arrays["hash"].astype("S66")
+    arrays["value"] = arrays["value"].limbs
+
+    # Describes the type and shape of every array in a header
+    header = json.dumps([[column, array.dtype.str, array.shape] for column, array in arrays.items()]).encode()
+
+    # Returns the header and the raw bytes of the arrays, compressed
+    return zlib.compress(struct.pack("<I", len(header)) + header + b"".join(array.tobytes() for array in arrays.values()), 1)
+
+
+  @classmethod
+  def from_bytes(cls, data: bytes) -> "TransactionBatch":
+    """Function to decode a batch encoded with to_bytes"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Gets the header
+    data = zlib.decompress(data)
+    header_length, = struct.unpack_from("<I", data)
+    offset = 4 + header_length
+
+    # Reads every array from the raw bytes after the header
+    arrays = {}
+    for column, dtype, shape in json.loads(data[4:offset]):
+      array = numpy.frombuffer(data, dtype=dtype, count=int(numpy.prod(shape)), offset=offset).reshape(shape)
+      offset += array.nbytes
+      arrays[column] = array
+
+    # Returns the batch with the columns turned back into their usual types
+    arrays["hash"] = arrays["hash"].astype("<U66")
+    arrays["value"] = WeiArray(arrays["value"])
+    return cls(**arrays)
+
+
+  def fees(self) -> WeiArray:
+    """Function to get the exact gas fee (gasUsed x gasPrice) of every transaction in wei"""
+    return WeiArray.from_product(self.gas_used, self.gas_price)
+
+
+  def to_transactions(self) -> List[Transaction]:
+    """Function to turn the rows back into transaction objects"""
+
+    # Gets the exact values as python integers
+    values = self.value.to_ints()
+
+    return [
+      Transaction(**{
+        "hash": self.hash[i],
+        "blockNumber": str(self.block_number[i]),
+        "timeStamp": str(self.timestamp[i]),
+        "from": addresses.intern(self.sender[i]),
+        "to": addresses.intern(self.receiver[i]),
+        "value": str(values[i]),
+        "gasUsed": str(self.gas_used[i]),
+        "gasPrice": str(self.gas_price[i]),
+        "isError": "1" if self.is_error[i] else "0"
+      })
+      for i in range(len(self))
+    ]
+
+
+@single_flight.coalesced
+def fetch_page(address: str, page_size: int, start_block: int) -> TransactionBatch:
+  """Function to fetch a page of transactions from the start block, oldest first, streaming the response straight into columns"""
+
+  # Gets the json from the API, with the result parsed block by block into a batch
+  json_response = etherscan_api.request_json(
+    etherscan_api.get_txlist_request(address, page_size, start_block, "asc"),
+    lambda chunks: txlist_stream.parse_txlist(chunks, TransactionBatch.from_rows, TransactionBatch.join)
+  )
+
+  # Returns the batch (an empty batch if the result is an error message)
+  result = json_response.get("result")
+  return result if isinstance(result, TransactionBatch) else TransactionBatch.empty()
+
+
+class TransactionStore:
+  """Class that keeps the full transaction history of wallets, fetching only the new blocks on each sync"""
+
+  def __init__(self) -> None:
+
+    # The dictionary that maps the 20-byte address to its history
+    self.batches: Dict[bytes, TransactionBatch] = {}
+
+    # The dictionary that maps the 20-byte address to the last block synced
+    self.last_blocks: Dict[bytes, int] = {}
+
+    # The dictionary that maps the 20-byte address to the time it was last synced
+    self.synced_at: Dict[bytes, float] = {}
+
+    # The dictionary that maps the 20-byte address to the lock stopping it from syncing twice at once
+    self.locks: Dict[bytes, threading.Lock] = {}
+
+    # The lock protecting the dictionary of locks
+    self.locks_lock = threading.Lock()
+
+    # The 20-byte addresses whose history is being served without syncing because Etherscan is down
+    self.stale: Set[bytes] = set()
+
+    # The functions called with (20-byte address, new batch) whenever new transactions are synced
+    self.listeners: List[Callable[[bytes, TransactionBatch], None]] = []
+
+    # The functions called with the 20-byte address whenever its history is evicted
+    self.eviction_listeners: List[Callable[[bytes], None]] = []
+
+    # The dictionary that maps the 20-byte address to the time its history was last used
+    self.used_at: Dict[bytes, float] = {}
+
+    # The 20-byte addresses with newer transactions left to fetch, as a sync stopped at the maximum number of pages
+    self.incomplete: Set[bytes] = set()
+
+    # The 20-byte addresses whose oldest transactions were dropped to keep the maximum number of transactions
+    self.trimmed: Set[bytes] = set()
+
+
+  def add_listener(self, listener: Callable[[bytes, TransactionBatch], None]) -> None:
+    """Function to register a function to call with the new transactions of an address after each sync"""
+    self.listeners.append(listener)
+
+
+  def add_eviction_listener(self, listener: Callable[[bytes], None]) -> None:
+    """Function to register a function to call with an address whose history is evicted, so state built from it can be dropped"""
+    self.eviction_listeners.append(listener)
+
+
+  def get_lock(self, address: bytes) -> threading.Lock:
+    """Function to get the sync lock of an address"""
+
+    with self.locks_lock:
+      return self.locks.setdefault(address, threading.Lock())
+
+
+  def fetch_new_transactions(self, address: bytes, start_block: int) -> Tuple[TransactionBatch, bool]:
+    """Function to fetch the transactions of an address from the start block, page by page up to the maximum number of pages
+
+    Returns the transactions and whether they reach the latest block (False if there are more pages to fetch).
+    """
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # The pages of new transactions
+    pages: List[TransactionBatch] = []
+
+    while True:
+
+      # Stops at the maximum number of pages, leaving the rest for the next sync
+      if len(pages) >= MAX_SYNC_PAGES:
+        return TransactionBatch.join(pages), False
+
+      # Gets the page of transactions from the start block, oldest first
+      page = fetch_page(addresses.to_hex(address), PAGE_SIZE, start_block)
+
+      # Checks if this is the last page
+      if len(page) < PAGE_SIZE:
+
+        # Adds the page and stops fetching
+        pages.append(page)
+        break
+
+      # Gets the last block in the page, which may continue on the next page
+      last_block = int(page.block_number[-1])
+
+      # Checks if the whole page is in one block, which cannot be split, so the page is kept as it is
+      if last_block == start_block:
+        pages.append(page)
+        start_block = last_block + 1
+        continue
+
+      # Adds the page without the last block, which is fetched again in full with the next page
+      pages.append(page.slice(0, int(numpy.searchsorted(page.block_number, last_block, "left"))))
+
+      # Starts the next page from the last block
+      start_block = last_block
+
+    # Returns the new transactions
+    return TransactionBatch.join(pages), True
+
+
+  def load_shared(self, address: bytes) -> bool:
+    """Function to take the history of an address from the shared cache if another replica synced it more recently
+
+    Returns whether the shared cache holds a history at least as recent as this one (must be called with the address lock held).
+    """
+
+    # Gets the time and last block of the shared history
+    key = addresses.to_hex(address)
+    synced = cache.cache.get("history_synced", key, local=False)
+    if synced is None or synced["last_block"] < self.last_blocks.get(address, -1):
+      return False
+
+    # Checks if this replica already has every transaction of the shared history
+    if address in self.batches and synced["last_block"] == self.last_blocks.get(address, -1):
+      self.synced_at[address] = max(self.synced_at[address], synced["synced_at"])
+      return True
+
+    # Gets the shared history, checking it is the one the sync time was saved for
+    batch = cache.cache.get("history", key, local=False)
+    if batch is None or (int(batch.block_number[-1]) if len(batch) else -1) != synced["last_block"]:
+      return False
+
+    # Replaces the history with the shared one
+    self.batches[address] = batch
+    self.last_blocks[address] = synced["last_block"]
+    self.synced_at[address] = synced["synced_at"]
+    self.set_flag(self.incomplete, address, synced.get("incomplete", False))
+    self.set_flag(self.trimmed, address, synced.get("trimmed", False))
+    return True
+
+
+  def save_shared(self, address: bytes, changed: bool) -> None:
+    """Function to write the history of an address through to the shared cache, sending the columns only if they changed (must be called with the address lock held)"""
+
+    key = addresses.to_hex(address)
+
+    # Shares the history, which the store already keeps in memory, so it is only written to the shared tier
+    if changed:
+      cache.cache.set("history", key, self.batches[address], SHARED_HISTORY_TTL, local=False)
+
+    # Shares the time of the sync
+    cache.cache.set("history_synced", key, {
+      "synced_at": self.synced_at[address],
+      "last_block": self.last_blocks.get(address, -1),
+      "incomplete": address in self.incomplete,
+      "trimmed": address in self.trimmed
+    }, SHARED_HISTORY_TTL, local=False)
+
+
+  @staticmethod
+  def set_flag(flags: Set[bytes], address: bytes, value: bool) -> None:
+    """Function to add an address to a set of flags or remove it from it"""
+    if value:
+      flags.add(address)
+    else:
+      flags.discard(address)
+
+
+  def sync(self, address: str, force: bool = False) -> TransactionBatch:
+    """Function to fetch the transactions of an address since the last sync and return the full history"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Normalizes the address
+    address = addresses.normalize(address)
+
+    # Marks the history as used, so it is the last to be evicted
+    self.used_at[address] = time.time()
+
+    with self.get_lock(address):
+
+      # Returns the stored history if it was synced recently
+      if not force and address in self.batches and time.time() - self.synced_at[address] < SYNC_INTERVAL:
+        return self.batches[address]
+
+      # Gets the last block synced before this sync, so the listeners are only told about the transactions after it
+      previous_block = self.last_blocks.get(address, -1)
+
+      # Takes the history from the shared cache if another replica synced it more recently
+      shared = self.load_shared(address)
+
+      # Fetches the transactions after the last synced block, unless another replica has just synced them
+      if force or time.time() - self.synced_at.get(address, 0.0) >= SYNC_INTERVAL:
+        try:
+          fetched, complete = self.fetch_new_transactions(address, self.last_blocks.get(address, -1) + 1)
+
+        # Serves the stored history while Etherscan is down (there is nothing to serve if it was never synced)
+        except circuit_breaker.CircuitOpen:
+          if address not in self.batches:
+            raise
+
+          self.stale.add(address)
+
+        else:
+
+          # Marks the history as fresh again
+          self.stale.discard(address)
+
+          # Adds the new transactions to the history
+          batch = self.batches.get(address)
+          batch = fetched if batch is None else batch.concatenate(fetched)
+
+          # Drops the oldest transactions if the history is longer than the maximum
+          if len(batch) > MAX_HISTORY_ROWS:
+            batch = batch.slice(len(batch) - MAX_HISTORY_ROWS, len(batch))
+            self.trimmed.add(address)
+          self.batches[address] = batch
+
+          # Remembers if there are newer transactions left for the next sync
+          self.set_flag(self.incomplete, address, not complete)
+
+          # Saves the last synced block and the time of the sync
+          if len(fetched):
+            self.last_blocks[address] = int(fetched.block_number[-1])
+          self.synced_at[address] = time.time()
+
+          # Writes the history through to the shared cache for the other replicas
+          self.save_shared(address, len(fetched) > 0 or not shared)
+
+      # Gets the transactions added by this sync, whether they came from the shared cache or from Etherscan
+      batch = self.batches[address]
+      new_batch = batch.slice(int(numpy.searchsorted(batch.block_number, previous_block, "right")), len(batch))
+
+    # Tells the listeners about the new transactions
+    if len(new_batch):
+      for listener in self.listeners:
+        try:
+          listener(address, new_batch)
+
+        # Logs the error so that one listener does not stop the others
+        except Exception as e:
+          logging.error(e)
+
+    # Evicts the histories that have not been used for a while
+    self.evict()
+
+    # Returns the full history
+    return batch
+
+
+  def evict(self) -> None:
+    """Function to drop the histories not used within the time to live, and the least recently used ones past the maximum number of histories"""
+
+    now = time.time()
+
+    # Gets the time every history was last used (histories loaded from a snapshot count from their last sync)
+    used_at = {address: self.used_at.get(address, self.synced_at.get(address, 0.0)) for address in list(self.batches)}
+
+    # Gets the expired histories and the least recently used ones past the maximum
+    expired = {address for address, time_used in used_at.items() if now - time_used > STORED_HISTORY_TTL}
+    remaining = len(used_at) - len(expired)
+    if remaining > MAX_STORED_ADDRESSES:
+      expired.update(heapq.nsmallest(remaining - MAX_STORED_ADDRESSES, (address for address in used_at if address not in expired), key=used_at.get))
+
+    for address in expired:
+      lock = self.get_lock(address)
+
+      # Skips the histories being synced, which are evicted later if they are still unused
+      if not lock.acquire(blocking=False):
+        continue
+
+      try:
+        self.batches.pop(address, None)
+        self.last_blocks.pop(address, None)
+        self.synced_at.pop(address, None)
+        self.used_at.pop(address, None)
+        self.stale.discard(address)
+        self.incomplete.discard(address)
+        self.trimmed.discard(address)
+
+      finally:
+        lock.release()
+
+      # Tells the listeners so they drop what they built from the history
+      for listener in self.eviction_listeners:
+        try:
+          listener(address)
+
+        # Logs the error so that one listener does not stop the others
+        except Exception as e:
+          logging.error(e)
+
+
+  def truncation_note(self, address: str) -> Optional[str]:
+    """Function to get the note added to replies when the stored history of an address is not complete, or None if it is"""
+
+    # Normalizes the address
+    address = addresses.normalize(address)
+
+    # Gets the first and last stored blocks
+    batch = self.batches.get(address)
+    if batch is None or not len(batch) or (address not in self.incomplete and address not in self.trimmed):
+      return None
+
+    first_block, last_block = int(batch.block_number[0]), int(batch.block_number[-1])
+
+    # Returns the note
+    if address in self.incomplete:
+      return f"(partial history: only blocks {first_block} to {last_block} are loaded so far, the newer transactions are fetched on later requests)"
+    return f"(partial history: only the latest {len(batch)} transactions, from block {first_block}, are kept)"
+
+
+  def staleness(self, address: str) -> Optional[float]:
+    """Function to get the age in seconds of the history of an address if it is being served while Etherscan is down, or None if it is fresh"""
+
+    # Normalizes the address
+    address = addresses.normalize(address)
+
+    # Returns the time since the last successful sync if the history is stale
+    if address in self.stale:
+      return time.time() - self.synced_at[address]
+
+
+  def get(self, address: str) -> TransactionBatch:
+    """Function to get the full transaction history of an address, syncing it if needed"""
+    return self.sync(address)
+
+
+# The transaction store shared by both bots
+store = TransactionStore()
+
+# Encodes the histories in the shared cache as their compressed columns
+cache.cache.register_codec(b"B", TransactionBatch, TransactionBatch.to_bytes, TransactionBatch.from_bytes)
@@ -0,0 +1,97 @@
+# Module that parses txlist responses while they stream in, turning the rows into columns block by block
+
+import json, re
+from typing import Any, Callable, Dict, Iterable, List
+
+# Uses orjson to decode the rows if it is installed, as it is several times faster than the json module
+try:
+  from orjson import loads
+except ImportError:
+  loads = json.loads
+
+
+# The pattern of the start of the result value
+RESULT_PATTERN = re.compile(rb'"result"\s*:\s*')
+
+# The pattern of the end of the result array, which is the end of the last row followed by the closing bracket
+ARRAY_END_PATTERN = re.compile(rb"\}\s*\]")
+
+# The number of bytes of rows decoded and turned into columns at a time
+BYTES_PER_BLOCK = 1 << 20
+
+
+def parse_txlist(chunks: Iterable[bytes], make_columns: Callable[[List[Dict[str, str]]], Any], join: Callable[[List[Any]], Any]) -> Dict[str, Any]:
+  """Function to parse a streamed txlist response, with the result array turned into columns
+
+  Only the bytes of the rows not decoded yet and one block of decoded rows are held at a time. Each block is
+  turned into columns with make_columns, and the blocks are joined at the end with join. Error responses,
+  whose result is a message instead of an array, are returned as they are.
+  """
+
+  # Gets an iterator over the chunks
+  chunks = iter(chunks)
+
+  # The bytes read but not parsed yet
+  buffer = b""
+
+  # Reads until the start of the result value
+  for chunk in chunks:
+    buffer += chunk
+    match = RESULT_PATTERN.search(buffer)
+    if match and len(buffer) > match.end():
+      break
+
+  # Parses the whole response if it has no result value
+  else:
+    return loads(buffer) if buffer else {}
+
+  # Checks if the result is not an array, which is an error message small enough to parse at once
+  if buffer[match.end():match.end() + 1] != b"[":
+    return loads(buffer + b"".join(chunks))
+
+  # Parses the fields before the result (the status and the message) by closing the object early
+  response = loads(buffer[:match.end()] + b"null}")
+
+  # Keeps the bytes after the start of the array
+  buffer = buffer[match.end() + 1:]
+
+  # The blocks of columns, the complete rows waiting to be decoded and their size in bytes
+  blocks = []
+  rows: List[bytes] = []
+  size = 0
+
+  while True:
+
+    # Checks if the end of the array has been read, either after rows in the buffer (rows never contain braces, so the
+    # first match ends the last row) or at the start of the buffer, which always starts right after the last row taken
+    match = ARRAY_END_PATTERN.search(buffer)
+    done = match is not None or buffer.lstrip().startswith(b"]")
+
+    # Gets the end of the complete rows, leaving the row that is cut off by the end of the chunk
+    end = match.start() + 1 if match else 0 if done else buffer.rfind(b"}") + 1
+
+    # Moves the complete rows out of the buffer
+    if end:
+      rows.append(buffer[:end])
+      size += end
+      buffer = buffer[end:]
+
+    # Decodes the rows into a block of columns once there are enough of them, or at the end of the array
+    if rows and (size >= BYTES_PER_BLOCK or done):
+      blocks.append(make_columns(loads(b"[" + b"".join(rows).lstrip(b", \t\r\n") + b"]")))
+      rows = []
+      size = 0
+
+    # Stops at the end of the array
+    if done:
+      break
+
+    # Reads the next chunk
+    chunk = next(chunks, None)
+    if chunk is None:
+      raise ValueError("The txlist response ended before the end of the result array")
+    buffer += chunk
+
+  # Returns the response with the joined columns as the result
+  response["result"] = join(blocks)
+  return response
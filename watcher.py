@@ -0,0 +1,428 @@
+# Module that watches wallets for new transactions and notifies the chats subscribed to them
+
+import os, heapq, logging, threading, time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import etherscan_api
+from etherscan_api import Transaction
+from rate_limiter import TokenBucket
+
+
+# The number of Etherscan requests per second the watcher is allowed to use (the rest is left for commands)
+WATCH_REQUESTS_PER_SECOND = float(os.environ.get("WATCH_REQUESTS_PER_SECOND", 2))
+
+# The shortest and longest number of seconds between polls of an address
+MIN_INTERVAL = 30.0
+MAX_INTERVAL = 3600.0
+
+# The number of seconds addresses can be polled early so that they share a balancemulti request
+GROUPING_WINDOW = 15.0
+
+# The maximum number of new transactions fetched for an address in one poll
+MAX_NEW_TRANSACTIONS = 100
+
+# The number of polls with an unchanged balance after which the transactions are fetched anyway, as transactions that
+# leave the balance unchanged (calls without value, transfers that cancel out) are not seen in the balance
+FULL_CHECK_POLLS = int(os.environ.get("WATCH_FULL_CHECK_POLLS", 5))
+
+# The minimum number of seconds between two saves of the changed addresses to the database
+SAVE_INTERVAL = float(os.environ.get("WATCH_SAVE_INTERVAL", 30))
+
+# The prefix of the database key of every watched address
+DB_PREFIX = "watch:"
+
+# The type of a subscriber, which is the platform name and the chat or channel ID
+Subscriber = Tuple[str, str]
+
+
+class WatchedAddress:
+  """Class that represents the polling state of a watched address"""
+
+  def __init__(self, address: str, last_seen_block: int) -> None:
+
+    # The lowercased address
+    self.address = address
+
+    # The block of the latest transaction already notified
+    self.last_seen_block = last_seen_block
+
+    # The exact balance in wei at the last poll
+    self.last_balance: Optional[int] = None
+
+    # The number of polls in a row that skipped fetching the transactions because the balance was unchanged
+    self.unchanged_polls = 0
+
+    # The number of seconds until the next poll, which adapts to the activity of the wallet
+    self.interval = MIN_INTERVAL
+
+    # The time of the next poll
+    self.next_poll = time.time()
+
+    # The chats and channels subscribed to the address
+    self.subscribers: Set[Subscriber] = set()
+
+
+class Watcher:
+  """Class that polls the watched addresses in the background and sends alerts for new transactions"""
+
+  def __init__(self) -> None:
+
+    # The dictionary that maps the lowercased address to its state
+    self.watched: Dict[str, WatchedAddress] = {}
+
+    # The heap of (time of the next poll, address) used to find the addresses that are due
+    self.schedule: List[Tuple[float, str]] = []
+
+    # The dictionary that maps the platform name to the function that sends an alert to a chat
+    self.notifiers: Dict[str, Callable[[str, str, List[Transaction]], None]] = {}
+
+    # The rate limiter for the watcher's share of the Etherscan budget
+    self.limiter = TokenBucket(WATCH_REQUESTS_PER_SECOND, WATCH_REQUESTS_PER_SECOND)
+
+    # The lock protecting the watched addresses and the schedule
+    self.lock = threading.Lock()
+
+    # The event used to wake the scheduler up when an address is added
+    self.wake_up = threading.Event()
+
+    # The addresses whose subscribers or last seen block changed since the last save
+    self.dirty: Set[str] = set()
+
+    # The time of the last save
+    self.saved_at = 0.0
+
+    # The scheduler thread
+    self.thread: Optional[threading.Thread] = None
+
+
+  def add_notifier(self, platform: str, notifier: Callable[[str, str, List[Transaction]], None]) -> None:
+    """Function to register the function that sends alerts to the chats of a platform"""
+    self.notifiers[platform] = notifier
+
+
+  def subscribe(self, address: str, platform: str, chat_id: str) -> None:
+    """Function to subscribe a chat to the new transactions of an address"""
+
+    # Normalizes the address
+    address = address.lower()
+
+    with self.lock:
+      watched_address = self.watched.get(address)
+
+    # Checks if the address is not watched yet
+    if watched_address is None:
+
+      # Gets the latest transaction so that only transactions after the subscription are sent
+      latest = etherscan_api.get_normal_transactions(address, 1)
+
+      # Creates the state of the address, starting after the latest block
+      new_address = WatchedAddress(address, int(latest[0].blockNumber) if latest else 0)
+
+      with self.lock:
+
+        # Adds the address unless another chat added it in the meantime
+        watched_address = self.watched.setdefault(address, new_address)
+
+        # Schedules the first poll if the address was added
+        if watched_address is new_address:
+          heapq.heappush(self.schedule, (watched_address.next_poll, address))
+
+      # Wakes the scheduler up
+      self.wake_up.set()
+
+    with self.lock:
+
+      # Adds the subscriber to the address
+      watched_address.subscribers.add((platform, str(chat_id)))
+      self.dirty.add(address)
+
+    # Saves the subscriptions to the database
+    self.save()
+
+
+  def unsubscribe(self, address: str, platform: str, chat_id: str) -> bool:
+    """Function to unsubscribe a chat from an address, returning False if it was not subscribed"""
+
+    # Normalizes the address
+    address = address.lower()
+
+    with self.lock:
+      watched_address = self.watched.get(address)
+
+      # Checks if the chat is not subscribed to the address
+      if watched_address is None or (platform, str(chat_id)) not in watched_address.subscribers:
+        return False
+
+      # Removes the subscriber
+      watched_address.subscribers.discard((platform, str(chat_id)))
+      self.dirty.add(address)
+
+      # Stops watching the address if no one is subscribed (its entry in the schedule is skipped later)
+      if not watched_address.subscribers:
+        del self.watched[address]
+
+    # Saves the subscriptions to the database
+    self.save()
+
+    # Returns True as the chat was unsubscribed
+    return True
+
+
+  def subscriptions(self, platform: str, chat_id: str) -> List[str]:
+    """Function to get the list of addresses a chat is subscribed to"""
+
+    with self.lock:
+      return [address for address, watched_address in self.watched.items() if (platform, str(chat_id)) in watched_address.subscribers]
+
+
+  def save(self) -> None:
+    """Function to save the addresses whose subscribers or last seen block changed, one database key per address"""
+
+    with self.lock:
+
+      # Takes the changed addresses with their state, or None for the addresses no longer watched
+      changed = {address: self.watched.get(address) for address in self.dirty}
+      self.dirty.clear()
+      self.saved_at = time.time()
+
+      saved = {
+        address: None if watched_address is None else {
+          "last_seen_block": watched_address.last_seen_block,
+          "subscribers": [f"{platform} {chat_id}" for platform, chat_id in watched_address.subscribers]
+        }
+        for address, watched_address in changed.items()
+      }
+
+    try:
+
+      # Imports the database here because connecting to it slows down startup
+      from replit import db
+
+      # Writes the changed addresses and deletes the ones no longer watched
+      for address, value in saved.items():
+        if value is not None:
+          db[DB_PREFIX + address] = value
+        elif DB_PREFIX + address in db:
+          del db[DB_PREFIX + address]
+
+    # Logs the error and keeps the addresses to save them again next time, as the watcher still works without the database
+    except Exception as e:
+      logging.error(e)
+      with self.lock:
+        self.dirty.update(saved)
+
+
+  def load(self) -> None:
+    """Function to load the subscriptions from the database"""
+
+    try:
+
+      # Imports the database here because connecting to it slows down startup
+      from replit import db
+
+      # Gets the saved addresses
+      saved_watches = {key[len(DB_PREFIX):]: db[key] for key in db.prefix(DB_PREFIX)}
+
+      # Moves the subscriptions saved under one key by earlier versions to a key per address
+      if "watches" in db:
+        for address, saved in db["watches"].items():
+          saved_watches.setdefault(address, saved)
+          db[DB_PREFIX + address] = saved
+        del db["watches"]
+
+    # Logs the error and starts with no subscriptions
+    except Exception as e:
+      logging.error(e)
+      return
+
+    with self.lock:
+
+      # Iterates the saved addresses
+      for address, saved in saved_watches.items():
+
+        # Creates the state of the address
+        watched_address = WatchedAddress(address, int(saved["last_seen_block"]))
+
+        # Adds the subscribers
+        watched_address.subscribers = {tuple(subscriber.split(" ", 1)) for subscriber in saved["subscribers"]}
+
+        # Adds the address and schedules its first poll
+        self.watched[address] = watched_address
+        heapq.heappush(self.schedule, (watched_address.next_poll, address))
+
+
+  def take_due_addresses(self) -> List[WatchedAddress]:
+    """Function to take the addresses due within the grouping window off the schedule"""
+
+    # The list of addresses to poll
+    due: List[WatchedAddress] = []
+
+    # Gets the time up to which addresses are polled together
+    deadline = time.time() + GROUPING_WINDOW
+
+    with self.lock:
+
+      # Takes every address due before the deadline
+      while self.schedule and self.schedule[0][0] <= deadline:
+        next_poll, address = heapq.heappop(self.schedule)
+
+        # Gets the state of the address
+        watched_address = self.watched.get(address)
+
+        # Skips entries of unwatched addresses and old entries of rescheduled ones
+        if watched_address is None or watched_address.next_poll != next_poll:
+          continue
+
+        due.append(watched_address)
+
+    # Returns the list of due addresses
+    return due
+
+
+  def reschedule(self, watched_address: WatchedAddress, active: bool) -> None:
+    """Function to schedule the next poll of an address, polling active wallets more often"""
+
+    # Halves the interval if the wallet had new activity, otherwise increases it
+    if active:
+      watched_address.interval = max(MIN_INTERVAL, watched_address.interval / 2)
+    else:
+      watched_address.interval = min(MAX_INTERVAL, watched_address.interval * 1.5)
+
+    # Sets the time of the next poll
+    watched_address.next_poll = time.time() + watched_address.interval
+
+    with self.lock:
+
+      # Schedules the address again if it is still watched
+      if watched_address.address in self.watched:
+        heapq.heappush(self.schedule, (watched_address.next_poll, watched_address.address))
+
+
+  def poll_group(self, group: List[WatchedAddress]) -> None:
+    """Function to poll a group of at most 20 addresses with one balancemulti request"""
+
+    # Gets the exact balances of the addresses in one request
+    self.limiter.acquire()
+    balances = etherscan_api.get_wei_balances([watched_address.address for watched_address in group])
+
+    # Iterates the addresses in the group
+    for watched_address in group:
+
+      # Gets the balance of the address
+      balance = balances.get(watched_address.address)
+
+      # Skips fetching the transactions if the balance has not changed, except every few polls, which finds the
+      # transactions that leave the balance unchanged
+      if watched_address.last_balance is not None and balance == watched_address.last_balance and watched_address.unchanged_polls + 1 < FULL_CHECK_POLLS:
+        watched_address.unchanged_polls += 1
+        self.reschedule(watched_address, False)
+        continue
+      watched_address.unchanged_polls = 0
+
+      # Fetches only the transactions after the last seen block
+      self.limiter.acquire()
+      transactions = etherscan_api.get_normal_transactions(watched_address.address, MAX_NEW_TRANSACTIONS, watched_address.last_seen_block + 1, "asc") or []
+
+      # Saves the balance, unless the page was full and there are more transactions to fetch at the next poll
+      watched_address.last_balance = balance if len(transactions) < MAX_NEW_TRANSACTIONS else None
+
+      # Checks if there are new transactions
+      if transactions:
+
+        # Moves the last seen block to the latest transaction
+        watched_address.last_seen_block = max(int(transaction.blockNumber) for transaction in transactions)
+        with self.lock:
+          self.dirty.add(watched_address.address)
+
+        # Sends the alerts to the subscribers
+        self.notify(watched_address, transactions)
+
+      # Schedules the next poll
+      self.reschedule(watched_address, bool(transactions))
+
+
+  def notify(self, watched_address: WatchedAddress, transactions: List[Transaction]) -> None:
+    """Function to send the new transactions to every subscriber of the address"""
+
+    with self.lock:
+      subscribers = list(watched_address.subscribers)
+
+    # Iterates the subscribers
+    for platform, chat_id in subscribers:
+
+      # Gets the notifier of the platform
+      notifier = self.notifiers.get(platform)
+
+      # Checks if there is a notifier for the platform
+      if notifier is not None:
+        try:
+
+          # Sends the alert
+          notifier(chat_id, watched_address.address, transactions)
+
+        # Logs the error so that one chat does not stop the other alerts
+        except Exception as e:
+          logging.error(e)
+
+
+  def run(self) -> None:
+    """Function to poll the due addresses forever"""
+
+    while True:
+      try:
+
+        # Gets the addresses that are due
+        due = self.take_due_addresses()
+
+        # Polls the due addresses in groups of the balancemulti size
+        for start in range(0, len(due), etherscan_api.MAX_BALANCEMULTI_ADDRESSES):
+
+          # Gets the group of addresses
+          group = due[start : start + etherscan_api.MAX_BALANCEMULTI_ADDRESSES]
+
+          try:
+            self.poll_group(group)
+
+          # Logs the error and schedules the group again so the addresses are not lost
+          except Exception as e:
+            logging.error(e)
+
+            for watched_address in group:
+              self.reschedule(watched_address, False)
+
+        # Saves the changed addresses, at most once every save interval
+        if self.dirty and time.time() - self.saved_at >= SAVE_INTERVAL:
+          self.save()
+
+      # Logs the error and keeps the scheduler running
+      except Exception as e:
+        logging.error(e)
+
+      with self.lock:
+
+        # Gets the number of seconds until the next address is due, waking up in time to save the changed addresses
+        sleep_time = self.schedule[0][0] - time.time() if self.schedule else MAX_INTERVAL
+        if self.dirty:
+          sleep_time = min(sleep_time, self.saved_at + SAVE_INTERVAL - time.time())
+
+      # Waits until the next address is due or a new address is added
+      self.wake_up.wait(max(0.0, sleep_time))
+      self.wake_up.clear()
+
+
+  def start(self) -> None:
+    """Function to load the subscriptions and start the scheduler thread"""
+
+    # Checks if the scheduler is already running
+    if self.thread is not None:
+      return
+
+    # Loads the subscriptions from the database
+    self.load()
+
+    # Starts the scheduler thread
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+
+# The watcher shared by both bots
+watcher = Watcher()
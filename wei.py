@@ -0,0 +1,199 @@
+# Module for exact vectorized arithmetic on wei amounts, which can be bigger than 2^64
+
+from typing import Iterable, List, Union
+
+
+# The number of bits in each limb
+LIMB_BITS = 32
+
+# The mask of one limb
+LIMB_MASK = (1 << LIMB_BITS) - 1
+
+# The number of limbs used for Ether values (128 bits, far more than the total supply of Ether)
+ETHER_LIMBS = 4
+
+# The number of limbs used for token amounts (256 bits, the largest amount a token contract can hold)
+TOKEN_LIMBS = 8
+
+# The number of wei in one Ether
+WEI_PER_ETHER = 10**18
+
+
+class WeiArray:
+  """Class that represents an array of wei amounts split into 32-bit limbs stored in int64 arrays
+
+  Each limb is less than 2^32, so the limbs of up to 2^31 rows can be summed in int64 without overflowing,
+  and sums, signed nets and cumulative sums stay exact. Carries between limbs are only resolved when the
+  result is turned back into python integers or Ether floats.
+  """
+
+  def __init__(self, limbs) -> None:
+
+    # The int64 array of shape (number of limbs, number of rows), least significant limb first
+    self.limbs = limbs
+
+
+  @classmethod
+  def from_values(cls, values: Iterable[Union[int, str]], number_of_limbs: int = ETHER_LIMBS) -> "WeiArray":
+    """Function to create the array from python integers or decimal strings"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Parses the values into python integers (the only step done one row at a time)
+    integers = numpy.array([int(value) for value in values], dtype=object)
+
+    # Checks if any value does not fit in the limbs
+    if len(integers) and (integers.max() >> (LIMB_BITS * number_of_limbs) or integers.min() < 0):
+      raise OverflowError(f"Wei amounts must be between 0 and 2^{LIMB_BITS * number_of_limbs}")
+
+    # Splits the values into limbs
+    limbs = numpy.empty((number_of_limbs, len(integers)), dtype=numpy.int64)
+    for i in range(number_of_limbs):
+      limbs[i] = ((integers >> (LIMB_BITS * i)) & LIMB_MASK).astype(numpy.int64)
+
+    # Returns the array
+    return cls(limbs)
+
+
+  @classmethod
+  def from_product(cls, small, large) -> "WeiArray":
+    """Function to create the array from the products of a uint64 array below 2^32 and a uint64 array (like gasUsed x gasPrice)"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Gets the arrays as unsigned integers
+    small = numpy.asarray(small, dtype=numpy.uint64)
+    large = numpy.asarray(large, dtype=numpy.uint64)
+
+    # Multiplies the small values by the two halves of the large values (each product is below 2^64)
+    low_product = small * (large & numpy.uint64(LIMB_MASK))
+    high_product = small * (large >> numpy.uint64(LIMB_BITS)) + (low_product >> numpy.uint64(LIMB_BITS))
+
+    # Returns the limbs of the products
+    return cls(numpy.stack((
+      (low_product & numpy.uint64(LIMB_MASK)).astype(numpy.int64),
+      (high_product & numpy.uint64(LIMB_MASK)).astype(numpy.int64),
+      (high_product >> numpy.uint64(LIMB_BITS)).astype(numpy.int64),
+      numpy.zeros(len(small), dtype=numpy.int64)
+    )))
+
+
+  @classmethod
+  def zeros(cls, length: int, number_of_limbs: int = ETHER_LIMBS) -> "WeiArray":
+    """Function to create an array of zeros"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    return cls(numpy.zeros((number_of_limbs, length), dtype=numpy.int64))
+
+
+  def __len__(self) -> int:
+    return self.limbs.shape[1]
+
+
+  def __getitem__(self, index) -> "WeiArray":
+    """Function to get the rows at an index, slice, mask or array of indices as a new array"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Keeps a single row as an array of one row
+    if isinstance(index, (int, numpy.integer)):
+      index = slice(index, index + 1 if index != -1 else None)
+
+    return WeiArray(self.limbs[:, index])
+
+
+  def concatenate(self, other: "WeiArray") -> "WeiArray":
+    """Function to create an array with the rows of this array followed by the other array"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    return WeiArray(numpy.concatenate((self.limbs, other.limbs), axis=1))
+
+
+  def where(self, mask) -> "WeiArray":
+    """Function to get the array with the rows outside the mask set to 0"""
+    return WeiArray(self.limbs * mask)
+
+
+  def signed(self, signs) -> "WeiArray":
+    """Function to multiply every row by its sign (-1, 0 or 1) to get signed amounts"""
+    return WeiArray(self.limbs * signs)
+
+
+  def __add__(self, other: "WeiArray") -> "WeiArray":
+    return WeiArray(self.limbs + other.limbs)
+
+
+  def __sub__(self, other: "WeiArray") -> "WeiArray":
+    return WeiArray(self.limbs - other.limbs)
+
+
+  def cumsum(self) -> "WeiArray":
+    """Function to get the cumulative sums, starting with 0 so the sum of rows i to j is cum[j] - cum[i]"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Returns the cumulative sums of every limb with a column of zeros in front
+    return WeiArray(numpy.concatenate((numpy.zeros((self.limbs.shape[0], 1), dtype=numpy.int64), numpy.cumsum(self.limbs, axis=1)), axis=1))
+
+
+  def limb_weights(self):
+    """Function to get 2^(32 x i) for every limb as floats"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    return numpy.ldexp(1.0, numpy.arange(self.limbs.shape[0]) * LIMB_BITS)
+
+
+  def to_float(self):
+    """Function to get the amounts as a float64 array of wei"""
+    return self.limb_weights() @ self.limbs.astype(float)
+
+
+  def to_ether(self):
+    """Function to get the amounts as a float64 array of Ether"""
+    return self.to_float() / WEI_PER_ETHER
+
+
+  def to_int(self, row: int) -> int:
+    """Function to get the exact amount of one row as a python integer"""
+    return sum(int(limb) << (LIMB_BITS * i) for i, limb in enumerate(self.limbs[:, row]))
+
+
+  def to_ints(self) -> List[int]:
+    """Function to get the exact amounts of every row as python integers"""
+
+    # Adds the shifted limbs of every row as python integers, one limb at a time across all the rows
+    amounts = self.limbs[0].astype(object)
+    for i in range(1, self.limbs.shape[0]):
+      amounts = amounts + (self.limbs[i].astype(object) << (LIMB_BITS * i))
+
+    return amounts.tolist()
+
+
+  def sum(self) -> int:
+    """Function to get the exact sum of every row as a python integer"""
+    return sum(int(limb_sum) << (LIMB_BITS * i) for i, limb_sum in enumerate(self.limbs.sum(axis=1)))
+
+
+  def group_sums(self, groups, number_of_groups: int) -> "WeiArray":
+    """Function to get the exact sum of the rows in each group, where groups gives the group of every row"""
+
+    # Imports numpy here because it is slow to import
+    import numpy
+
+    # Adds every row to its group, limb by limb (add.at keeps int64, so the sums stay exact)
+    sums = numpy.zeros((self.limbs.shape[0], number_of_groups), dtype=numpy.int64)
+    for i in range(self.limbs.shape[0]):
+      numpy.add.at(sums[i], groups, self.limbs[i])
+
+    # Returns the sums
+    return WeiArray(sums)